@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+import torch
+
+from visual_nav.utils.evaluation import evaluate
+
+
+class CoinEnv(object):
+    def __init__(self):
+        """ Environment whose episodes end after one step, in success if a random draw is above one half """
+        self.unwrapped = self
+        self.scenario = None
+        self.time = 0
+
+    def reset(self):
+        self.time = 0
+        return None
+
+    def step(self, action):
+        self.time = 1
+        return None, 0, True, 'Success' if np.random.uniform() > 0.5 else 'Collision'
+
+
+class RandomPolicy(object):
+    def reset(self):
+        pass
+
+    def act(self, env, obs):
+        return random.randint(0, 3) + int(torch.randint(0, 4, (1,)))
+
+
+def test_evaluate_is_seeded_and_keeps_caller_random_state():
+    random.seed(1)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    results = evaluate(None, None, 8, seed=3, env=CoinEnv(), policy=RandomPolicy())
+    after = random.random(), np.random.uniform(), float(torch.rand(1))
+
+    random.seed(1)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    assert after == (random.random(), np.random.uniform(), float(torch.rand(1)))
+    assert evaluate(None, None, 8, seed=3, env=CoinEnv(), policy=RandomPolicy()) == results
+
+
+def test_evaluate_does_not_leave_scenario_replayed():
+    env = CoinEnv()
+    evaluate(None, None, 2, env=env, policy=RandomPolicy(), scenarios=['a', 'b'])
+    assert env.scenario is None
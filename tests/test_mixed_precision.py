@@ -0,0 +1,74 @@
+"""
+    Regression test of bfloat16 autocast: training and evaluating on a small fixed synthetic dataset with
+    autocast must reach the accuracy of float32
+"""
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from visual_nav.utils.models import model_factory
+from visual_nav.utils.torch_utils import autocast, inference_mode
+
+NUM_CLASSES = 4
+NUM_ACTIONS = 16
+TOLERANCE = 0.05
+
+pytestmark = pytest.mark.skipif(not hasattr(torch, 'autocast'), reason='autocast is not supported by this torch')
+
+
+def synthetic_dataset(num_samples, seed):
+    """ Noisy depth images whose action is given by the column of a bright vertical bar """
+    rng = np.random.RandomState(seed)
+    actions = rng.randint(NUM_CLASSES, size=num_samples)
+    frames = rng.randint(0, 64, (num_samples, 1, 84, 84)).astype(np.float32)
+    for frame, action in zip(frames, actions):
+        frame[:, :, action * 20 + 4:action * 20 + 16] += 160
+    goals = rng.uniform(-1, 1, (num_samples, 1, 2)).astype(np.float32)
+    return torch.from_numpy(frames / 255.0), torch.from_numpy(goals), torch.from_numpy(actions).long()
+
+
+def accuracy(model, frames, goals, actions, mixed_precision):
+    device = torch.device('cpu')
+    model.train(False)
+    with inference_mode(), autocast(device, mixed_precision):
+        predicted_actions = model(frames, goals).float()
+    return (predicted_actions.max(1)[1] == actions).float().mean().item()
+
+
+def train(mixed_precision, frames, goals, actions, num_epochs=4, batch_size=32):
+    """ Train a model from a fixed initialization with the forward pass autocast like Trainer """
+    device = torch.device('cpu')
+    torch.manual_seed(0)
+    model = model_factory['plain_cnn'](1, NUM_ACTIONS)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    criterion = nn.CrossEntropyLoss()
+    generator = torch.Generator().manual_seed(0)
+    model.train(True)
+    for _ in range(num_epochs):
+        for idxes in torch.randperm(len(actions), generator=generator).split(batch_size):
+            with autocast(device, mixed_precision):
+                predicted_actions = model(frames[idxes], goals[idxes]).float()
+            loss = criterion(predicted_actions, actions[idxes])
+            assert torch.isfinite(loss)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    return model
+
+
+def test_bfloat16_training_matches_float32_accuracy():
+    train_set = synthetic_dataset(256, seed=1)
+    test_set = synthetic_dataset(128, seed=2)
+    fp32_acc = accuracy(train(False, *train_set), *test_set, mixed_precision=False)
+    bf16_acc = accuracy(train(True, *train_set), *test_set, mixed_precision=True)
+    assert fp32_acc > 0.9
+    assert abs(bf16_acc - fp32_acc) <= TOLERANCE
+
+
+def test_bfloat16_evaluation_matches_float32_accuracy():
+    model = train(False, *synthetic_dataset(256, seed=1))
+    test_set = synthetic_dataset(128, seed=2)
+    fp32_acc = accuracy(model, *test_set, mixed_precision=False)
+    bf16_acc = accuracy(model, *test_set, mixed_precision=True)
+    assert abs(bf16_acc - fp32_acc) <= TOLERANCE
@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+import numpy as np
+
+from visual_nav.utils.replay_buffer import ReplayBuffer
+
+Observation = namedtuple('Observation', ['image', 'goal'])
+IMAGE_SIZE = (84, 84, 1)
+
+
+def fill(replay_buffer, episode_lengths):
+    for episode_length in episode_lengths:
+        for t in range(episode_length):
+            image = np.full(IMAGE_SIZE, t, dtype=np.uint8)
+            idx = replay_buffer.store_observation(Observation(image, (t, 0)))
+            replay_buffer.store_effect(idx, 0, 1, t == episode_length - 1)
+
+
+def test_n_step_transitions_stay_in_their_episode():
+    replay_buffer = ReplayBuffer(1000, 1, IMAGE_SIZE, n_step=3, gamma=0.5)
+    fill(replay_buffer, [5])
+    idxes = np.arange(5)
+    np.testing.assert_array_equal(replay_buffer.n_step_offset[idxes], [3, 3, 2, 1, 0])
+    np.testing.assert_array_equal(replay_buffer.n_step_done[idxes], [0, 0, 1, 1, 1])
+    np.testing.assert_allclose(replay_buffer.n_step_return[idxes], [1.75, 1.75, 1.75, 1.5, 1])
+
+    _, goals, _, rewards, _, next_goals, done_mask, discounts = replay_buffer._encode_sample(idxes,
+                                                                                              with_discount=True)
+    # goals hold the step of each frame in the episode, the last frame bootstraps from itself
+    np.testing.assert_array_equal(next_goals[:, -1, 0], [3, 4, 4, 4, 4])
+    np.testing.assert_allclose(discounts, [0.125, 0.125, 0.25, 0.5, 1])
+
+
+def test_sample_growable_buffer_with_episode_ending_at_capacity():
+    replay_buffer = ReplayBuffer(1000, 4, IMAGE_SIZE, n_step=3, gamma=0.9, growable=True, grow_size=64)
+    fill(replay_buffer, [20, 30, 14])
+    assert len(replay_buffer.action) == 64 and replay_buffer.num_in_buffer == 64
+
+    for _ in range(20):
+        frames, goals, _, _, next_frames, next_goals, done_mask, _ = replay_buffer.sample(32, with_discount=True)
+        assert frames.shape == next_frames.shape == (32, 4, 84, 84)
+        assert goals.shape == next_goals.shape == (32, 4, 2)
+        # next observations are n steps later or the last frame of the episode
+        steps, next_steps = goals[:, -1, 0], next_goals[:, -1, 0]
+        assert np.all((next_steps == steps + 3) | ((done_mask == 1) & (next_steps >= steps)))
+
+
+def test_sharded_frames_match_in_memory_frames(tmpdir):
+    in_memory = ReplayBuffer(100, 4, IMAGE_SIZE)
+    sharded = ReplayBuffer(100, 4, IMAGE_SIZE, storage_dir=str(tmpdir), segment_size=16, cache_segments=2)
+    # the buffers wrap around, so that segments written to disk are written again
+    fill(in_memory, [30, 50, 40])
+    fill(sharded, [30, 50, 40])
+    for idx in range(100):
+        np.testing.assert_array_equal(sharded.encode_observation(idx)[0], in_memory.encode_observation(idx)[0])
+    # segments other than the one being written are memory-mapped instead of read whole
+    assert isinstance(sharded.frames._segment(0), np.memmap)
+    assert not isinstance(sharded.frames.hot_segment, np.memmap)
+    # frames are stored as uint8 and read back as float32
+    assert sharded.frames._segment(0).dtype == np.uint8
+    assert sharded.frames[0].dtype == sharded.frames[0:20].dtype == np.float32
+
+
+def test_sharded_snapshot_keeps_frames_overwritten_after_it(tmpdir):
+    storage_dir, checkpoint_dir = str(tmpdir.join('storage')), str(tmpdir.join('checkpoint'))
+    replay_buffer = ReplayBuffer(100, 4, IMAGE_SIZE, storage_dir=storage_dir, segment_size=16, cache_segments=2)
+    fill(replay_buffer, [30, 50])
+    frames = replay_buffer.frames[0:100].copy()
+    ReplayBuffer.write_snapshot(replay_buffer.snapshot(), checkpoint_dir)
+    # the buffer wraps around, so that segments of the snapshot are written again
+    fill(replay_buffer, [40, 45])
+
+    restored = ReplayBuffer(100, 4, IMAGE_SIZE, storage_dir=storage_dir, segment_size=16, cache_segments=2)
+    restored.restore(checkpoint_dir)
+    assert restored.num_stored == 80
+    np.testing.assert_array_equal(restored.frames[0:100], frames)
@@ -0,0 +1,20 @@
+import json
+import os
+
+from visual_nav.utils.run_logs import summarize_run, METRICS_FILE
+
+
+def test_cached_summary_moves_past_malformed_records(tmpdir):
+    metrics_file = str(tmpdir.join(METRICS_FILE))
+    with open(metrics_file, 'w') as fo:
+        fo.write(json.dumps({'kind': 'evaluation', 'success_rate': 0.5}) + '\n')
+        fo.write('{"kind": "evaluation", \n')
+    summary = summarize_run(str(tmpdir))
+    assert summary['offset'] == os.path.getsize(metrics_file)
+    assert summary['evaluation']['success_rate'] == 0.5
+
+    with open(metrics_file, 'a') as fo:
+        fo.write(json.dumps({'kind': 'evaluation', 'success_rate': 0.75}) + '\n')
+    summary = summarize_run(str(tmpdir), summary)
+    assert summary['offset'] == os.path.getsize(metrics_file)
+    assert summary['evaluation']['success_rate'] == 0.75
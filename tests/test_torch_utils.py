@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from visual_nav.utils.torch_utils import CompiledModel, update_target_model
+
+
+def fail(*args):
+    raise RuntimeError('out of memory')
+
+
+def test_compiled_model_falls_back_to_eager_if_the_first_pass_fails():
+    model = torch.nn.Linear(2, 2)
+    compiled_model = CompiledModel(model, fail)
+    frames = torch.zeros(1, 2)
+    assert torch.equal(compiled_model(frames), model(frames))
+    assert compiled_model.compiled is None
+
+
+def test_compiled_model_raises_errors_of_later_passes():
+    model = torch.nn.Linear(2, 2)
+    compiled_model = CompiledModel(model, model)
+    compiled_model(torch.zeros(1, 2))
+    compiled_model.compiled = fail
+    with pytest.raises(RuntimeError):
+        compiled_model(torch.zeros(1, 2))
+    assert compiled_model.compiled is fail
+
+
+@pytest.mark.parametrize('tau', [0, -0.5, 1.5])
+def test_update_target_model_rejects_tau_outside_unit_interval(tau):
+    with pytest.raises(ValueError):
+        update_target_model(torch.nn.Linear(2, 2), torch.nn.Linear(2, 2), tau)
+
+
+def test_update_target_model_averages_parameters():
+    target_model, model = torch.nn.Linear(2, 2), torch.nn.Linear(2, 2)
+    expected = 0.25 * model.weight.detach() + 0.75 * target_model.weight.detach()
+    update_target_model(target_model, model, 0.25)
+    assert torch.allclose(target_model.weight, expected)
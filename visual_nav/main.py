@@ -1,4 +1,5 @@
 import sys
+import functools
 from collections import namedtuple
 import time
 import copy
@@ -6,11 +7,8 @@ import random
 import logging
 import os
 import argparse
-import shutil
 import pprint
-import configparser
 
-import git
 import gym
 import gym.spaces
 import numpy as np
@@ -19,17 +17,21 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.optim import lr_scheduler
 from torch.utils.data.dataloader import DataLoader
-from tensorboardX import SummaryWriter
-import matplotlib.pyplot as plt
-
-from crowd_sim.envs.utils.action import ActionXY
-from crowd_nav.policy.sarl import SARL
-from visual_sim.envs.visual_sim import VisualSim
-from visual_nav.utils.replay_buffer import ReplayBuffer, BufferWrapper, pack_batch
-from visual_nav.utils.my_monitor import MyMonitor
+
+from visual_nav.utils.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, BufferWrapper, pack_batch
+from visual_nav.utils.frame_history import FrameHistory
+from visual_nav.utils.evaluation import QNetworkPolicy, evaluate, summarize, format_summary, make_env, load_sarl
+from visual_nav.utils.scenarios import get_scenarios
+from visual_nav.utils.metrics import MetricsLogger
+from visual_nav.utils.checkpoint import CheckpointWriter
+from visual_nav.utils.file_utils import OVERWRITE_POLICIES, prepare_dir, file_lock
+from visual_nav.utils.run_logs import RunRecorder
+from visual_nav.utils.profiling import profiler, ProfileCapture
+from visual_nav.utils.episode_monitor import EpisodeMonitor
 from visual_nav.utils.schedule import LinearSchedule, ConstantSchedule
-from visual_nav.utils.heatmap import heatmap
-from visual_nav.utils.models import model_factory
+from visual_nav.utils.models import model_factory, GDNet
+from visual_nav.utils.torch_utils import accelerate_model, autocast, inference_mode, to_channels_last, \
+    update_target_model, load_checkpoint
 
 
 """
@@ -38,6 +40,7 @@ from visual_nav.utils.models import model_factory
         kwargs: {Dict} arguments for constructing optimizer
 """
 OptimizerSpec = namedtuple("OptimizerSpec", ["constructor", "kwargs"])
+TRAINING_STATE_FILE = 'training_state.pth'
 
 
 class Trainer(object):
@@ -51,7 +54,18 @@ class Trainer(object):
                  gamma=0.9,
                  frame_history_len=4,
                  target_update_freq=10000,
-                 num_test_case=100
+                 target_update_tau=1.0,
+                 double_q=False,
+                 n_step=1,
+                 replay_storage_dir=None,
+                 prioritized_replay=False,
+                 prioritized_replay_alpha=0.6,
+                 prioritized_replay_beta0=0.4,
+                 prioritized_replay_beta_steps=500000,
+                 num_test_case=100,
+                 accelerate=False,
+                 mixed_precision=False,
+                 keep_last_n_checkpoints=0
                  ):
         self.env = env
         self.device = device
@@ -59,8 +73,21 @@ class Trainer(object):
         self.gamma = gamma
         self.frame_history_len = frame_history_len
         self.target_update_freq = target_update_freq
+        if not 0 < target_update_tau <= 1:
+            raise ValueError('target_update_tau should be in (0, 1], got {}'.format(target_update_tau))
+        self.target_update_tau = target_update_tau
+        self.double_q = double_q
+        self.n_step = n_step
+        self.replay_buffer_size = replay_buffer_size
+        self.replay_storage_dir = replay_storage_dir
+        self.prioritized_replay = prioritized_replay
+        self.prioritized_replay_alpha = prioritized_replay_alpha
+        # importance-sampling exponent annealed to 1 over the parameter updates
+        self.prioritized_replay_beta = LinearSchedule(prioritized_replay_beta_steps, 1.0, prioritized_replay_beta0)
         self.output_dir = output_dir
         self.num_test_case = num_test_case
+        self.accelerate = accelerate
+        self.mixed_precision = mixed_precision
 
         img_h, img_w, img_c = env.observation_space.shape
         input_arg = frame_history_len * img_c
@@ -68,79 +95,64 @@ class Trainer(object):
         self.image_size = (img_h, img_w, img_c)
         self.time_step = env.unwrapped.time_step
 
+        self.q_func = q_func
         self.Q = q_func(input_arg, self.num_actions).to(device)
         self.target_Q = q_func(input_arg, self.num_actions).to(device)
+        # forward callables used for training, which are compiled and channels_last in accelerated mode
+        if accelerate:
+            self.q_forward = accelerate_model(self.Q)
+            self.target_q_forward = accelerate_model(self.target_Q)
+            logging.info('Use accelerated training mode with torch.compile and channels_last')
+        else:
+            self.q_forward = self.Q
+            self.target_q_forward = self.target_Q
+        if mixed_precision:
+            logging.info('Use bfloat16 autocast for training forward passes')
         # self.replay_buffer = ReplayBuffer(replay_buffer_size, frame_history_len, self.image_size)
         self.replay_buffer = None
+        # weights and checkpoints are written in the background, keeping copies of the last saved weights
+        self.checkpoint_writer = CheckpointWriter(keep_last_n_checkpoints)
+        # directory holding the replay buffer snapshots of training state checkpoints
+        self.checkpoint_dir = None
+        # structured records of epochs, progress and evaluations read by the reports
+        self.recorder = RunRecorder(output_dir)
 
         self.log_every_n_steps = 10000
         self.num_param_updates = 0
         # map action_rot to its index and action_xy
+        from crowd_sim.envs.utils.action import ActionXY
         self.action_dict = {action: (i, ActionXY(action.v * np.cos(action.r), action.v * np.sin(action.r)))
                             for i, action in enumerate(self.env.unwrapped.actions)}
 
-    def imitation_learning(self, num_episodes=3000, training='mc', num_epochs=500, step_size=100):
+    def imitation_learning(self, num_episodes=3000, training='mc', num_epochs=500, step_size=100,
+                           compress_replay_buffer=False, checkpoint_every_n_episodes=None, resume=False,
+                           overwrite='ask'):
         """
         Imitation learning and reinforcement learning share the same environment, replay buffer and Q function
+        Demonstrations are saved with frames in compressed chunks if compress_replay_buffer is True
+        Demonstration collection is checkpointed every checkpoint_every_n_episodes episodes and resumed if resume
+        An existing replay buffer dir is handled by the overwrite policy
 
         """
         num_train_batch = num_episodes * 50
         optimizer = optim.Adam(self.Q.parameters(), lr=0.001)
-        self.replay_buffer = ReplayBuffer(int(num_episodes * self.env.max_time / self.env.time_step),
-                                          self.frame_history_len, self.image_size)
+        # most episodes end before max_time, so the buffer grows as demonstrations arrive
+        self.replay_buffer = self._make_replay_buffer(int(num_episodes * self.env.max_time / self.env.time_step),
+                                                      growable=True)
 
         logging.info('Start imitation learning')
         weights_file = os.path.join(self.output_dir, 'il_model.pth')
         replay_buffer_file = 'data/replay_buffer_{}'.format(num_episodes)
         if self.load_weights(weights_file):
             return
-        if os.path.exists(replay_buffer_file):
-            self.replay_buffer.load(replay_buffer_file)
-        else:
-            model_dir = 'data/sarl'
-            assert os.path.exists(model_dir)
-            policy = SARL()
-            policy.epsilon = 0
-            policy_config = configparser.RawConfigParser()
-            policy_config.read(os.path.join(model_dir, 'policy.config'))
-            policy.configure(policy_config)
-            policy.model.load_state_dict(torch.load(os.path.join(model_dir, 'rl_model.pth')))
-
-            policy.set_device(torch.device('cpu'))
-            policy.set_phase('test')
-            policy.time_step = self.time_step
-
-            episode = 0
-            while True:
-                observations = []
-                effects = []
-                done = False
-                info = ''
-                obs = self.env.reset()
-                joint_state = self.env.unwrapped.compute_coordinate_observation()
-                while not done:
-                    observations.append(obs)
-                    action_xy = policy.predict(joint_state)
-                    action_rot, index = self._approximate_action(action_xy)
-                    obs, reward, done, info = self.env.step(action_rot)
-                    effects.append((torch.IntTensor([[index]]), reward, done))
-
-                    if done:
-                        logging.info(self.env.get_episode_summary())
-                        obs = self.env.reset()
-
-                    joint_state = self.env.unwrapped.compute_coordinate_observation()
-
-                if info in ['Success', 'Collision']:
-                    episode += 1
-                    for obs, effect in zip(observations, effects):
-                        last_idx = self.replay_buffer.store_observation(obs)
-                        self.replay_buffer.store_effect(last_idx, *effect)
-                if episode > num_episodes:
-                    break
-
-            self.replay_buffer.save(replay_buffer_file)
-            logging.info('Total steps: {}'.format(self.replay_buffer.num_in_buffer))
+        # jobs sharing the demonstrations wait for the one collecting them, instead of collecting them again
+        with file_lock(replay_buffer_file):
+            if os.path.exists(replay_buffer_file):
+                self.replay_buffer.load(replay_buffer_file)
+            else:
+                self._collect_demonstrations(num_episodes, checkpoint_every_n_episodes, resume)
+                self.replay_buffer.save(replay_buffer_file, compress=compress_replay_buffer, overwrite=overwrite)
+                logging.info('Total steps: {}'.format(self.replay_buffer.num_in_buffer))
 
         # finish collecting experience and update the model
         if training == 'mc':
@@ -153,13 +165,68 @@ class Trainer(object):
         else:
             raise NotImplementedError
 
-        torch.save(self.Q.state_dict(), weights_file)
+        self.checkpoint_writer.save(self.Q.state_dict(), weights_file)
+        self._wait_checkpoint()
         logging.info('Save imitation learning trained weights to {}'.format(weights_file))
 
         # self.test()
 
+    def _collect_demonstrations(self, num_episodes, checkpoint_every_n_episodes=None, resume=False):
+        """ Store successful and colliding episodes of the SARL policy in the replay buffer """
+        policy = load_sarl('data/sarl', self.time_step)
+        checkpoint_dir = os.path.join(self.output_dir, 'il_checkpoint')
+
+        episode = 0
+        if resume:
+            loop_state = self._load_checkpoint(checkpoint_dir)
+            if loop_state is not None:
+                episode = loop_state['episode']
+                logging.info('Resume demonstration collection from episode {}'.format(episode))
+        while True:
+            observations = []
+            effects = []
+            done = False
+            info = ''
+            obs = self.env.reset()
+            joint_state = self.env.unwrapped.compute_coordinate_observation()
+            while not done:
+                observations.append(obs)
+                action_xy = policy.predict(joint_state)
+                action_rot, index = self._approximate_action(action_xy)
+                obs, reward, done, info = self.env.step(action_rot)
+                effects.append((torch.IntTensor([[index]]), reward, done))
+
+                if done:
+                    logging.info(self.env.get_episode_summary())
+                    obs = self.env.reset()
+
+                joint_state = self.env.unwrapped.compute_coordinate_observation()
+
+            if info in ['Success', 'Collision']:
+                episode += 1
+                for obs, effect in zip(observations, effects):
+                    last_idx = self.replay_buffer.store_observation(obs)
+                    self.replay_buffer.store_effect(last_idx, *effect)
+                if checkpoint_every_n_episodes and episode % checkpoint_every_n_episodes == 0:
+                    self._save_checkpoint(checkpoint_dir, {'episode': episode})
+            if episode > num_episodes:
+                break
+
+        self._wait_checkpoint()
+
+    def _make_replay_buffer(self, size, growable=False):
+        # discount factor between two consecutive transitions
+        gamma = pow(self.gamma, self.time_step)
+        if self.prioritized_replay:
+            return PrioritizedReplayBuffer(size, self.frame_history_len, self.image_size, self.n_step, gamma,
+                                           self.replay_storage_dir, growable, alpha=self.prioritized_replay_alpha)
+        else:
+            return ReplayBuffer(size, self.frame_history_len, self.image_size, self.n_step, gamma,
+                                self.replay_storage_dir, growable=growable)
+
     def _approximate_action(self, demonstration):
         """ Approximate demonstration action with closest target action"""
+        from crowd_sim.envs.utils.action import ActionXY
         min_diff = float('inf')
         target_action = None
         index = -1
@@ -176,57 +243,105 @@ class Trainer(object):
 
         return target_action, index
 
-    def test(self, visualize_step=False):
+    def test(self, visualize_step=False, num_workers=1, env_fn=None, seed=0, scenarios=None):
+        """
+        Test the model on num_test_case cases seeded from seed, spread over num_workers processes with
+        environments built by env_fn(worker_id) if num_workers > 1, otherwise in self.env.
+        Test cases replay recorded scenarios if given.
+        """
         logging.info('Start testing model')
-        replay_buffer = ReplayBuffer(int(self.num_test_case * self.env.max_time / self.env.time_step),
-                                     self.frame_history_len, self.image_size)
-
-        if visualize_step:
-            _, (ax1, ax2) = plt.subplots(1, 2)
-        for i in range(self.num_test_case):
-            obs = self.env.reset()
-            done = False
-            while not done:
-                last_idx = replay_buffer.store_observation(obs)
-                recent_observations = replay_buffer.encode_recent_observation()
-                action = self.act(recent_observations)
-
-                if visualize_step and self.Q.attention_weights is not None:
+        if num_workers > 1 and not visualize_step:
+            state_dict = {name: value.cpu() for name, value in self.Q.state_dict().items()}
+            policy_fn = functools.partial(QNetworkPolicy.from_state_dict, self.q_func, state_dict,
+                                          self.frame_history_len, self.image_size, self.num_actions)
+            results = evaluate(env_fn, policy_fn, self.num_test_case, num_workers, seed, scenarios=scenarios)
+        else:
+            step_callback = None
+            if visualize_step:
+                import matplotlib.pyplot as plt
+                from visual_nav.utils.heatmap import heatmap
+                _, (ax1, ax2) = plt.subplots(1, 2)
+
+                def visualize(env, obs, action):
+                    if self.Q.attention_weights is None:
+                        return
                     plt.ion()
                     plt.show()
                     ax1.imshow(obs.image[:, :, 0], cmap='gray')
                     attention_weights = self.Q.attention_weights.squeeze().view(7, 7).cpu().numpy()
                     heatmap(obs.image[:, :, 0], attention_weights, ax=ax2)
 
-                    action_rot = self.env.unwrapped.actions[action.item()]
+                    action_rot = env.unwrapped.actions[action]
                     logging.info('v: {:.2f}, r: {:.2f}'.format(action_rot[0], -np.rad2deg(action_rot[1])))
+                step_callback = visualize
 
-                obs, reward, done, info = self.env.step(action.item())
-                replay_buffer.store_effect(last_idx, action, reward, done)
-
-            logging.info(self.env.get_episode_summary())
+            policy = QNetworkPolicy(self.Q, self.frame_history_len, self.image_size, self.device)
+            results = evaluate(None, None, self.num_test_case, seed=seed, env=self.env, policy=policy,
+                               step_callback=step_callback, scenarios=scenarios)
 
-        logging.info(self.env.get_episodes_summary(num_last_episodes=self.num_test_case))
+        summary = summarize(results)
+        logging.info(format_summary(summary))
+        self.recorder.record('evaluation', seed=seed, scenarios=scenarios is not None, **summary._asdict())
+        return results
 
     def reinforcement_learning(self, optimizer_spec, exploration, learning_starts=50000,
-                               learning_freq=4, num_timesteps=2000000, episode_update=False):
+                               learning_freq=4, num_timesteps=2000000, episode_update=False, metrics_log_interval=100,
+                               checkpoint_every_n_steps=None, resume=False, profile_log_interval=None,
+                               profile_capture=None, profile_capture_mode='cprofile'):
+        """
+        Episode statistics are only recomputed when an episode finishes, and logged to TensorBoard
+        every metrics_log_interval steps from a background thread
+
+        With profile_log_interval, the time spent in the simulator, the replay buffer and the updates is timed and
+        its breakdown logged every profile_log_interval steps. A cProfile or torch profiler profile of the steps
+        in the range profile_capture is saved in the output directory.
+
+        The full training state is checkpointed at the first episode end after every checkpoint_every_n_steps
+        steps, and training continues from the last checkpoint if resume. Checkpoints are taken between episodes,
+        since the simulator state can not be saved, so that a resumed run starts a new episode like the original.
+        """
         statistics_file = os.path.join(self.output_dir, 'statistics.json')
         weights_file = os.path.join(self.output_dir, 'rl_model.pth')
         self.load_weights(weights_file)
+        if self.replay_buffer is None:
+            self.replay_buffer = self._make_replay_buffer(self.replay_buffer_size)
         logging.info('Start reinforcement learning')
-        writer = SummaryWriter()
+        from tensorboardX import SummaryWriter
+        metrics = MetricsLogger(SummaryWriter(), metrics_log_interval)
         episode_starts = len(self.env.get_episode_rewards())
+        num_episodes = 0
         avg_reward = -float('nan')
         success_rate = -float('nan')
         collision_rate = -float('nan')
         overtime_rate = -float('nan')
         avg_time = -float('nan')
         best_avg_episode_reward = -float('inf')
-        last_obs = self.env.reset()
         optimizer = optimizer_spec.constructor(self.Q.parameters(), **optimizer_spec.kwargs)
+        # episodes are only stored in the replay buffer once they finish, so rollouts keep their own history
+        frame_history = FrameHistory(self.frame_history_len, self.image_size)
 
         t = 0
+        checkpoint_dir = os.path.join(self.output_dir, 'checkpoint')
+        if resume:
+            loop_state = self._load_checkpoint(checkpoint_dir, optimizer)
+            if loop_state is not None:
+                t = loop_state['t']
+                episode_starts = loop_state['episode_starts']
+                best_avg_episode_reward = loop_state['best_avg_episode_reward']
+                logging.info('Resume reinforcement learning from step {}'.format(t))
+        next_checkpoint_t = t + checkpoint_every_n_steps if checkpoint_every_n_steps else None
+        last_obs = self.env.reset()
+        if profile_log_interval:
+            self._instrument_env()
+            profiler.enable(cuda_sync=self.device.type == 'cuda')
+            last_profile_t = t
+        capture = None
+        if profile_capture is not None:
+            capture = ProfileCapture(*profile_capture, os.path.join(self.output_dir, 'profile_{}_{}.{}'.format(
+                *profile_capture, 'prof' if profile_capture_mode == 'cprofile' else 'json')), profile_capture_mode)
         while True:
+            if capture is not None:
+                capture.step(t)
             # Check stopping criterion
             if self.env.get_total_steps() > num_timesteps:
                 break
@@ -258,33 +373,11 @@ class Trainer(object):
             else:
                 done = False
                 observations = []
-                frames = []
-                goals = []
                 effects = []
+                frame_history.reset()
                 while not done:
-                    frame, goal = last_obs
-                    frame = np.array(frame).astype(np.float32)
-                    goal = np.array(goal).astype(np.float32)
-
-                    # transpose image frame into (img_c, img_h, img_w)
-                    frame = frame.transpose(2, 0, 1)
-                    frames.append(frame)
-                    goals.append(goal)
-
-                    frame_concat = []
-                    goal_concat = []
-                    if len(frames) < self.frame_history_len:
-                        for _ in range(self.frame_history_len - len(frames)):
-                            frame_concat.append(np.zeros_like(frame))
-                            goal_concat.append(np.zeros_like(goal))
-                        frame_concat += frames
-                        goal_concat += goals
-                    else:
-                        frame_concat = frames[-4:]
-                        goal_concat = goals[-4:]
-                    frame_concat = np.concatenate(frame_concat, 0)
-                    goal_concat = np.concatenate(goal_concat, 0)
-                    recent_observations = frame_concat, goal_concat
+                    frame_history.append(last_obs)
+                    recent_observations = frame_history.encode()
 
                     if t > learning_starts:
                         eps_threshold = exploration.value(t)
@@ -311,25 +404,25 @@ class Trainer(object):
                 last_obs = self.env.reset()
                 logging.info(self.env.get_episode_summary() + ' in step {}'.format(t))
 
-            # Log progress and keep track of statistics
+            # Log progress and keep track of statistics, which only change when an episode finishes
             num_last_episodes = 100
-            episode_rewards = self.env.get_episode_rewards()[episode_starts:]
-            num_episodes = len(episode_rewards)
-            if num_episodes > 0:
+            if len(self.env.get_episode_rewards()) - episode_starts != num_episodes:
+                num_episodes = len(self.env.get_episode_rewards()) - episode_starts
                 avg_reward = self.env.get_average_reward(num_last_episodes, episode_starts)
                 success_rate = self.env.get_success_rate(num_last_episodes, episode_starts)
                 collision_rate = self.env.get_collision_rate(num_last_episodes, episode_starts)
                 overtime_rate = self.env.get_overtime_rate(num_last_episodes, episode_starts)
                 avg_time = self.env.get_average_time(num_last_episodes, episode_starts)
-            if num_episodes > num_last_episodes:
-                best_avg_episode_reward = max(best_avg_episode_reward, avg_reward)
+                if num_episodes > num_last_episodes:
+                    best_avg_episode_reward = max(best_avg_episode_reward, avg_reward)
 
-            writer.add_scalar('data/mean_episode_rewards', avg_reward, t)
-            writer.add_scalar('data/best_mean_episode_rewards', best_avg_episode_reward, t)
-            writer.add_scalar('data/success_rate', success_rate, t)
-            writer.add_scalar('data/collision_rate', collision_rate, t)
-            writer.add_scalar('data/overtime_rate', overtime_rate, t)
-            writer.add_scalar('data/mean_episode_time', avg_time, t)
+            if metrics.due(t):
+                metrics.log({'data/mean_episode_rewards': avg_reward,
+                             'data/best_mean_episode_rewards': best_avg_episode_reward,
+                             'data/success_rate': success_rate,
+                             'data/collision_rate': collision_rate,
+                             'data/overtime_rate': overtime_rate,
+                             'data/mean_episode_time': avg_time}, t)
 
             if t % self.log_every_n_steps == 0 and t > learning_starts:
                 logging.info("Timestep %d" % (t,))
@@ -338,56 +431,193 @@ class Trainer(object):
                 logging.info("episodes %d" % num_episodes)
                 logging.info("exploration %f" % exploration.value(t))
                 sys.stdout.flush()
+                self.recorder.record('rl_progress', t=t, mean_reward=avg_reward,
+                                     best_mean_reward=best_avg_episode_reward, success_rate=success_rate,
+                                     collision_rate=collision_rate, overtime_rate=overtime_rate, mean_time=avg_time,
+                                     episodes=num_episodes, exploration=exploration.value(t))
 
                 # Dump statistics to json file
-                writer.export_scalars_to_json(statistics_file)
-                logging.info("Saved to %s" % statistics_file)
+                metrics.export_scalars_to_json(statistics_file)
+
+                self.checkpoint_writer.save(self.Q.state_dict(), weights_file, step=t)
+
+            if next_checkpoint_t is not None and done and t >= next_checkpoint_t:
+                self._save_checkpoint(checkpoint_dir, {'t': t, 'episode_starts': episode_starts,
+                                                       'best_avg_episode_reward': best_avg_episode_reward}, optimizer)
+                next_checkpoint_t = t + checkpoint_every_n_steps
+
+            if profile_log_interval and t - last_profile_t >= profile_log_interval:
+                metrics.log(profiler.log_breakdown(t - last_profile_t), t)
+                last_profile_t = t
+
+        if capture is not None:
+            capture.stop()
+        profiler.enabled = False
+        self._wait_checkpoint()
+        metrics.close(t)
+
+    def _instrument_env(self):
+        """ Time the steps of the simulator, with its observation and state updates and its client calls """
+        env = self.env.unwrapped
+        profiler.instrument(env, ['step', 'compute_observation', '_update_states'], 'env')
+        client = getattr(env, 'client', None)
+        if client is not None:
+            profiler.instrument(client, ['simGetImages', 'simGetVehiclePose', 'simSetVehiclePose', 'simGetObjectPose',
+                                         'simSetObjectPose', 'simGetCollisionInfo', 'simContinueForTime',
+                                         'setCarControls'], 'env/rpc')
+
+    def _save_checkpoint(self, checkpoint_dir, loop_state, optimizer=None):
+        """
+        Snapshot the training state and write it to checkpoint_dir with the checkpoint writer
 
-                torch.save(self.Q.state_dict(), weights_file)
+        Tensors are copied to CPU and only the frames stored since the last snapshot are copied from the replay
+        buffer, so that the training loop only waits for the copies.
+        """
+        if checkpoint_dir != self.checkpoint_dir:
+            # frames snapshotted into another directory need to be written again
+            self.replay_buffer.num_snapshotted = 0
+            self.checkpoint_dir = checkpoint_dir
+        state = {'Q': self.Q.state_dict(),
+                 'target_Q': self.target_Q.state_dict(),
+                 'optimizer': optimizer.state_dict() if optimizer is not None else None,
+                 'num_param_updates': self.num_param_updates,
+                 'loop_state': loop_state,
+                 'num_stored': self.replay_buffer.num_stored,
+                 'rng_states': {'random': random.getstate(), 'numpy': np.random.get_state(),
+                                'torch': torch.get_rng_state(),
+                                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}}
+        if hasattr(self.env, 'state_dict'):
+            state['monitor'] = self.env.state_dict()
+        else:
+            state['monitor'] = None
+            logging.warning('Monitor statistics are not checkpointed by {}'.format(type(self.env).__name__))
+        # the training state is replaced last, so that it never refers to replay buffer frames not yet written
+        self.checkpoint_writer.submit(type(self.replay_buffer).write_snapshot, self.replay_buffer.snapshot(),
+                                      os.path.join(checkpoint_dir, 'replay_buffer'))
+        self.checkpoint_writer.save(state, os.path.join(checkpoint_dir, TRAINING_STATE_FILE))
+
+    def _wait_checkpoint(self):
+        self.checkpoint_writer.wait()
+
+    def _load_checkpoint(self, checkpoint_dir, optimizer=None):
+        """ Restore the training state saved in checkpoint_dir and return the loop state, or None without one """
+        state_file = os.path.join(checkpoint_dir, TRAINING_STATE_FILE)
+        if not os.path.exists(state_file):
+            logging.warning('No checkpoint to resume from in {}'.format(checkpoint_dir))
+            return None
+        state = load_checkpoint(state_file, map_location=self.device)
+        self.Q.load_state_dict(state['Q'])
+        self.target_Q.load_state_dict(state['target_Q'])
+        if optimizer is not None and state['optimizer'] is not None:
+            optimizer.load_state_dict(state['optimizer'])
+        self.num_param_updates = state['num_param_updates']
+
+        rng_states = state['rng_states']
+        random.setstate(rng_states['random'])
+        np.random.set_state(rng_states['numpy'])
+        torch.set_rng_state(rng_states['torch'].cpu())
+        if rng_states['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([rng_state.cpu() for rng_state in rng_states['cuda']])
+        if state['monitor'] is not None and hasattr(self.env, 'load_state_dict'):
+            self.env.load_state_dict(state['monitor'])
+        else:
+            logging.warning('Monitor statistics are not restored from the checkpoint')
 
-        writer.close()
+        self.replay_buffer.restore(os.path.join(checkpoint_dir, 'replay_buffer'))
+        self.checkpoint_dir = checkpoint_dir
+        if self.replay_buffer.num_stored != state['num_stored']:
+            logging.warning('Replay buffer checkpoint has {} stored frames instead of {}'.format(
+                self.replay_buffer.num_stored, state['num_stored']))
+        logging.info('Checkpoint loaded from {}'.format(checkpoint_dir))
+        return state['loop_state']
 
+    @profiler.timed('trainer/act')
     def _select_epsilon_greedy_action(self, model, obs, eps_threshold):
         sample = random.random()
         if sample > eps_threshold:
             frames = torch.from_numpy(obs[0]).unsqueeze(0).to(self.device) / 255.0
             goals = torch.from_numpy(obs[1]).unsqueeze(0).to(self.device)
-            # Use volatile = True if variable is only used in inference mode, i.e. don’t save the history
-            return model(frames, goals).data.max(1)[1].cpu()
+            # Use inference mode since the output is only used for acting, i.e. don’t save the history
+            with inference_mode():
+                return model(frames, goals).max(1)[1].cpu()
         else:
             return torch.IntTensor([random.randrange(self.num_actions)])
 
+    @profiler.timed('trainer/act')
     def act(self, obs):
+        """ Greedy action for an observation encoded by FrameHistory or the replay buffer """
         frames = torch.from_numpy(obs[0]).unsqueeze(0).to(self.device) / 255.0
-        goals = torch.from_numpy(np.array(obs[1])).unsqueeze(0).to(self.device)
-        return self.Q(frames, goals).data.max(1)[1].cpu()
+        goals = torch.from_numpy(np.asarray(obs[1], dtype=np.float32)).unsqueeze(0).to(self.device)
+        with inference_mode():
+            return self.Q(frames, goals).max(1)[1].cpu()
+
+    def _autocast(self):
+        """ bfloat16 autocast context for training forward passes if mixed precision is enabled """
+        return autocast(self.device, self.mixed_precision)
+
+    def _check_finite(self, value, optimizer):
+        """
+        Guard against overflow in reduced precision: skip the update if value is not finite.
+        Only checked with mixed precision since it synchronizes with the device.
+        """
+        if self.mixed_precision and not torch.isfinite(value).all():
+            logging.warning('Non-finite value encountered in mixed precision, skip the update')
+            optimizer.zero_grad()
+            return False
+        return True
+
+    @profiler.timed('trainer/frames_to_device')
+    def _frames_to_device(self, frames):
+        """ Move a batch of frames to device and normalize it, in channels_last format for accelerated mode """
+        frames = frames.to(self.device) / 255.0
+        if self.accelerate:
+            frames = to_channels_last(frames)
+        return frames
 
+    @profiler.timed('trainer/td_update')
     def _td_update(self, optimizer):
         # Use the replay buffer to sample a batch of transitions
         # Note: done_mask[i] is 1 if the next state corresponds to the end of an episode,
         # in which case there is no Q-value at the next state; at the end of an
         # episode, only the current state reward contributes to the target
-        frames_batch, goals_batch, action_batch, reward_batch, next_frames_batch, next_goals_batch, done_mask = \
-            self.replay_buffer.sample(self.batch_size)
+        # With prioritized replay, transitions are weighted by importance-sampling weights
+        if self.prioritized_replay:
+            beta = self.prioritized_replay_beta.value(self.num_param_updates)
+            *batch, weights, idxes = self.replay_buffer.sample(self.batch_size, beta=beta, with_discount=True)
+        else:
+            batch = self.replay_buffer.sample(self.batch_size, with_discount=True)
+        frames_batch, goals_batch, action_batch, reward_batch, next_frames_batch, next_goals_batch, done_mask, \
+            discount_batch = batch
         # Convert numpy nd_array to torch variables for calculation
-        frames_batch = torch.from_numpy(frames_batch).to(self.device) / 255.0
+        frames_batch = self._frames_to_device(torch.from_numpy(frames_batch))
         goals_batch = torch.from_numpy(goals_batch).to(self.device)
         action_batch = torch.from_numpy(action_batch).long().to(self.device)
         reward_batch = torch.from_numpy(reward_batch).to(self.device)
-        next_frames_batch = torch.from_numpy(next_frames_batch).to(self.device) / 255.0
+        next_frames_batch = self._frames_to_device(torch.from_numpy(next_frames_batch))
         next_goals_batch = torch.from_numpy(next_goals_batch).to(self.device)
         not_done_mask = torch.from_numpy(1 - done_mask).to(self.device)
+        discount_batch = torch.from_numpy(discount_batch).to(self.device)
 
         # Compute current Q value, q_func takes only state and output value for every state-action pair
         # We choose Q based on action taken, action is used to index the value in the dqn output
         # current_q_values[i][j] = Q_outputs[i][action_batch[i][j]], where j=0
-        current_q_values = self.Q(frames_batch, goals_batch).gather(1, action_batch.unsqueeze(1)).squeeze(1)
+        # Q values are cast back to float32 so that the Bellman error and its clipping are computed in full precision
+        with self._autocast():
+            current_q_values = self.q_forward(frames_batch, goals_batch).float()
+        current_q_values = current_q_values.gather(1, action_batch.unsqueeze(1)).squeeze(1)
         # Compute next Q value based on which action gives max Q values
-        # Detach variable from the current graph since we don't want gradients for next Q to propagated
-        next_max_q = self.target_Q(next_frames_batch, next_goals_batch).detach().max(1)[0]
+        # Use inference mode since we don't want gradients for next Q to propagated
+        with inference_mode(), self._autocast():
+            next_q = self.target_q_forward(next_frames_batch, next_goals_batch).float()
+            if self.double_q:
+                # Double DQN: select next actions with Q network and evaluate them with target Q network
+                next_actions = self.q_forward(next_frames_batch, next_goals_batch).max(1)[1]
+                next_max_q = next_q.gather(1, next_actions.unsqueeze(1)).squeeze(1)
+            else:
+                next_max_q = next_q.max(1)[0]
         next_q_values = not_done_mask * next_max_q
-        # Compute the target of the current Q values
-        target_q_values = reward_batch + (pow(self.gamma, self.time_step) * next_q_values)
+        # Compute the target of the current Q values, where rewards are n-step returns discounted within the buffer
+        target_q_values = reward_batch + (discount_batch * next_q_values)
 
         # Compute Bellman error
         td_error = target_q_values - current_q_values
@@ -398,35 +628,44 @@ class Trainer(object):
         d_error = clipped_bellman_error * -1.0
         # Clear previous gradients before backward pass
         optimizer.zero_grad()
-        # run backward pass and back prop through Q network, d_error is the gradient of final loss w.r.t. Q
-        current_q_values.backward(d_error.data)
-
-        # # equivalent gradient computation, TODO: test
-        # loss = (target_q_values - current_q_values).pow(2).mean()
-        # self.optimizer.zero_grad()
-        # loss.backward()
+        if not self._check_finite(td_error, optimizer):
+            return
+        if self.prioritized_replay:
+            d_error = d_error * torch.from_numpy(weights).to(self.device)
+            self.replay_buffer.update_priorities(idxes, td_error.detach().cpu().numpy())
+        with profiler.timer('trainer/backward'):
+            # run backward pass and back prop through Q network, d_error is the gradient of final loss w.r.t. Q
+            current_q_values.backward(d_error.data)
+
+            # # equivalent gradient computation, TODO: test
+            # loss = (target_q_values - current_q_values).pow(2).mean()
+            # self.optimizer.zero_grad()
+            # loss.backward()
 
-        # Perform the update
-        optimizer.step()
+            # Perform the update
+            optimizer.step()
         self.num_param_updates += 1
 
-        # Periodically update the target network by Q network to target Q network
-        if self.num_param_updates % self.target_update_freq == 0:
-            self.target_Q.load_state_dict(self.Q.state_dict())
+        self._update_target_network()
 
     def _mc_update(self, optimizer, criterion, num_train_batch=1):
         for _ in range(num_train_batch):
+            # importance-sampling weights and indices returned by prioritized replay are not used
             frames_batch, goals_batch, action_batch, _, _, _, _, value_batch = \
-                self.replay_buffer.sample(self.batch_size, with_value=True)
+                self.replay_buffer.sample(self.batch_size, with_value=True)[:8]
             # Convert numpy nd_array to torch variables for calculation
-            frames_batch = torch.from_numpy(frames_batch).to(self.device) / 255.0
+            frames_batch = self._frames_to_device(torch.from_numpy(frames_batch))
             goals_batch = torch.from_numpy(goals_batch).to(self.device)
             action_batch = torch.from_numpy(action_batch).long().to(self.device)
             value_batch = torch.from_numpy(value_batch).to(self.device)
 
-            current_q_values = self.Q(frames_batch, goals_batch).gather(1, action_batch.unsqueeze(1)).squeeze(1)
+            with self._autocast():
+                current_q_values = self.q_forward(frames_batch, goals_batch).float()
+            current_q_values = current_q_values.gather(1, action_batch.unsqueeze(1)).squeeze(1)
             loss = criterion(current_q_values, value_batch)
             optimizer.zero_grad()
+            if not self._check_finite(loss, optimizer):
+                continue
             loss.backward()
             logging.info('Batch loss: {:.4f}'.format(loss.item()))
 
@@ -434,22 +673,33 @@ class Trainer(object):
             optimizer.step()
             self.num_param_updates += 1
 
-            # Periodically update the target network by Q network to target Q network
-            if self.num_param_updates % self.target_update_freq == 0:
-                self.target_Q.load_state_dict(self.Q.state_dict())
+            self._update_target_network()
+
+    def _update_target_network(self):
+        """
+        Periodically copy Q network to target Q network, or softly update the target Q network
+        after every update with Polyak averaging if target_update_tau < 1
+        """
+        if self.target_update_tau < 1:
+            update_target_model(self.target_Q, self.Q, self.target_update_tau)
+        elif self.num_param_updates % self.target_update_freq == 0:
+            update_target_model(self.target_Q, self.Q)
 
     def _action_classification_batch(self, optimizer, criterion, num_train_batch):
         for _ in range(num_train_batch):
             frames_batch, goals_batch, action_batch, _, _, _, done_mask = \
-                self.replay_buffer.sample(self.batch_size)
+                self.replay_buffer.sample(self.batch_size)[:7]
             # Convert numpy nd_array to torch variables for calculation
             frames_batch = torch.from_numpy(frames_batch).to(self.device) / 255.0
             goals_batch = torch.from_numpy(goals_batch).to(self.device)
             action_batch = torch.from_numpy(action_batch).long().to(self.device)
 
-            predicted_actions = self.Q(frames_batch, goals_batch)
+            with self._autocast():
+                predicted_actions = self.Q(frames_batch, goals_batch).float()
             loss = criterion(predicted_actions, action_batch)
             optimizer.zero_grad()
+            if not self._check_finite(loss, optimizer):
+                continue
             loss.backward()
 
             # Perform the update
@@ -477,6 +727,7 @@ class Trainer(object):
             logging.info('Epoch {}/{}'.format(epoch, num_train_epochs - 1))
 
             # Each epoch has a training and validation phase
+            epoch_record = {'epoch': epoch}
             for phase in ['train', 'val']:
                 if phase == 'train' and epoch != 0:
                     scheduler.step()
@@ -488,21 +739,23 @@ class Trainer(object):
                 running_corrects = 0
 
                 # Iterating over data once is one epoch
+                train_step = phase == 'train' and epoch != 0
                 for data in dataloaders[phase]:
                     # get the inputs
                     frames_batch, goals_batch, action_batch = data
-                    frames_batch = frames_batch.to(self.device) / 255.0
+                    frames_batch = self._frames_to_device(frames_batch)
                     goals_batch = goals_batch.to(self.device)
                     action_batch = action_batch.long().to(self.device)
 
                     # zero the parameter gradients and forward
                     optimizer.zero_grad()
-                    predicted_actions = model(frames_batch, goals_batch)
+                    with inference_mode(not train_step), self._autocast():
+                        predicted_actions = self.q_forward(frames_batch, goals_batch).float()
                     _, preds = torch.max(predicted_actions.data, 1)
                     loss = criterion(predicted_actions, action_batch)
 
                     # backward + optimize only if in training phase
-                    if phase == 'train' and epoch != 0:
+                    if train_step and self._check_finite(loss, optimizer):
                         loss.backward()
                         optimizer.step()
                     # statistics
@@ -514,12 +767,15 @@ class Trainer(object):
 
                 logging.info('{} Loss: {:.4f} Acc: {:.4f}'.format(
                     phase, epoch_loss, epoch_acc))
+                epoch_record[phase + '_loss'] = epoch_loss
+                epoch_record[phase + '_acc'] = epoch_acc
 
                 # deep copy the model
                 if phase == 'val' and epoch_acc > best_acc:
                     best_acc = epoch_acc
                     if use_best_wts:
                         best_model_wts = copy.deepcopy(model.state_dict())
+            self.recorder.record('il_epoch', **epoch_record)
 
         time_elapsed = time.time() - since
         logging.info('Training complete in {:.0f}m {:.0f}s'.format(
@@ -539,13 +795,14 @@ class Trainer(object):
         for data in dataloaders[phase]:
             # get the inputs
             frames_batch, goals_batch, action_batch = data
-            frames_batch = frames_batch.to(self.device) / 255.0
+            frames_batch = self._frames_to_device(frames_batch)
             goals_batch = goals_batch.to(self.device)
             action_batch = action_batch.long().to(self.device)
 
             # zero the parameter gradients and forward
             optimizer.zero_grad()
-            predicted_actions = model(frames_batch, goals_batch)
+            with inference_mode(), self._autocast():
+                predicted_actions = self.q_forward(frames_batch, goals_batch).float()
             _, preds = torch.max(predicted_actions.data, 1)
             loss = criterion(predicted_actions, action_batch)
 
@@ -557,13 +814,15 @@ class Trainer(object):
         epoch_acc = running_corrects / len(datasets[phase])
 
         logging.info('{} Loss: {:.4f} Acc: {:.4f}'.format(phase, epoch_loss, epoch_acc))
+        self.recorder.record('il_test', best_val_acc=best_acc, test_loss=epoch_loss, test_acc=epoch_acc)
 
         return model, best_acc
 
     def load_weights(self, weights_file):
         if os.path.exists(weights_file):
-            self.Q.load_state_dict(torch.load(weights_file))
-            self.target_Q.load_state_dict(torch.load(weights_file))
+            state_dict = torch.load(weights_file, map_location=self.device)
+            self.Q.load_state_dict(state_dict)
+            self.target_Q.load_state_dict(state_dict)
             logging.info('Imitation learning trained weight loaded')
             return True
         else:
@@ -578,6 +837,8 @@ def main():
     parser.add_argument('--with_il', default=True, action='store_true')
     parser.add_argument('--il_training', type=str, default='classification')
     parser.add_argument('--num_episodes', type=int, default=3000)
+    parser.add_argument('--compress_replay_buffer', default=False, action='store_true')
+    parser.add_argument('--replay_storage_dir', type=str, default=None)
     parser.add_argument('--num_epochs', type=int, default=150)
     parser.add_argument('--step_size', type=int, default=150)
     parser.add_argument('--frame_history_len', type=int, default=1)
@@ -586,32 +847,48 @@ def main():
     parser.add_argument('--eps_end', type=float, default=0.1)
     parser.add_argument('--eps_decay_steps', type=int, default=1000000)
     parser.add_argument('--gamma', type=float, default=0.9)
+    parser.add_argument('--target_update_tau', type=float, default=1.0)
+    parser.add_argument('--double_q', default=False, action='store_true')
+    parser.add_argument('--n_step', type=int, default=1)
+    parser.add_argument('--dueling', default=False, action='store_true')
+    parser.add_argument('--prioritized_replay', default=False, action='store_true')
+    parser.add_argument('--prioritized_replay_alpha', type=float, default=0.6)
     parser.add_argument('--batch_size', type=int, default=128)
     parser.add_argument('--num_timesteps', type=int, default=2000000)
     parser.add_argument('--learning_starts', type=int, default=50000)
     parser.add_argument('--reward_shaping', default=False, action='store_true')
     parser.add_argument('--curriculum_learning', default=False, action='store_true')
     parser.add_argument('--episode_update', default=False, action='store_true')
+    parser.add_argument('--metrics_log_interval', type=int, default=100)
     parser.add_argument('--test_il', default=False, action='store_true')
     parser.add_argument('--test_rl', default=False, action='store_true')
     parser.add_argument('--num_test_case', type=int, default=200)
+    parser.add_argument('--num_test_workers', type=int, default=1)
+    parser.add_argument('--test_seed', type=int, default=0)
+    parser.add_argument('--test_scenarios', type=str, default=None)
     parser.add_argument('--visualize_step', default=False, action='store_true')
+    parser.add_argument('--accelerate', default=False, action='store_true')
+    parser.add_argument('--mixed_precision', default=False, action='store_true')
+    parser.add_argument('--gym_monitor', default=False, action='store_true')
+    parser.add_argument('--sim_port', type=int, default=41451,
+                        help='port of the simulator, parallel test workers use the following ports')
+    parser.add_argument('--checkpoint_every_n_steps', type=int, default=None)
+    parser.add_argument('--checkpoint_every_n_episodes', type=int, default=None)
+    parser.add_argument('--resume', default=False, action='store_true')
+    parser.add_argument('--overwrite', type=str, default='ask', choices=OVERWRITE_POLICIES,
+                        help='what to do with an existing output or replay buffer directory')
+    parser.add_argument('--keep_last_n_checkpoints', type=int, default=0)
+    parser.add_argument('--profile_log_interval', type=int, default=None)
+    parser.add_argument('--profile_capture', type=int, nargs=2, default=None, metavar=('START_STEP', 'END_STEP'))
+    parser.add_argument('--profile_capture_mode', type=str, default='cprofile', choices=['cprofile', 'torch'])
     args = parser.parse_args()
 
     if args.test_il or args.test_rl:
         if not os.path.exists(args.output_dir):
             raise ValueError('Model dir does not exist')
     else:
-        # configure paths
-        make_new_dir = True
-        if os.path.exists(args.output_dir):
-            key = input('Output directory already exists! Overwrite the folder? (y/n)')
-            if key == 'y':
-                shutil.rmtree(args.output_dir)
-            else:
-                make_new_dir = False
-        if make_new_dir:
-            os.makedirs(args.output_dir)
+        # configure paths, where resuming a run keeps its output directory
+        prepare_dir(args.output_dir, 'resume' if args.resume else args.overwrite, 'Output directory')
     log_file = os.path.join(args.output_dir, 'output.log')
     monitor_output_dir = os.path.join(args.output_dir, 'monitor-outputs')
 
@@ -621,23 +898,36 @@ def main():
     level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(level=level, handlers=[stdout_handler, file_handler],
                         format='%(asctime)s, %(levelname)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-    repo = git.Repo(search_parent_directories=True)
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     logging.info(sys.argv)
     if not args.test_il and not args.test_rl:
+        import git
+        repo = git.Repo(search_parent_directories=True)
         logging.info('Current git head hash code: {}'.format(repo.head.object.hexsha))
         logging.info('Using device: %s', device)
         logging.info(pprint.pformat(vars(args), indent=4))
 
     # configure environment
-    env = VisualSim(reward_shaping=args.reward_shaping, curriculum_learning=args.curriculum_learning)
-    env = MyMonitor(env, monitor_output_dir)
+    from visual_sim.envs.visual_sim import VisualSim
+    env = VisualSim(reward_shaping=args.reward_shaping, curriculum_learning=args.curriculum_learning,
+                    port=args.sim_port)
+    if args.gym_monitor:
+        from visual_nav.utils.my_monitor import MyMonitor
+        env = MyMonitor(env, monitor_output_dir)
+    else:
+        env = EpisodeMonitor(env, monitor_output_dir)
     assert type(env.observation_space) == gym.spaces.Box
     assert type(env.action_space) == gym.spaces.Discrete
 
+    q_func = model_factory[args.model]
+    if args.dueling:
+        if not issubclass(q_func, GDNet):
+            raise ValueError('Dueling head is only supported by GDNet models')
+        q_func = functools.partial(q_func, dueling=True)
+
     trainer = Trainer(
         env=env,
-        q_func=model_factory[args.model],
+        q_func=q_func,
         device=device,
         output_dir=args.output_dir,
         replay_buffer_size=100000,
@@ -645,15 +935,31 @@ def main():
         gamma=args.gamma,
         frame_history_len=args.frame_history_len,
         target_update_freq=10000,
-        num_test_case=args.num_test_case
+        target_update_tau=args.target_update_tau,
+        double_q=args.double_q,
+        n_step=args.n_step,
+        replay_storage_dir=args.replay_storage_dir,
+        prioritized_replay=args.prioritized_replay,
+        prioritized_replay_alpha=args.prioritized_replay_alpha,
+        num_test_case=args.num_test_case,
+        accelerate=args.accelerate,
+        mixed_precision=args.mixed_precision,
+        keep_last_n_checkpoints=args.keep_last_n_checkpoints
     )
 
+    # test environments of parallel workers, each connecting to its own simulator
+    test_env_fn = functools.partial(make_env, base_port=args.sim_port, reward_shaping=args.reward_shaping,
+                                    curriculum_learning=args.curriculum_learning)
+    # scenarios cached in a file, recorded at the first test, so that models are tested on the same episodes
+    test_scenarios = None
+    if (args.test_il or args.test_rl) and args.test_scenarios is not None:
+        test_scenarios = get_scenarios(args.test_scenarios, test_env_fn, args.num_test_case, args.test_seed)
     if args.test_il:
         trainer.load_weights(os.path.join(args.output_dir, 'il_model.pth'))
-        trainer.test(args.visualize_step)
+        trainer.test(args.visualize_step, args.num_test_workers, test_env_fn, args.test_seed, test_scenarios)
     elif args.test_rl:
         trainer.load_weights(os.path.join(args.output_dir, 'rl_model.pth'))
-        trainer.test(args.visualize_step)
+        trainer.test(args.visualize_step, args.num_test_workers, test_env_fn, args.test_seed, test_scenarios)
     else:
         # imitation learning
         if args.with_il:
@@ -661,7 +967,11 @@ def main():
                 num_episodes=args.num_episodes,
                 training=args.il_training,
                 num_epochs=args.num_epochs,
-                step_size=args.step_size
+                step_size=args.step_size,
+                compress_replay_buffer=args.compress_replay_buffer,
+                checkpoint_every_n_episodes=args.checkpoint_every_n_episodes,
+                resume=args.resume,
+                overwrite=args.overwrite
             )
 
         # reinforcement learning
@@ -681,8 +991,15 @@ def main():
                 learning_starts=args.learning_starts,
                 learning_freq=4,
                 num_timesteps=args.num_timesteps,
-                episode_update=args.episode_update
+                episode_update=args.episode_update,
+                metrics_log_interval=args.metrics_log_interval,
+                checkpoint_every_n_steps=args.checkpoint_every_n_steps,
+                resume=args.resume,
+                profile_log_interval=args.profile_log_interval,
+                profile_capture=args.profile_capture,
+                profile_capture_mode=args.profile_capture_mode
             )
+    env.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+"""
+    Measure the import time of entry point modules with python -X importtime, and list the slowest
+    top level packages they pull in, to keep the startup of training jobs and evaluation workers in check
+"""
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+def import_times(module):
+    """ Run a fresh interpreter importing module and return the cumulative import time of each module in us """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError('Fail to import {}: {}'.format(module, result.stderr.strip().splitlines()[-1]))
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark the import time of entry points')
+    parser.add_argument('--modules', type=str, nargs='+',
+                        default=['visual_nav.main', 'visual_nav.utils.evaluation', 'visual_nav.utils.scenarios'])
+    parser.add_argument('--num_runs', type=int, default=5)
+    parser.add_argument('--num_packages', type=int, default=8)
+    parser.add_argument('--max_ms', type=float, default=None, help='fail if an import takes longer')
+    args = parser.parse_args()
+
+    slow_modules = []
+    for module in args.modules:
+        # the fastest run is the least disturbed by the file system cache and other processes
+        runs = [import_times(module) for _ in range(args.num_runs)]
+        total = min(times[module] for times in runs) / 1000
+        print('{}: {:.1f}ms'.format(module, total))
+
+        packages = defaultdict(int)
+        for name, cumulative in runs[-1].items():
+            if '.' not in name and name != module:
+                packages[name] = max(packages[name], cumulative)
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.num_packages]:
+            print('    {:<20} {:.1f}ms'.format(name, cumulative / 1000))
+        if args.max_ms is not None and total > args.max_ms:
+            slow_modules.append(module)
+
+    if slow_modules:
+        print('Imports slower than {}ms: {}'.format(args.max_ms, ', '.join(slow_modules)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+    Measure the per-step overhead of the gym Monitor based MyMonitor and of EpisodeMonitor
+    over a stand-in environment which does no work
+"""
+import time
+import shutil
+import argparse
+import tempfile
+
+import gym
+import gym.spaces
+import numpy as np
+
+from visual_nav.utils.episode_monitor import EpisodeMonitor, END_SIGNALS
+
+
+class NullEnv(gym.Env):
+    def __init__(self, episode_length):
+        """ Environment returning the same observation, with episodes ending every episode_length steps """
+        self.episode_length = episode_length
+        self.time_step = 0.25
+        self.max_time = 50
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(84, 84, 1), dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(16)
+        self.observation = np.zeros((84, 84, 1), dtype=np.uint8)
+        self.steps = 0
+        self.num_episodes = 0
+
+    def reset(self):
+        self.steps = 0
+        return self.observation
+
+    def step(self, action):
+        self.steps += 1
+        done = self.steps == self.episode_length
+        info = ''
+        if done:
+            info = END_SIGNALS[self.num_episodes % len(END_SIGNALS)]
+            self.num_episodes += 1
+        return self.observation, 0.1, done, info
+
+    def render(self, mode='human'):
+        pass
+
+
+def measure(env, num_steps):
+    env.reset()
+    start = time.time()
+    for _ in range(num_steps):
+        _, _, done, _ = env.step(0)
+        if done:
+            env.reset()
+            # query statistics once per episode like the training loop
+            if hasattr(env, 'get_average_reward'):
+                env.get_average_reward(100)
+    return (time.time() - start) / num_steps
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark the per-step overhead of monitors')
+    parser.add_argument('--num_steps', type=int, default=200000)
+    parser.add_argument('--episode_length', type=int, default=50)
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp()
+    baseline = measure(NullEnv(args.episode_length), args.num_steps)
+    print('{:<15}: {:.2f}us per step'.format('no monitor', baseline * 1e6))
+
+    monitors = [('EpisodeMonitor', EpisodeMonitor)]
+    try:
+        from visual_nav.utils.my_monitor import MyMonitor
+        monitors.append(('MyMonitor', MyMonitor))
+    except ImportError as e:
+        print('Skip MyMonitor, gym Monitor is not available in gym {}: {}'.format(gym.__version__, e))
+    for name, monitor in monitors:
+        env = monitor(NullEnv(args.episode_length), tempfile.mkdtemp(dir=output_dir))
+        per_step = measure(env, args.num_steps)
+        env.close()
+        print('{:<15}: {:.2f}us per step, overhead {:.2f}us per step'.format(
+            name, per_step * 1e6, (per_step - baseline) * 1e6))
+    shutil.rmtree(output_dir)
+
+
+if __name__ == '__main__':
+    main()
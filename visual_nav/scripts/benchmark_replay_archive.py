@@ -0,0 +1,82 @@
+"""
+    Compare size, write time and random read throughput of the raw .npy replay buffer format
+    and the compressed chunked archive
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from visual_nav.utils.replay_buffer import ReplayBuffer
+
+Observation = namedtuple('Observation', ['image', 'goal'])
+
+
+def synthetic_depth_frame(step, image_size):
+    """ Smooth depth image of a floor gradient with a few moving obstacles """
+    img_h, img_w = image_size[:2]
+    rows, cols = np.mgrid[0:img_h, 0:img_w]
+    frame = 40 + 150 * rows / img_h
+    for i in range(3):
+        center = (img_h / 2, (cols.max() * (i + 1) / 4 + 2 * step) % img_w)
+        mask = ((rows - center[0]) / 20) ** 2 + ((cols - center[1]) / 6) ** 2 < 1
+        frame[mask] = 220 - 20 * i
+    return frame.astype(np.uint8)[:, :, np.newaxis]
+
+
+def fill_replay_buffer(replay_buffer, num_frames, episode_length=50):
+    for i in range(num_frames):
+        idx = replay_buffer.store_observation(Observation(synthetic_depth_frame(i, replay_buffer.image_size),
+                                                          (np.random.uniform(0, 6), np.random.uniform(-1, 1))))
+        replay_buffer.store_effect(idx, np.random.randint(16), 0, (i + 1) % episode_length == 0)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark replay buffer storage formats')
+    parser.add_argument('--replay_buffer_dir', type=str, default=None)
+    parser.add_argument('--num_frames', type=int, default=20000)
+    parser.add_argument('--codecs', type=str, nargs='+', default=['zlib'])
+    parser.add_argument('--num_reads', type=int, default=20000)
+    args = parser.parse_args()
+
+    image_size = (84, 84, 1)
+    replay_buffer = ReplayBuffer(args.num_frames, 1, image_size)
+    if args.replay_buffer_dir is None:
+        fill_replay_buffer(replay_buffer, args.num_frames)
+    else:
+        replay_buffer.load(args.replay_buffer_dir)
+        replay_buffer.frames = replay_buffer.frames[:]
+
+    output_root = tempfile.mkdtemp()
+    for codec in [None] + args.codecs:
+        output_dir = os.path.join(output_root, codec or 'npy')
+        start = time.time()
+        replay_buffer.save(output_dir, compress=codec is not None, codec=codec)
+        write_time = time.time() - start
+
+        loaded_buffer = ReplayBuffer(0, 1, image_size)
+        start = time.time()
+        loaded_buffer.load(output_dir)
+        load_time = time.time() - start
+
+        idxes = np.random.randint(0, loaded_buffer.num_in_buffer, args.num_reads)
+        start = time.time()
+        for idx in idxes:
+            loaded_buffer.encode_observation(idx)
+        read_throughput = args.num_reads / (time.time() - start)
+
+        print('{:<5}: size {:.1f}MB, write {:.2f}s, load {:.2f}s, random reads {:.0f} frames/s'.format(
+            codec or 'npy', dir_size(output_dir) / 2 ** 20, write_time, load_time, read_throughput))
+    shutil.rmtree(output_root)
+
+
+if __name__ == '__main__':
+    main()
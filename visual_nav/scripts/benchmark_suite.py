@@ -0,0 +1,406 @@
+"""
+    Benchmark the hot paths of training, to catch performance regressions of replay_buffer.py, models.py
+    and visual_sim.py:
+        replay: store, encode and sample throughput at several buffer sizes and frame history lengths
+        models: forward and forward + backward latency of every model_factory entry at several batch sizes
+        env: step latency of VisualSim against a local stand-in of the airsim client, which answers instantly
+             or after --rpc_latencies_ms, so that only the work done by VisualSim itself is measured. The airsim
+             package is replaced by a minimal stand-in module, so neither the simulator nor airsim is needed
+
+    Results are written as json with the versions and machine they were measured on, e.g.
+        python visual_nav/scripts/benchmark_suite.py --output_file baseline.json
+        python visual_nav/scripts/benchmark_suite.py --output_file new.json --compare baseline.json
+    where --compare prints the change of each benchmark, and fails if one is slower than --max_slowdown or if
+    one measured in the baseline is skipped, e.g. models which only support a fixed number of frames.
+"""
+import os
+import sys
+import json
+import math
+import time
+import types
+import random
+import socket
+import importlib.util
+import argparse
+import platform
+import itertools
+import subprocess
+from collections import namedtuple
+
+import numpy as np
+import torch
+
+from visual_nav.utils.replay_buffer import ReplayBuffer
+from visual_nav.utils.models import model_factory
+from visual_nav.utils.torch_utils import inference_mode
+
+Observation = namedtuple('Observation', ['image', 'goal'])
+BENCHMARKS = ['replay', 'models', 'env']
+IMAGE_SIZE = (84, 84, 1)
+NUM_ACTIONS = 16
+
+
+def measure(function, num_iterations, num_warmup_iterations=0, synchronize=None):
+    """ Time each call of function and return the statistics of the latency in ms """
+    for _ in range(num_warmup_iterations):
+        function()
+    if synchronize is not None:
+        synchronize()
+    latencies = []
+    for _ in range(num_iterations):
+        start = time.perf_counter()
+        function()
+        if synchronize is not None:
+            synchronize()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    return {'mean_ms': float(latencies.mean()), 'median_ms': float(np.median(latencies)),
+            'p90_ms': float(np.percentile(latencies, 90)), 'std_ms': float(latencies.std()),
+            'iterations': num_iterations}
+
+
+def benchmark_key(name, params):
+    """ Key identifying the same benchmark across runs """
+    return name + ''.join('/{}={}'.format(param, value) for param, value in sorted(params.items()))
+
+
+def result(name, params, stats, items_per_call=1):
+    key = benchmark_key(name, params)
+    throughput = items_per_call * 1000 / stats['median_ms'] if stats['median_ms'] > 0 else float('inf')
+    print('{:<60} median {:9.4f}ms, p90 {:9.4f}ms, {:10.1f} per s'.format(key, stats['median_ms'], stats['p90_ms'],
+                                                                        throughput))
+    return dict(stats, key=key, name=name, params=params, throughput_per_s=throughput)
+
+
+def random_observation():
+    image = np.random.randint(0, 256, IMAGE_SIZE, dtype=np.uint8)
+    return Observation(image, (np.random.uniform(0, 6), np.random.uniform(-np.pi, np.pi)))
+
+
+def benchmark_replay(buffer_sizes, frame_history_lens, batch_size, num_iterations, episode_length=50):
+    results = []
+    for size in buffer_sizes:
+        for frame_history_len in frame_history_lens:
+            params = {'size': size, 'frame_history_len': frame_history_len}
+            replay_buffer = ReplayBuffer(size, frame_history_len, IMAGE_SIZE)
+            # images are drawn beforehand so that only storing them is timed, the buffer wraps around once
+            observations = [random_observation() for _ in range(min(size, 1000))]
+            steps = iter(range(size + num_iterations))
+
+            def store():
+                i = next(steps)
+                idx = replay_buffer.store_observation(observations[i % len(observations)])
+                replay_buffer.store_effect(idx, i % NUM_ACTIONS, 0, (i + 1) % episode_length == 0)
+            results.append(result('replay/store', params, measure(store, num_iterations, size)))
+            results.append(result('replay/encode_recent_observation', params,
+                                  measure(replay_buffer.encode_recent_observation, num_iterations)))
+            results.append(result('replay/sample', dict(params, batch_size=batch_size),
+                                  measure(lambda: replay_buffer.sample(batch_size), max(num_iterations // 10, 10)),
+                                  items_per_call=batch_size))
+    return results
+
+
+def benchmark_models(models, batch_sizes, frame_history_lens, device, num_iterations, num_warmup_iterations,
+                     skipped):
+    """ Benchmark models, adding the keys of benchmarks which cannot run to skipped """
+    synchronize = torch.cuda.synchronize if device.type == 'cuda' else None
+    results = []
+    for model_name, frame_history_len in itertools.product(models, frame_history_lens):
+        model = model_factory[model_name](frame_history_len * IMAGE_SIZE[2], NUM_ACTIONS).to(device)
+        for batch_size in batch_sizes:
+            params = {'model': model_name, 'batch_size': batch_size, 'frame_history_len': frame_history_len}
+            frames = torch.rand(batch_size, frame_history_len * IMAGE_SIZE[2], IMAGE_SIZE[0], IMAGE_SIZE[1],
+                                device=device)
+            goals = torch.rand(batch_size, frame_history_len, 2, device=device)
+
+            def forward():
+                with inference_mode():
+                    model(frames, goals)
+
+            def forward_backward():
+                model.zero_grad()
+                model(frames, goals).sum().backward()
+            model.eval()
+            try:
+                forward()
+            except RuntimeError as e:
+                # models of the archive are built for a fixed number of frames
+                print('Skip {} with frame_history_len {}: {}'.format(model_name, frame_history_len, e))
+                skipped += [benchmark_key(name, dict(params, batch_size=size)) for size in batch_sizes
+                            for name in ['models/forward', 'models/forward_backward']]
+                break
+            results.append(result('models/forward', params, measure(forward, num_iterations, num_warmup_iterations,
+                                                                    synchronize), items_per_call=batch_size))
+            model.train()
+            results.append(result('models/forward_backward', params,
+                                  measure(forward_backward, num_iterations, num_warmup_iterations, synchronize),
+                                  items_per_call=batch_size))
+    return results
+
+
+class Vector3r(object):
+    def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0):
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+
+
+class Quaternionr(object):
+    def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0, w_val=1.0):
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+        self.w_val = w_val
+
+
+class Pose(object):
+    def __init__(self, position_val=None, orientation_val=None):
+        self.position = position_val if position_val is not None else Vector3r()
+        self.orientation = orientation_val if orientation_val is not None else Quaternionr()
+
+
+class ImageRequest(object):
+    def __init__(self, camera_name, image_type, pixels_as_float=False, compress=True):
+        self.camera_name = camera_name
+        self.image_type = image_type
+        self.pixels_as_float = pixels_as_float
+        self.compress = compress
+
+
+class ImageResponse(object):
+    def __init__(self):
+        self.image_data_uint8 = b''
+        self.image_data_float = []
+        self.height = 0
+        self.width = 0
+
+
+class CollisionInfo(object):
+    def __init__(self):
+        self.has_collided = False
+
+
+def to_quaternion(pitch, roll, yaw):
+    t0, t1 = math.cos(yaw * 0.5), math.sin(yaw * 0.5)
+    t2, t3 = math.cos(roll * 0.5), math.sin(roll * 0.5)
+    t4, t5 = math.cos(pitch * 0.5), math.sin(pitch * 0.5)
+    return Quaternionr(t0 * t3 * t4 - t1 * t2 * t5, t0 * t2 * t5 + t1 * t3 * t4, t1 * t2 * t4 - t0 * t3 * t5,
+                       t0 * t2 * t4 + t1 * t3 * t5)
+
+
+def to_eularian_angles(q):
+    x, y, z, w = q.x_val, q.y_val, q.z_val, q.w_val
+    roll = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = math.asin(max(-1.0, min(1.0, 2 * (w * y - z * x))))
+    yaw = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    return pitch, roll, yaw
+
+
+def install_stand_in_modules():
+    """
+    Insert a minimal airsim module with the types and conversions VisualSim uses, computed like airsim, so that
+    the env benchmark runs without the simulator or the airsim package and measures the same work everywhere.
+    The action and state types of crowd_sim are stood in as well if it is not installed.
+    """
+    airsim = types.ModuleType('airsim')
+    for value in [Vector3r, Quaternionr, Pose, ImageRequest, ImageResponse, CollisionInfo, to_quaternion,
+                  to_eularian_angles]:
+        setattr(airsim, value.__name__, value)
+    sys.modules['airsim'] = airsim
+
+    if importlib.util.find_spec('crowd_sim') is None:
+        action = types.ModuleType('crowd_sim.envs.utils.action')
+        action.ActionXY = namedtuple('ActionXY', ['vx', 'vy'])
+        action.ActionRot = namedtuple('ActionRot', ['v', 'r'])
+        state = types.ModuleType('crowd_sim.envs.utils.state')
+        # only used for the coordinate observations of crowd_nav policies
+        state.ObservableState = state.FullState = state.JointState = None
+        for name in ['crowd_sim', 'crowd_sim.envs', 'crowd_sim.envs.utils']:
+            sys.modules[name] = types.ModuleType(name)
+        sys.modules[action.__name__] = action
+        sys.modules[state.__name__] = state
+
+
+class StandInClient(object):
+    def __init__(self, image_type, rpc_latency_ms=0):
+        """
+        Stand-in of the airsim client which VisualSim talks to, keeping the poses set by VisualSim and answering
+        image requests with a fixed depth image, optionally after a delay emulating the RPC round trip
+        """
+        from visual_sim.envs.visual_sim import ImageInfo
+        self.rpc_latency = rpc_latency_ms / 1000
+        self.vehicle_pose = Pose(Vector3r(0, 0, -1), to_quaternion(0, 0, 0))
+        self.object_poses = {}
+
+        info = ImageInfo[image_type]
+        rows, cols = np.mgrid[0:IMAGE_SIZE[0], 0:IMAGE_SIZE[1]]
+        depth = 1 + 20 * (1 - rows / IMAGE_SIZE[0]) + np.sin(cols / 10)
+        self.image_response = ImageResponse()
+        self.image_response.height, self.image_response.width = IMAGE_SIZE[:2]
+        # responses hold lists of floats or bytes like those unpacked from msgpack
+        if info.as_float:
+            self.image_response.image_data_float = depth.ravel().tolist()
+        else:
+            image = np.repeat((depth * 10).astype(np.uint8)[:, :, np.newaxis], info.channel_size, axis=2)
+            self.image_response.image_data_uint8 = image.tobytes()
+
+    def _call(self):
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    def reset(self):
+        self._call()
+
+    def simPause(self, is_paused):
+        self._call()
+
+    def simIsPause(self):
+        self._call()
+        return True
+
+    def simContinueForTime(self, seconds):
+        self._call()
+
+    def simGetImages(self, requests):
+        self._call()
+        return [self.image_response for _ in requests]
+
+    def simGetVehiclePose(self):
+        self._call()
+        return self.vehicle_pose
+
+    def simSetVehiclePose(self, pose, ignore_collision):
+        self._call()
+        self.vehicle_pose = pose
+
+    def simGetObjectPose(self, object_name):
+        self._call()
+        return self.object_poses.get(object_name, Pose(Vector3r(3, 1, -1), to_quaternion(0, 0, 0)))
+
+    def simSetObjectPose(self, object_name, pose, teleport=True):
+        self._call()
+        self.object_poses[object_name] = pose
+
+    def simGetCollisionInfo(self):
+        self._call()
+        return CollisionInfo()
+
+
+def benchmark_env(image_types, rpc_latencies_ms, num_iterations, num_warmup_iterations):
+    install_stand_in_modules()
+    from visual_sim.envs.visual_sim import VisualSim
+    results = []
+    for image_type in image_types:
+        for rpc_latency_ms in rpc_latencies_ms:
+            params = {'image_type': image_type, 'rpc_latency_ms': rpc_latency_ms}
+            env = VisualSim(image_type=image_type)
+            env.client = StandInClient(image_type, rpc_latency_ms)
+            env.reset()
+            actions = iter(range(num_iterations + num_warmup_iterations))
+
+            def step():
+                # episodes only end on overtime with the stand-in client, keep the robot near the start
+                _, _, done, _ = env.step(next(actions) % env.action_space.n)
+                if done or env.time > env.max_time / 2:
+                    env.reset()
+            results.append(result('env/step', params, measure(step, num_iterations, num_warmup_iterations)))
+            results.append(result('env/reset', params, measure(env.reset, max(num_iterations // 10, 10))))
+    return results
+
+
+def environment_info(args):
+    """ Versions and machine which results depend on """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'time': time.time(), 'commit': commit or None, 'host': socket.gethostname(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'torch': torch.__version__, 'num_threads': torch.get_num_threads(),
+            'device': args.device, 'cuda_device': torch.cuda.get_device_name() if args.device == 'cuda' else None,
+            'args': vars(args)}
+
+
+def compare(results, skipped, baseline_file, max_slowdown):
+    """
+    Print the change of the median latency of benchmarks also in baseline_file, return the slower ones
+    and those skipped in this run although measured in the baseline
+    """
+    with open(baseline_file, 'r') as fo:
+        baseline = {result['key']: result for result in json.load(fo)['results']}
+    print('Compared to {}:'.format(baseline_file))
+    regressions = []
+    missing = [key for key in skipped if key in baseline]
+    for key in missing:
+        print('{:<60} skipped in this run'.format(key))
+    for result in results:
+        if result['key'] not in baseline:
+            continue
+        ratio = result['median_ms'] / max(baseline[result['key']]['median_ms'], 1e-9)
+        slower = ratio > 1 + max_slowdown
+        print('{:<60} {:9.4f}ms -> {:9.4f}ms {:+7.1%}{}'.format(result['key'], baseline[result['key']]['median_ms'],
+                                                              result['median_ms'], ratio - 1,
+                                                              ' slower' if slower else ''))
+        if slower:
+            regressions.append(result['key'])
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark the replay buffer, models and environment step')
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--output_file', type=str, default='benchmark_results.json')
+    parser.add_argument('--compare', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--max_slowdown', type=float, default=0.1, help='fail if a benchmark is slower by more')
+    parser.add_argument('--buffer_sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--frame_history_lens', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--sample_batch_size', type=int, default=128)
+    parser.add_argument('--models', type=str, nargs='+', default=sorted(model_factory), choices=sorted(model_factory))
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 32, 128])
+    parser.add_argument('--model_frame_history_lens', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--image_types', type=str, nargs='+', default=['DepthPerspective'])
+    parser.add_argument('--rpc_latencies_ms', type=float, nargs='+', default=[0])
+    parser.add_argument('--num_iterations', type=int, default=200)
+    parser.add_argument('--num_warmup_iterations', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cpu', choices=['cpu', 'cuda'])
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    results = []
+    skipped = []
+    if 'replay' in args.benchmarks:
+        results += benchmark_replay(args.buffer_sizes, args.frame_history_lens, args.sample_batch_size,
+                                    args.num_iterations)
+    if 'models' in args.benchmarks:
+        results += benchmark_models(args.models, args.batch_sizes, args.model_frame_history_lens,
+                                    torch.device(args.device), args.num_iterations, args.num_warmup_iterations,
+                                    skipped)
+    if 'env' in args.benchmarks:
+        results += benchmark_env(args.image_types, args.rpc_latencies_ms, args.num_iterations,
+                                 args.num_warmup_iterations)
+
+    with open(args.output_file, 'w') as fo:
+        json.dump({'environment': environment_info(args), 'results': results, 'skipped': skipped}, fo, indent=2)
+    print('Results written to {}'.format(args.output_file))
+
+    if args.compare is not None:
+        regressions, missing = compare(results, skipped, args.compare, args.max_slowdown)
+        if regressions:
+            print('{} benchmarks are slower by more than {:.0%}'.format(len(regressions), args.max_slowdown))
+        if missing:
+            print('{} benchmarks of the baseline were skipped'.format(len(missing)))
+        if regressions or missing:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
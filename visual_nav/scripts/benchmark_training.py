@@ -0,0 +1,75 @@
+"""
+    Measure the update throughput (steps/s) of Trainer in eager and accelerated mode on synthetic experience
+
+    The simulator is not needed: VisualSim is built with the stand-in airsim module of benchmark_suite.py.
+"""
+import argparse
+import time
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from visual_nav.main import Trainer
+from visual_nav.scripts.benchmark_suite import install_stand_in_modules, Observation
+from visual_nav.utils.replay_buffer import ReplayBuffer
+from visual_nav.utils.models import model_factory
+
+
+def fill_replay_buffer(replay_buffer, num_steps, episode_length, num_actions):
+    for i in range(num_steps):
+        image = np.random.randint(0, 256, replay_buffer.image_size, dtype=np.uint8)
+        goal = (np.random.uniform(0, 6), np.random.uniform(-np.pi, np.pi))
+        idx = replay_buffer.store_observation(Observation(image, goal))
+        replay_buffer.store_effect(idx, np.random.randint(num_actions), 0, (i + 1) % episode_length == 0)
+        replay_buffer.store_value(idx, np.random.uniform(-1, 1))
+
+
+def measure(update, num_steps, num_warmup_steps):
+    for _ in range(num_warmup_steps):
+        update()
+    start = time.time()
+    for _ in range(num_steps):
+        update()
+    return num_steps / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark training updates on CPU')
+    parser.add_argument('--models', type=str, nargs='+', default=['gdda', 'plain_cnn'])
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--frame_history_len', type=int, default=1)
+    parser.add_argument('--buffer_size', type=int, default=5000)
+    parser.add_argument('--num_steps', type=int, default=50)
+    parser.add_argument('--num_warmup_steps', type=int, default=5)
+    parser.add_argument('--num_threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device('cpu')
+    install_stand_in_modules()
+    from visual_sim.envs.visual_sim import VisualSim
+    env = VisualSim()
+    output_dir = tempfile.mkdtemp()
+
+    for model in args.models:
+        for accelerate in [False, True]:
+            trainer = Trainer(env, model_factory[model], device, output_dir, batch_size=args.batch_size,
+                              frame_history_len=args.frame_history_len, accelerate=accelerate)
+            trainer.replay_buffer = ReplayBuffer(args.buffer_size, args.frame_history_len, trainer.image_size)
+            fill_replay_buffer(trainer.replay_buffer, args.buffer_size, 40, trainer.num_actions)
+            optimizer = optim.RMSprop(trainer.Q.parameters(), lr=0.00025, alpha=0.95, eps=0.01)
+            criterion = nn.MSELoss()
+
+            td_steps = measure(lambda: trainer._td_update(optimizer), args.num_steps, args.num_warmup_steps)
+            mc_steps = measure(lambda: trainer._mc_update(optimizer, criterion), args.num_steps,
+                               args.num_warmup_steps)
+            print('{:<15} {:<12}: td update {:.2f} steps/s, mc update {:.2f} steps/s'.format(
+                model, 'accelerated' if accelerate else 'eager', td_steps, mc_steps))
+
+
+if __name__ == '__main__':
+    main()
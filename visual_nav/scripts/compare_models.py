@@ -0,0 +1,52 @@
+"""
+    Evaluate several trained models on the same cached scenarios and compare each of them with the first one
+    with paired statistics, which need far fewer episodes than comparing independent test runs
+"""
+import logging
+import argparse
+import functools
+
+import torch
+
+from visual_nav.utils.evaluation import QNetworkPolicy, evaluate, summarize, format_summary, paired_comparison, \
+    format_comparison, make_env
+from visual_nav.utils.models import model_factory
+from visual_nav.utils.scenarios import get_scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare models on identical scenarios')
+    parser.add_argument('--model', type=str, nargs=2, action='append', required=True,
+                        metavar=('MODEL', 'WEIGHTS_FILE'), help='model name in model_factory and its weights')
+    parser.add_argument('--scenarios', type=str, default='data/scenarios.npz')
+    parser.add_argument('--num_scenarios', type=int, default=50)
+    parser.add_argument('--frame_history_len', type=int, default=1)
+    parser.add_argument('--num_actions', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    image_size = (84, 84, 1)
+    scenarios = get_scenarios(args.scenarios, make_env, args.num_scenarios, args.seed)
+
+    model_results = []
+    for model, weights_file in args.model:
+        state_dict = torch.load(weights_file, map_location='cpu')
+        policy_fn = functools.partial(QNetworkPolicy.from_state_dict, model_factory[model], state_dict,
+                                      args.frame_history_len, image_size, args.num_actions)
+        results = evaluate(make_env, policy_fn, args.num_scenarios, args.num_workers, args.seed,
+                           scenarios=scenarios)
+        model_results.append(results)
+
+    for (model, weights_file), results in zip(args.model, model_results):
+        print('{} ({}): {}'.format(model, weights_file, format_summary(summarize(results))))
+    base_model, base_weights_file = args.model[0]
+    for (model, weights_file), results in zip(args.model[1:], model_results[1:]):
+        print('{} ({}) vs {} ({}): {}'.format(model, weights_file, base_model, base_weights_file,
+                                              format_comparison(paired_comparison(model_results[0], results))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+    Compare the action classification accuracy of a trained model in float32 and with bfloat16 autocast
+    on a saved replay buffer
+
+    Optional check of real models and demonstrations, the regression test on a synthetic dataset runs with pytest
+    in tests/test_mixed_precision.py
+"""
+import sys
+import argparse
+
+import torch
+from torch.utils.data.dataloader import DataLoader
+
+from visual_nav.utils.replay_buffer import ReplayBuffer, BufferWrapper, pack_batch
+from visual_nav.utils.models import model_factory
+from visual_nav.utils.torch_utils import autocast, inference_mode
+
+
+def accuracy(model, dataloader, device, mixed_precision):
+    corrects = 0
+    total = 0
+    with inference_mode():
+        for frames_batch, goals_batch, action_batch in dataloader:
+            frames_batch = frames_batch.to(device) / 255.0
+            goals_batch = goals_batch.to(device)
+            action_batch = action_batch.long().to(device)
+            with autocast(device, mixed_precision):
+                predicted_actions = model(frames_batch, goals_batch).float()
+            corrects += torch.sum(predicted_actions.max(1)[1] == action_batch).item()
+            total += frames_batch.size(0)
+    return corrects / total
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare float32 and bfloat16 accuracy on a saved replay buffer')
+    parser.add_argument('replay_buffer_dir', type=str)
+    parser.add_argument('weights_file', type=str)
+    parser.add_argument('--model', type=str, default='dqn')
+    parser.add_argument('--frame_history_len', type=int, default=1)
+    parser.add_argument('--num_actions', type=int, default=16)
+    parser.add_argument('--split', type=str, default='test')
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    image_size = (84, 84, 1)
+    replay_buffer = ReplayBuffer(0, args.frame_history_len, image_size)
+    replay_buffer.load(args.replay_buffer_dir)
+    dataloader = DataLoader(BufferWrapper(replay_buffer, args.split), args.batch_size, collate_fn=pack_batch)
+
+    model = model_factory[args.model](args.frame_history_len * image_size[2], args.num_actions).to(device)
+    model.load_state_dict(torch.load(args.weights_file, map_location=device))
+    model.train(False)
+
+    fp32_acc = accuracy(model, dataloader, device, mixed_precision=False)
+    bf16_acc = accuracy(model, dataloader, device, mixed_precision=True)
+    print('{} accuracy float32: {:.4f}, bfloat16: {:.4f}, difference: {:.4f}'.format(
+        args.split, fp32_acc, bf16_acc, bf16_acc - fp32_acc))
+    if abs(bf16_acc - fp32_acc) > args.tolerance:
+        print('Accuracy difference exceeds tolerance {}'.format(args.tolerance))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
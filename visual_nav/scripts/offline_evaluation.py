@@ -0,0 +1,120 @@
+"""
+    Offline evaluation of trained Q networks on the demonstrations of a saved replay buffer, without the simulator
+
+    Observations are decoded once per batch and fed to all models, which are compared with the expert (SARL)
+    actions stored in the buffer: action agreement overall and along the episode, confusion between actions
+    and statistics of the Q values.
+"""
+import glob
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import DataLoader
+
+from visual_nav.utils.replay_buffer import ReplayBuffer, BufferWrapper, pack_batch
+from visual_nav.utils.models import model_factory
+from visual_nav.utils.torch_utils import inference_mode
+
+
+class OfflineStatistics(object):
+    def __init__(self, num_actions):
+        """ Running statistics of the predictions of one model """
+        self.confusion = np.zeros((num_actions, num_actions), dtype=np.int64)
+        self.episode_steps = []
+        self.agreements = []
+        self.max_q = []
+        self.q_gaps = []
+        self.expert_q_regrets = []
+
+    def update(self, q_values, expert_actions, episode_steps):
+        top2 = np.sort(q_values, axis=1)[:, -2:]
+        predicted_actions = q_values.argmax(axis=1)
+        np.add.at(self.confusion, (expert_actions, predicted_actions), 1)
+        self.episode_steps.append(episode_steps)
+        self.agreements.append(predicted_actions == expert_actions)
+        self.max_q.append(top2[:, 1])
+        self.q_gaps.append(top2[:, 1] - top2[:, 0])
+        self.expert_q_regrets.append(top2[:, 1] - q_values[np.arange(len(q_values)), expert_actions])
+
+    def report(self, step_bin_size):
+        agreements = np.concatenate(self.agreements)
+        episode_steps = np.concatenate(self.episode_steps)
+        max_q = np.concatenate(self.max_q)
+        lines = ['  agreement with expert: {:.4f} on {} steps'.format(agreements.mean(), len(agreements)),
+                 '  max Q: mean {:.4f}, std {:.4f}, min {:.4f}, max {:.4f}'.format(max_q.mean(), max_q.std(),
+                                                                                 max_q.min(), max_q.max()),
+                 '  gap between the top two Q values: mean {:.4f}'.format(np.concatenate(self.q_gaps).mean()),
+                 '  Q of the expert action below max Q: mean {:.4f}'.format(
+                     np.concatenate(self.expert_q_regrets).mean())]
+        bins = episode_steps // step_bin_size
+        step_agreements = ['{}-{}: {:.2f}'.format(b * step_bin_size, (b + 1) * step_bin_size - 1,
+                                                  agreements[bins == b].mean()) for b in np.unique(bins)]
+        lines.append('  agreement by episode step: ' + ', '.join(step_agreements))
+        return '\n'.join(lines)
+
+
+def load_models(model_specs, in_channels, num_actions, device):
+    """ Load (name, weights files glob pattern) pairs into a list of (label, model) """
+    models = []
+    for name, pattern in model_specs:
+        weights_files = sorted(glob.glob(pattern))
+        if not weights_files:
+            raise ValueError('No weights file matches {}'.format(pattern))
+        for weights_file in weights_files:
+            model = model_factory[name](in_channels, num_actions).to(device)
+            model.load_state_dict(torch.load(weights_file, map_location=device))
+            model.train(False)
+            models.append(('{} ({})'.format(name, weights_file), model))
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser('Evaluate models offline on the expert demonstrations of a replay buffer')
+    parser.add_argument('replay_buffer_dir', type=str)
+    parser.add_argument('--model', type=str, nargs=2, action='append', required=True,
+                        metavar=('MODEL', 'WEIGHTS_PATTERN'),
+                        help='model name in model_factory and a glob pattern of weights files, e.g. a sweep')
+    parser.add_argument('--frame_history_len', type=int, default=1)
+    parser.add_argument('--num_actions', type=int, default=16)
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'val', 'test', 'all'])
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_workers', type=int, default=0)
+    parser.add_argument('--step_bin_size', type=int, default=10)
+    parser.add_argument('--show_confusion', default=False, action='store_true')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    image_size = (84, 84, 1)
+    replay_buffer = ReplayBuffer(0, args.frame_history_len, image_size)
+    replay_buffer.load(args.replay_buffer_dir)
+    dataset = BufferWrapper(replay_buffer, args.split)
+    if len(dataset) == 0:
+        raise ValueError('The {} split of {} holds no transitions'.format(args.split, args.replay_buffer_dir))
+    dataloader = DataLoader(dataset, args.batch_size, num_workers=args.num_workers, collate_fn=pack_batch)
+    episode_steps = replay_buffer.episode_step[dataset.idxes]
+
+    models = load_models(args.model, args.frame_history_len * image_size[2], args.num_actions, device)
+    statistics = [OfflineStatistics(args.num_actions) for _ in models]
+    start = 0
+    with inference_mode():
+        for frames_batch, goals_batch, action_batch in dataloader:
+            frames_batch = frames_batch.to(device) / 255.0
+            goals_batch = goals_batch.to(device)
+            expert_actions = action_batch.long().numpy()
+            batch_steps = episode_steps[start:start + len(expert_actions)]
+            start += len(expert_actions)
+            for (_, model), model_statistics in zip(models, statistics):
+                q_values = model(frames_batch, goals_batch).float().cpu().numpy()
+                model_statistics.update(q_values, expert_actions, batch_steps)
+
+    for (label, _), model_statistics in zip(models, statistics):
+        print(label)
+        print(model_statistics.report(args.step_bin_size))
+        if args.show_confusion:
+            print('  confusion (rows: expert actions, columns: predicted actions):')
+            print(model_statistics.confusion)
+
+
+if __name__ == '__main__':
+    main()
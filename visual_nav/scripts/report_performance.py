@@ -1,56 +1,36 @@
+"""
+    Report the imitation learning accuracy, reinforcement learning progress and evaluation of the runs in a directory
+
+    Runs are summarized in parallel from their metrics.jsonl records, or from output.log for older runs, and the
+    summaries are cached so that later reports only read the records appended since.
+"""
 import os
+import json
 import argparse
-import re
+import multiprocessing
 from operator import itemgetter
-from collections import defaultdict, namedtuple
 import numpy as np
 
+from visual_nav.utils.run_logs import summarize_run, EpochLog, TestLog
+
+CACHE_FILE = '.report_cache.json'
+
 
 def running_mean(x, n):
     cumsum = np.cumsum(np.insert(x, 0, 0))
     return (cumsum[n:] - cumsum[:-n]) / float(n)
 
 
-Log = namedtuple('Log', ['epoch', 'train_loss', 'train_acc', 'val_loss', 'val_acc'])
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('target_dir', type=str)
-parser.add_argument('--plot', default=False, action='store_true')
-parser.add_argument('--window_size', type=int, default=5)
-args = parser.parse_args()
-
-models = os.listdir(args.target_dir)
-model_logs = defaultdict(list)
-test_logs = list()
-for model in models:
-    model_dir = os.path.join(args.target_dir, model)
-    log_file = os.path.join(model_dir, 'output.log')
-
-    with open(log_file, 'r') as fo:
-        log = fo.read()
+def summarize_runs(model_dirs, cache, num_workers):
+    """ Summaries of model_dirs updated from their cached summaries, in a pool of num_workers processes """
+    jobs = [(model_dir, cache.get(model_dir)) for model_dir in model_dirs]
+    if num_workers > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(min(num_workers, len(jobs))) as pool:
+            return pool.starmap(summarize_run, jobs)
+    return [summarize_run(*job) for job in jobs]
 
-    epoch_pattern = r"Epoch (?P<epoch>\d+).*\n" \
-                    r".*train Loss: (?P<train_loss>\d+.\d+) Acc: (?P<train_acc>0.\d+).*\n" \
-                    r".*val Loss: (?P<val_loss>\d+.\d+) Acc: (?P<val_acc>0.\d+).*"
 
-    for r in re.findall(epoch_pattern, log):
-        model_logs[model].append(Log(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])))
-
-    test_pattern = r"Best val Acc: (?P<best_val_acc>[0-1].\d+).*\n" \
-                   r".*test Loss: (?P<test_loss>\d+.\d+) Acc: (?P<test_acc>0.\d+)"
-    test_log = re.findall(test_pattern, log)
-    if test_log:
-        test_logs.append((model, float(test_log[0][0]), float(test_log[0][1]), float(test_log[0][2])))
-    else:
-        print('Cannot find test patter in {}'.format(model_dir))
-
-test_logs = sorted(test_logs, key=itemgetter(3), reverse=True)
-for test_log in test_logs:
-    print('{:<15}: best val acc: {:.4f}, test loss: {:.4f}, test acc: {:.4f}'.format(*test_log))
-
-
-if args.plot:
+def plot(model_logs, window_size):
     import matplotlib.pyplot as plt
     fig, axes = plt.subplots(2, 2, figsize=(13, 10))
     axes[0][0].set_title('Train loss')
@@ -64,10 +44,10 @@ if args.plot:
         val_loss = [log.val_loss for log in logs]
         val_acc = [log.val_acc for log in logs]
 
-        train_loss_smooth = running_mean(train_loss, args.window_size)
-        train_acc_smooth = running_mean(train_acc, args.window_size)
-        val_loss_smooth = running_mean(val_loss, args.window_size)
-        val_acc_smooth = running_mean(val_acc, args.window_size)
+        train_loss_smooth = running_mean(train_loss, window_size)
+        train_acc_smooth = running_mean(train_acc, window_size)
+        val_loss_smooth = running_mean(val_loss, window_size)
+        val_acc_smooth = running_mean(val_acc, window_size)
         epochs_smooth = epochs[:len(train_acc_smooth)]
 
         axes[0][0].plot(epochs_smooth, train_loss_smooth)
@@ -81,3 +61,64 @@ if args.plot:
     axes[1][1].legend(model_logs.keys())
 
     plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('target_dir', type=str)
+    parser.add_argument('--plot', default=False, action='store_true')
+    parser.add_argument('--window_size', type=int, default=5)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no_cache', default=False, action='store_true')
+    args = parser.parse_args()
+
+    cache_file = os.path.join(args.target_dir, CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_file) and not args.no_cache:
+        with open(cache_file, 'r') as fo:
+            cache = json.load(fo)
+
+    models = sorted(model for model in os.listdir(args.target_dir)
+                    if os.path.isdir(os.path.join(args.target_dir, model)))
+    model_dirs = [os.path.join(args.target_dir, model) for model in models]
+    summaries = summarize_runs(model_dirs, cache, args.num_workers)
+
+    model_logs = dict()
+    test_logs = list()
+    rl_logs = list()
+    for model, model_dir, summary in zip(models, model_dirs, summaries):
+        if summary is None:
+            print('Cannot find any log in {}'.format(model_dir))
+            continue
+        cache[model_dir] = summary
+        if summary['epochs']:
+            # epochs repeated by a resumed run are reported once
+            model_logs[model] = sorted({epoch[0]: EpochLog(*epoch) for epoch in summary['epochs']}.values())
+        if summary['test']:
+            test_log = TestLog(**summary['test'])
+            test_logs.append((model, test_log.best_val_acc, test_log.test_loss, test_log.test_acc))
+        elif summary['rl'] is None and summary['evaluation'] is None:
+            print('Cannot find test results in {}'.format(model_dir))
+        if summary['rl'] is not None:
+            rl_logs.append((model, summary['rl'], summary['evaluation']))
+
+    with open(cache_file, 'w') as fo:
+        json.dump(cache, fo)
+
+    test_logs = sorted(test_logs, key=itemgetter(3), reverse=True)
+    for test_log in test_logs:
+        print('{:<15}: best val acc: {:.4f}, test loss: {:.4f}, test acc: {:.4f}'.format(*test_log))
+    for model, rl_log, evaluation in rl_logs:
+        text = '{:<15}: step {}, episodes: {}, mean reward: {:.4f}, best mean reward: {:.4f}, ' \
+               'success rate: {:.2f}'.format(model, rl_log['t'], rl_log['episodes'], rl_log['mean_reward'],
+                                             rl_log['best_mean_reward'], rl_log['success_rate'])
+        if evaluation is not None:
+            text += ', test success rate: {:.2f}'.format(evaluation['success_rate'])
+        print(text)
+
+    if args.plot:
+        plot(model_logs, args.window_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+    Run a grid or random search over main.py arguments in parallel, replacing the serial run_jobs*.sh scripts
+
+    Example, comparing the models of run_jobs1.sh and run_jobs2.sh on two GPUs:
+        python visual_nav/scripts/sweep.py data/run7_overfit_single_frame_150_epochs \
+            --grid model=plain_cnn,plain_cnn_mean,gda_no_gef,gda,gdda_no_sie,gdda_no_gef,gdda,gdda_residual \
+            --gpus 0 1
+
+    or a random search of 8 configurations over the discount factor and multi-step returns:
+        python visual_nav/scripts/sweep.py data/run8 --grid gamma=0.9,0.95,0.99 n_step=1,3,5 --num_samples 8 \
+            --set model=gdda with_rl=true --gpus 0 1 --jobs_per_gpu 2
+
+    Each job runs main.py in its own output directory under the sweep directory, and is skipped by later runs
+    of the sweep once it has finished. Each job slot connects to its own simulator, listening on
+    base_port + slot * ports_per_job. Jobs sharing demonstrations, which main.py collects once into
+    data/replay_buffer_<num_episodes> and then only reads, wait for the first of them to collect them.
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import subprocess
+
+from visual_nav.utils.run_logs import summarize_run
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+# default of --num_episodes in main.py, which names the demonstration dataset
+DEFAULT_NUM_EPISODES = '3000'
+DONE_FILE = 'sweep_done.json'
+
+
+def parse_params(params):
+    """ Parse key=value1,value2 strings into a dict of key to list of values """
+    choices = {}
+    for param in params:
+        key, _, values = param.partition('=')
+        if not values:
+            raise ValueError('Expect key=value1,value2 instead of {}'.format(param))
+        choices[key] = values.split(',')
+    return choices
+
+
+def make_configs(grid, num_samples=None, seed=0):
+    """ All configurations of the grid, or num_samples of them drawn at random without replacement """
+    keys = sorted(grid)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+    if num_samples is not None and num_samples < len(configs):
+        configs = random.Random(seed).sample(configs, num_samples)
+    return configs
+
+
+def config_name(config):
+    name = '_'.join('{}-{}'.format(key, value) for key, value in sorted(config.items())) or 'default'
+    return re.sub(r'[^\w.\-]', '', name)
+
+
+def config_args(config):
+    """ Command line arguments of main.py, where true and false switch flags """
+    args = []
+    for key, value in sorted(config.items()):
+        if value.lower() == 'true':
+            args.append('--' + key)
+        elif value.lower() != 'false':
+            args += ['--' + key, value]
+    return args
+
+
+class Job(object):
+    def __init__(self, name, config, output_dir, demonstrations):
+        self.name = name
+        self.config = config
+        self.output_dir = output_dir
+        self.demonstrations = demonstrations
+        self.process = None
+        self.log_file = None
+        self.slot = None
+        self.start_time = None
+
+    def done_file(self):
+        return os.path.join(self.output_dir, DONE_FILE)
+
+    def is_done(self):
+        return os.path.exists(self.done_file())
+
+    def start(self, slot, gpu, sim_port, threads, log_dir, working_dir):
+        args = [sys.executable, MAIN_FILE, '--output_dir', self.output_dir, '--sim_port', str(sim_port)] + \
+            config_args(self.config)
+        # output of an interrupted run of the sweep is kept and its training resumed
+        args += ['--resume'] if os.path.exists(self.output_dir) else ['--overwrite', 'fail']
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        if gpu is not None:
+            env['CUDA_VISIBLE_DEVICES'] = gpu
+        self.log_file = open(os.path.join(log_dir, self.name + '.log'), 'a')
+        self.process = subprocess.Popen(args, stdout=self.log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                        cwd=working_dir, env=env)
+        self.slot = slot
+        self.start_time = time.time()
+        print('Start {} in slot {}{}'.format(self.name, slot, '' if gpu is None else ' on GPU ' + gpu))
+
+    def finish(self):
+        self.log_file.close()
+        duration = time.time() - self.start_time
+        print('{} {} in {:.1f}min'.format(self.name, 'finished' if self.process.returncode == 0 else
+                                          'failed with code {}'.format(self.process.returncode), duration / 60))
+        if self.process.returncode == 0:
+            with open(self.done_file(), 'w') as fo:
+                json.dump({'config': self.config, 'duration': duration}, fo)
+
+
+def run_jobs(jobs, slots, base_port, ports_per_job, threads, log_dir, working_dir):
+    """ Run jobs in slots of (slot, gpu), where jobs collecting missing demonstrations run before those reading them """
+    pending = [job for job in jobs if not job.is_done()]
+    print('{} jobs to run, {} already finished'.format(len(pending), len(jobs) - len(pending)))
+    free_slots = list(slots)
+    running = []
+    collecting = set()
+    failed = []
+    while pending or running:
+        for job in list(pending):
+            if not free_slots:
+                break
+            if not os.path.exists(job.demonstrations):
+                if job.demonstrations in collecting:
+                    continue
+                collecting.add(job.demonstrations)
+            pending.remove(job)
+            slot, gpu = free_slots.pop(0)
+            job.start(slot, gpu, base_port + slot * ports_per_job, threads, log_dir, working_dir)
+            running.append(job)
+
+        time.sleep(1)
+        for job in list(running):
+            if job.process.poll() is None:
+                continue
+            running.remove(job)
+            job.finish()
+            free_slots.append((job.slot, dict(slots)[job.slot]))
+            collecting.discard(job.demonstrations)
+            if job.process.returncode != 0:
+                failed.append(job)
+    return failed
+
+
+def write_results(jobs, keys, results_file):
+    """ Write a table of the configurations and test results of all jobs as csv, and print it """
+    columns = ['name'] + keys + ['status', 'duration_min', 'best_val_acc', 'test_loss', 'test_acc']
+    rows = []
+    for job in jobs:
+        row = dict(job.config, name=job.name, status='not run')
+        summary = summarize_run(job.output_dir) if os.path.exists(job.output_dir) else None
+        if summary is not None:
+            row['status'] = 'failed'
+            if summary['test'] is not None:
+                row.update(summary['test'])
+        if job.is_done():
+            with open(job.done_file()) as fo:
+                row['duration_min'] = '{:.1f}'.format(json.load(fo)['duration'] / 60)
+            row['status'] = 'done'
+        rows.append(row)
+    rows.sort(key=lambda row: -row.get('test_acc', -1))
+
+    with open(results_file, 'w', newline='') as fo:
+        writer = csv.DictWriter(fo, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows:
+        print('{}: '.format(row['name']) +
+              ', '.join('{}: {}'.format(column, row[column]) for column in columns[1:] if column in row))
+    print('Results written to {}'.format(results_file))
+
+
+def main():
+    parser = argparse.ArgumentParser('Run a hyperparameter sweep of main.py')
+    parser.add_argument('sweep_dir', type=str)
+    parser.add_argument('--grid', type=str, nargs='*', default=[], help='key=value1,value2 arguments to sweep')
+    parser.add_argument('--set', type=str, nargs='*', default=[], help='key=value arguments of all jobs')
+    parser.add_argument('--num_samples', type=int, default=None, help='random search over the grid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gpus', type=str, nargs='*', default=[])
+    parser.add_argument('--jobs_per_gpu', type=int, default=1)
+    parser.add_argument('--threads_per_job', type=int, default=4)
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='number of parallel jobs without GPUs, available cores / threads_per_job by default')
+    parser.add_argument('--base_port', type=int, default=41451)
+    parser.add_argument('--ports_per_job', type=int, default=1)
+    parser.add_argument('--working_dir', type=str, default=os.path.dirname(MAIN_FILE),
+                        help='directory holding the data directory of main.py')
+    args = parser.parse_args()
+
+    grid = parse_params(args.grid)
+    fixed = dict(param.split('=', 1) for param in args.set)
+    configs = make_configs(grid, args.num_samples, args.seed)
+    jobs = []
+    for config in configs:
+        name = config_name(config)
+        config = dict(fixed, **config)
+        demonstrations = os.path.join(args.working_dir, 'data',
+                                      'replay_buffer_' + config.get('num_episodes', DEFAULT_NUM_EPISODES))
+        jobs.append(Job(name, config, os.path.abspath(os.path.join(args.sweep_dir, name)), demonstrations))
+
+    if args.gpus:
+        slots = [(i, gpu) for i, gpu in enumerate(args.gpus * args.jobs_per_gpu)]
+    else:
+        num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        num_workers = args.num_workers or max(1, num_cores // args.threads_per_job)
+        slots = [(i, None) for i in range(num_workers)]
+    log_dir = os.path.join(args.sweep_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    failed = run_jobs(jobs, slots, args.base_port, args.ports_per_job, args.threads_per_job, log_dir,
+                      args.working_dir)
+    write_results(jobs, sorted(set(grid) | set(fixed)), os.path.join(args.sweep_dir, 'results.csv'))
+    if failed:
+        print('Failed jobs: {}, see their logs in {}'.format(', '.join(job.name for job in failed), log_dir))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import glob
+import queue
+import shutil
+import logging
+import threading
+
+import torch
+
+from visual_nav.utils.torch_utils import snapshot_state
+
+
+class CheckpointWriter(object):
+    def __init__(self, keep_last_n=0, max_pending=2):
+        """
+        Write checkpoints in a background thread, so that slow filesystems never block training
+
+        State is copied to CPU on the calling thread, then serialized to a temporary file which is atomically
+        renamed, so that a preempted job leaves either the previous or the new checkpoint but no torn file.
+        Jobs run in submission order, and saving blocks while max_pending jobs wait, which bounds the memory
+        held by snapshots. With keep_last_n, a copy of each checkpoint saved with a step is kept next to it,
+        and copies older than the last keep_last_n are deleted.
+        """
+        self.keep_last_n = keep_last_n
+        self.error = None
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._run, name='checkpoint_writer', daemon=True)
+        self.thread.start()
+
+    def save(self, state, path, step=None):
+        """ Snapshot state, which can nest tensors in dicts, lists and tuples, and queue it to be saved to path """
+        self.submit(self._write, snapshot_state(state), path, step)
+
+    def submit(self, function, *args):
+        """ Queue function(*args) behind the pending checkpoints, e.g. to write files a checkpoint refers to """
+        self._raise_error()
+        self.queue.put((function, args))
+
+    def wait(self):
+        """ Block until all queued checkpoints are written, raising the first error of the writer thread """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Fail to write checkpoint') from error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    break
+                function, args = job
+                function(*args)
+            except Exception as e:
+                logging.error('Fail to write checkpoint: {}'.format(e))
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, state, path, step):
+        tmp_file = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+        logging.info('Checkpoint saved to {}'.format(path))
+        if step is not None and self.keep_last_n:
+            self._keep_copy(path, step)
+
+    def _keep_copy(self, path, step):
+        root, ext = os.path.splitext(path)
+        copy_file = '{}-{:09d}{}'.format(root, step, ext)
+        if os.path.exists(copy_file):
+            os.remove(copy_file)
+        try:
+            # the checkpoint file is replaced and never modified, so a hard link is a safe copy
+            os.link(path, copy_file)
+        except OSError:
+            shutil.copyfile(path, copy_file)
+        copies = sorted(glob.glob(glob.escape(root) + '-' + '[0-9]' * 9 + ext))
+        for old_copy in copies[:-self.keep_last_n]:
+            os.remove(old_copy)
@@ -0,0 +1,203 @@
+import os
+import glob
+import time
+import logging
+
+import gym
+import numpy as np
+
+
+END_SIGNALS = ['Success', 'Collision', 'Overtime']
+
+
+class EpisodeStatistics(object):
+    fields = ['success', 'collision', 'overtime', 'length', 'reward']
+
+    def __init__(self, initial_capacity=1024):
+        """
+        Prefix sums of episode statistics, so that the mean over the last episodes since any episode
+        takes constant time. The array grows geometrically, which is amortized O(1) per episode.
+        """
+        # row i holds the sums over the first i episodes
+        self.prefix_sums = np.zeros((initial_capacity + 1, len(self.fields)), dtype=np.float64)
+        self.num_episodes = 0
+
+    def __len__(self):
+        return self.num_episodes
+
+    def add(self, success, collision, overtime, length, reward):
+        if self.num_episodes + 1 == len(self.prefix_sums):
+            prefix_sums = np.zeros((2 * len(self.prefix_sums) - 1, len(self.fields)), dtype=np.float64)
+            prefix_sums[:len(self.prefix_sums)] = self.prefix_sums
+            self.prefix_sums = prefix_sums
+        self.prefix_sums[self.num_episodes + 1] = self.prefix_sums[self.num_episodes] + \
+            (success, collision, overtime, length, reward)
+        self.num_episodes += 1
+
+    def mean(self, field, num_last_episodes, episode_starts=0):
+        """ Mean of field over the last num_last_episodes episodes since episode_starts, nan if there is none """
+        start = max(episode_starts, self.num_episodes - num_last_episodes)
+        if start >= self.num_episodes:
+            return float('nan')
+        column = self.fields.index(field)
+        return (self.prefix_sums[self.num_episodes, column] - self.prefix_sums[start, column]) / \
+            (self.num_episodes - start)
+
+
+class EpisodeSummaryMixin(object):
+    """
+    Episode statistics queries shared by monitors, which need statistics, time_step, last_done_info,
+    get_episode_lengths and get_episode_rewards
+    """
+    def get_success_rate(self, num_last_episodes, episode_starts=0):
+        return self.statistics.mean('success', num_last_episodes, episode_starts)
+
+    def get_collision_rate(self, num_last_episodes, episode_starts=0):
+        return self.statistics.mean('collision', num_last_episodes, episode_starts)
+
+    def get_overtime_rate(self, num_last_episodes, episode_starts=0):
+        return self.statistics.mean('overtime', num_last_episodes, episode_starts)
+
+    def get_average_time(self, num_last_episodes, episode_starts=0):
+        return self.statistics.mean('length', num_last_episodes, episode_starts) * self.time_step
+
+    def get_average_reward(self, num_last_episodes, episode_starts=0):
+        return self.statistics.mean('reward', num_last_episodes, episode_starts)
+
+    def get_episodes_summary(self, num_last_episodes):
+        success_rate = self.get_success_rate(num_last_episodes)
+        collision_rate = self.get_collision_rate(num_last_episodes)
+        overtime_rates = self.get_overtime_rate(num_last_episodes)
+        avg_time = self.get_average_time(num_last_episodes)
+        avg_reward = self.get_average_reward(num_last_episodes)
+
+        return 'Success: {:.2f}, collision: {:.2f}, overtime: {:.2f}, avg steps: {:.2f}s, avg reward: {:.4f}'.\
+            format(success_rate, collision_rate, overtime_rates, avg_time, avg_reward)
+
+    def get_episode_summary(self, ):
+        return 'Episode finished in {}s with total reward {:.4f} and end signal {}'.\
+                 format(self.get_episode_lengths()[-1] * self.time_step,
+                        self.get_episode_rewards()[-1], self.last_done_info)
+
+
+class EpisodeMonitor(EpisodeSummaryMixin, gym.Wrapper):
+    def __init__(self, env, directory, flush_every_n_episodes=100, initial_capacity=1024):
+        """
+        Lightweight replacement of gym Monitor, which only counts steps and rewards in step
+
+        Finished episodes are recorded in numpy arrays and appended to directory in batches of
+        flush_every_n_episodes episodes, as columnar npz files to be read by load_episodes.
+        """
+        super().__init__(env)
+        self.directory = directory
+        self.flush_every_n_episodes = flush_every_n_episodes
+        self.time_step = env.time_step
+        self.max_time = env.max_time
+        self.statistics = EpisodeStatistics(initial_capacity)
+        self.last_done_info = ''
+
+        self.total_steps = 0
+        self.episode_steps = 0
+        self.episode_reward = 0.0
+        self.num_episodes = 0
+        self.num_flushed = 0
+        self.episode_lengths = np.zeros(initial_capacity, dtype=np.int32)
+        self.episode_rewards = np.zeros(initial_capacity, dtype=np.float64)
+        # index of the end signal in END_SIGNALS, or -1 for other signals
+        self.end_signals = np.zeros(initial_capacity, dtype=np.int8)
+        self.timestamps = np.zeros(initial_capacity, dtype=np.float64)
+        # files of different runs in the same directory are told apart by the start time
+        self.file_prefix = os.path.join(directory, 'episodes.{}'.format(int(time.time() * 1000)))
+        os.makedirs(directory, exist_ok=True)
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        self.total_steps += 1
+        self.episode_steps += 1
+        self.episode_reward += reward
+        if done:
+            self._record_episode(info)
+        return observation, reward, done, info
+
+    def reset(self, **kwargs):
+        self.episode_steps = 0
+        self.episode_reward = 0.0
+        return self.env.reset(**kwargs)
+
+    def _record_episode(self, info):
+        if self.num_episodes == len(self.episode_lengths):
+            for name in ['episode_lengths', 'episode_rewards', 'end_signals', 'timestamps']:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.episode_lengths[self.num_episodes] = self.episode_steps
+        self.episode_rewards[self.num_episodes] = self.episode_reward
+        self.end_signals[self.num_episodes] = END_SIGNALS.index(info) if info in END_SIGNALS else -1
+        self.timestamps[self.num_episodes] = time.time()
+        self.num_episodes += 1
+        self.statistics.add(info == 'Success', info == 'Collision', info == 'Overtime', self.episode_steps,
+                            self.episode_reward)
+        self.last_done_info = info
+        if self.num_episodes - self.num_flushed >= self.flush_every_n_episodes:
+            self.flush()
+
+    def flush(self):
+        """ Write the episodes recorded since the last flush into a new npz file """
+        if self.num_episodes == self.num_flushed:
+            return
+        episodes = slice(self.num_flushed, self.num_episodes)
+        np.savez(self.file_prefix + '.{:08d}.npz'.format(self.num_flushed),
+                 episode_lengths=self.episode_lengths[episodes], episode_rewards=self.episode_rewards[episodes],
+                 end_signals=self.end_signals[episodes], timestamps=self.timestamps[episodes],
+                 time_step=self.time_step)
+        self.num_flushed = self.num_episodes
+
+    def close(self):
+        self.flush()
+        return super().close()
+
+    def state_dict(self):
+        """ Copy of the recorded episodes, to resume monitoring from a checkpoint """
+        return {'total_steps': self.total_steps, 'num_episodes': self.num_episodes, 'num_flushed': self.num_flushed,
+                'episode_lengths': self.episode_lengths[:self.num_episodes].copy(),
+                'episode_rewards': self.episode_rewards[:self.num_episodes].copy(),
+                'end_signals': self.end_signals[:self.num_episodes].copy(),
+                'timestamps': self.timestamps[:self.num_episodes].copy(),
+                'prefix_sums': self.statistics.prefix_sums[:self.num_episodes + 1].copy(),
+                'last_done_info': self.last_done_info}
+
+    def load_state_dict(self, state):
+        """ Restore recorded episodes, where episodes flushed by the previous run are not written again """
+        self.total_steps = state['total_steps']
+        self.num_episodes = state['num_episodes']
+        self.num_flushed = state['num_flushed']
+        capacity = max(len(self.episode_lengths), self.num_episodes)
+        for name in ['episode_lengths', 'episode_rewards', 'end_signals', 'timestamps']:
+            array = np.zeros(capacity, dtype=getattr(self, name).dtype)
+            array[:self.num_episodes] = state[name]
+            setattr(self, name, array)
+        self.statistics.prefix_sums = np.zeros((capacity + 1, len(EpisodeStatistics.fields)), dtype=np.float64)
+        self.statistics.prefix_sums[:self.num_episodes + 1] = state['prefix_sums']
+        self.statistics.num_episodes = self.num_episodes
+        self.last_done_info = state['last_done_info']
+
+    def get_total_steps(self):
+        return self.total_steps
+
+    def get_episode_rewards(self):
+        return self.episode_rewards[:self.num_episodes]
+
+    def get_episode_lengths(self):
+        return self.episode_lengths[:self.num_episodes]
+
+
+def load_episodes(directory):
+    """ Concatenate episodes flushed by EpisodeMonitor in directory, ordered by their timestamps """
+    files = sorted(glob.glob(os.path.join(directory, 'episodes.*.npz')))
+    if not files:
+        logging.warning('No episodes found in {}'.format(directory))
+        return None
+    columns = ['episode_lengths', 'episode_rewards', 'end_signals', 'timestamps']
+    batches = [np.load(file) for file in files]
+    episodes = {column: np.concatenate([batch[column] for batch in batches]) for column in columns}
+    order = np.argsort(episodes['timestamps'], kind='stable')
+    return {column: values[order] for column, values in episodes.items()}
@@ -0,0 +1,239 @@
+"""
+    Evaluation of navigation policies on test cases, which can be spread over a pool of environment workers
+
+    A policy has reset() called at the beginning of each episode and act(env, obs) returning the action
+    to take. Each test case is run with a fixed seed, so that results do not depend on the number of workers.
+    Test cases can also replay recorded scenarios, so that policies are compared on identical episodes.
+
+    The simulator client and crowd_nav are only imported when an environment or SARL policy is built, so that
+    spawned workers and scripts comparing results start quickly.
+"""
+import os
+import math
+import random
+import logging
+import contextlib
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import torch
+
+from visual_nav.utils.frame_history import FrameHistory
+from visual_nav.utils.torch_utils import inference_mode
+
+EpisodeResult = namedtuple('EpisodeResult', ['case', 'signal', 'time', 'reward', 'steps'])
+EvaluationSummary = namedtuple('EvaluationSummary', ['num_cases', 'success_rate', 'collision_rate', 'overtime_rate',
+                                                     'avg_time', 'time_percentiles', 'avg_reward', 'reward_std',
+                                                     'reward_percentiles'])
+PairedComparison = namedtuple('PairedComparison', ['num_cases', 'success_diff', 'only_a_success', 'only_b_success',
+                                                   'success_p_value', 'reward_diff', 'reward_diff_ci'])
+PERCENTILES = (10, 50, 90)
+
+
+def make_env(worker_id=0, base_port=41451, human_num=None, **kwargs):
+    """ VisualSim connecting to the simulator listening on base_port + worker_id """
+    from visual_sim.envs.visual_sim import VisualSim
+    env = VisualSim(port=base_port + worker_id, **kwargs)
+    if human_num is not None:
+        env.human_num = human_num
+    return env
+
+
+class QNetworkPolicy(object):
+    def __init__(self, model, frame_history_len, image_size, device=torch.device('cpu')):
+        """ Greedy policy of a Q network over the recent frame history """
+        self.model = model
+        self.device = device
+        self.frame_history = FrameHistory(frame_history_len, image_size)
+
+    @classmethod
+    def from_state_dict(cls, q_func, state_dict, frame_history_len, image_size, num_actions, env=None):
+        """ Build the Q network in a worker, where env is passed by evaluate and not needed """
+        model = q_func(frame_history_len * image_size[2], num_actions)
+        model.load_state_dict(state_dict)
+        model.train(False)
+        return cls(model, frame_history_len, image_size)
+
+    def reset(self):
+        self.frame_history.reset()
+
+    def act(self, env, obs):
+        self.frame_history.append(obs)
+        frames, goals = self.frame_history.encode()
+        frames = torch.from_numpy(frames).unsqueeze(0).to(self.device) / 255.0
+        goals = torch.from_numpy(goals).unsqueeze(0).to(self.device)
+        with inference_mode():
+            return self.model(frames, goals).max(1)[1].item()
+
+
+def load_sarl(model_dir, time_step):
+    """ Load a trained SARL policy for testing on CPU """
+    import configparser
+    from crowd_nav.policy.sarl import SARL
+    assert os.path.exists(model_dir)
+    policy = SARL()
+    policy.epsilon = 0
+    policy_config = configparser.RawConfigParser()
+    policy_config.read(os.path.join(model_dir, 'policy.config'))
+    policy.configure(policy_config)
+    policy.model.load_state_dict(torch.load(os.path.join(model_dir, 'rl_model.pth'), map_location='cpu'))
+
+    policy.set_device(torch.device('cpu'))
+    policy.set_phase('test')
+    policy.time_step = time_step
+    return policy
+
+
+class CrowdNavPolicy(object):
+    def __init__(self, policy, with_fov=False):
+        """ Policy from crowd_nav such as SARL or ORCA, acting on the coordinates of the robot and humans """
+        self.policy = policy
+        self.with_fov = with_fov
+
+    def reset(self):
+        pass
+
+    def act(self, env, obs):
+        return self.policy.predict(env.unwrapped.compute_coordinate_observation(self.with_fov))
+
+
+def make_sarl_policy(model_dir, with_fov=False, env=None):
+    return CrowdNavPolicy(load_sarl(model_dir, env.unwrapped.time_step), with_fov)
+
+
+@contextlib.contextmanager
+def preserved_random_state():
+    """ Restore the state of the global random generators on exit, which test cases reseed """
+    python_state, numpy_state, torch_state = random.getstate(), np.random.get_state(), torch.get_rng_state()
+    cuda_states = torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+    try:
+        yield
+    finally:
+        random.setstate(python_state)
+        np.random.set_state(numpy_state)
+        torch.set_rng_state(torch_state)
+        if cuda_states is not None:
+            torch.cuda.set_rng_state_all(cuda_states)
+
+
+def run_case(env, policy, case, seed=0, step_callback=None, scenario=None):
+    """ Run test case with seed + case as the seed of all random generators, replaying scenario if given """
+    random.seed(seed + case)
+    np.random.seed(seed + case)
+    torch.manual_seed(seed + case)
+
+    env.unwrapped.scenario = scenario
+    obs = env.reset()
+    policy.reset()
+    done = False
+    info = ''
+    total_reward = 0
+    steps = 0
+    while not done:
+        action = policy.act(env, obs)
+        if step_callback is not None:
+            step_callback(env, obs, action)
+        obs, reward, done, info = env.step(action)
+        total_reward += reward
+        steps += 1
+    time = env.unwrapped.time
+    logging.info('Case {} ends with signal: {} in {}s'.format(case, info, time))
+    return EpisodeResult(case, info, time, total_reward, steps)
+
+
+def _run_cases(env_fn, policy_fn, worker_id, cases, seed, scenarios):
+    torch.set_num_threads(1)
+    env = env_fn(worker_id)
+    policy = policy_fn(env)
+    return [run_case(env, policy, case, seed, scenario=scenario) for case, scenario in zip(cases, scenarios)]
+
+
+def evaluate(env_fn, policy_fn, num_cases, num_workers=1, seed=0, env=None, policy=None, step_callback=None,
+             scenarios=None):
+    """
+    Run num_cases test cases and return their results ordered by case, where case i replays scenarios[i]
+    if scenarios are given
+
+    With one worker, cases run in this process, with env and policy if given. Otherwise test cases are
+    sharded over num_workers processes, each building its env with env_fn(worker_id) and its policy with
+    policy_fn(env), so both factories need to be picklable, e.g. functools.partial of module level functions.
+    """
+    if scenarios is None:
+        scenarios = [None] * num_cases
+    assert len(scenarios) >= num_cases
+    if num_workers <= 1:
+        env = env_fn(0) if env is None else env
+        policy = policy_fn(env) if policy is None else policy
+        # the caller, e.g. a training loop, keeps its random sequence and its env generates new scenarios
+        with preserved_random_state():
+            try:
+                return [run_case(env, policy, case, seed, step_callback, scenarios[case])
+                        for case in range(num_cases)]
+            finally:
+                env.unwrapped.scenario = None
+
+    shards = [list(range(worker_id, num_cases, num_workers)) for worker_id in range(num_workers)]
+    # spawn instead of fork, since the simulator client and torch threads do not survive forking
+    with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+        shard_results = pool.starmap(_run_cases, [(env_fn, policy_fn, worker_id, shard, seed,
+                                                   [scenarios[case] for case in shard])
+                                                  for worker_id, shard in enumerate(shards)])
+    return sorted([result for results in shard_results for result in results], key=lambda result: result.case)
+
+
+def summarize(results):
+    """ Aggregate episode results, where times are averaged over successful episodes like the baselines """
+    signals = np.array([result.signal for result in results])
+    times = np.array([result.time for result in results if result.signal == 'Success'])
+    rewards = np.array([result.reward for result in results])
+    return EvaluationSummary(num_cases=len(results),
+                             success_rate=np.mean(signals == 'Success'),
+                             collision_rate=np.mean(signals == 'Collision'),
+                             overtime_rate=np.mean(signals == 'Overtime'),
+                             avg_time=np.mean(times) if len(times) else 0,
+                             time_percentiles=tuple(np.percentile(times, PERCENTILES)) if len(times) else None,
+                             avg_reward=np.mean(rewards),
+                             reward_std=np.std(rewards),
+                             reward_percentiles=tuple(np.percentile(rewards, PERCENTILES)))
+
+
+def format_summary(summary):
+    text = 'Success: {:.2f}, collision: {:.2f}, overtime: {:.2f}, average time: {:.2f}s, ' \
+           'average reward: {:.4f} (std {:.4f})'.format(summary.success_rate, summary.collision_rate,
+                                                       summary.overtime_rate, summary.avg_time, summary.avg_reward,
+                                                       summary.reward_std)
+    if summary.time_percentiles is not None:
+        text += ', time p{}/p{}/p{}: {:.2f}/{:.2f}/{:.2f}s'.format(*(PERCENTILES + summary.time_percentiles))
+    return text
+
+
+def paired_comparison(results_a, results_b):
+    """
+    Compare two policies evaluated on the same test cases, which removes the variance between cases
+
+    The success rate difference is tested with the exact McNemar test on the cases where only one policy
+    succeeds, and the mean reward difference comes with a 95% normal confidence interval.
+    """
+    assert [result.case for result in results_a] == [result.case for result in results_b]
+    success_a = np.array([result.signal == 'Success' for result in results_a])
+    success_b = np.array([result.signal == 'Success' for result in results_b])
+    only_a = int(np.sum(success_a & ~success_b))
+    only_b = int(np.sum(success_b & ~success_a))
+    # two-sided binomial test of the discordant pairs with p = 0.5
+    discordant = only_a + only_b
+    tail = sum(math.comb(discordant, k) for k in range(min(only_a, only_b) + 1)) / 2 ** discordant
+    p_value = min(1.0, 2 * tail) if discordant else 1.0
+
+    reward_diffs = np.array([b.reward - a.reward for a, b in zip(results_a, results_b)])
+    half_width = 1.96 * np.std(reward_diffs, ddof=1) / np.sqrt(len(reward_diffs)) if len(reward_diffs) > 1 else 0
+    reward_diff = np.mean(reward_diffs)
+    return PairedComparison(len(results_a), np.mean(success_b) - np.mean(success_a), only_a, only_b, p_value,
+                            reward_diff, (reward_diff - half_width, reward_diff + half_width))
+
+
+def format_comparison(comparison):
+    return 'success diff: {:+.2f} ({} vs {} cases with a single success, McNemar p={:.4f}), ' \
+           'reward diff: {:+.4f} (95% CI {:+.4f}, {:+.4f})'.format(
+               comparison.success_diff, comparison.only_b_success, comparison.only_a_success,
+               comparison.success_p_value, comparison.reward_diff, *comparison.reward_diff_ci)
@@ -0,0 +1,82 @@
+import os
+import sys
+import shutil
+import logging
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# what to do with an existing directory
+#     ask: prompt on the terminal and keep the directory unless the answer is y, fail without a terminal
+#     overwrite: delete the directory and start anew
+#     resume: keep the directory and its content
+#     fail: raise FileExistsError
+OVERWRITE_POLICIES = ['ask', 'overwrite', 'resume', 'fail']
+
+# lock files held by this process, mapped to their open files and nesting depths
+_held_locks = {}
+
+
+def prepare_dir(directory, overwrite='ask', description='Directory'):
+    """ Create directory, applying the overwrite policy if it exists, and return True if its content is kept """
+    if overwrite not in OVERWRITE_POLICIES:
+        raise ValueError('Unknown overwrite policy {}, expected one of {}'.format(overwrite, OVERWRITE_POLICIES))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+        return False
+
+    if overwrite == 'ask':
+        if not sys.stdin.isatty():
+            raise FileExistsError('{} {} already exists and there is no terminal to ask whether to overwrite it, '
+                                  'choose an overwrite policy among {}'.format(description, directory,
+                                                                               OVERWRITE_POLICIES[1:]))
+        key = input('{} {} already exists! Overwrite it? (y/n)'.format(description, directory))
+        overwrite = 'overwrite' if key == 'y' else 'resume'
+    if overwrite == 'fail':
+        raise FileExistsError('{} {} already exists'.format(description, directory))
+    elif overwrite == 'overwrite':
+        logging.info('Overwrite {} {}'.format(description.lower(), directory))
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+        return False
+    else:
+        return True
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """
+    Advisory lock of path, held on a lock file beside it with flock, so that jobs sharing path wait for each other
+
+    Readers can share the lock while a writer holds it exclusively. Locks of the same path nested in a process
+    keep the outer lock. Without fcntl, e.g. on Windows, no lock is taken.
+    """
+    lock_file = os.path.abspath(path).rstrip(os.sep) + '.lock'
+    if fcntl is None:
+        yield
+        return
+    if lock_file in _held_locks:
+        _held_locks[lock_file][1] += 1
+        try:
+            yield
+        finally:
+            _held_locks[lock_file][1] -= 1
+        return
+
+    os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    with open(lock_file, 'a') as f:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(f, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info('Wait for another job holding {}'.format(lock_file))
+            fcntl.flock(f, mode)
+        _held_locks[lock_file] = [f, 1]
+        try:
+            yield
+        finally:
+            del _held_locks[lock_file]
+            fcntl.flock(f, fcntl.LOCK_UN)
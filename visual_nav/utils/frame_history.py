@@ -0,0 +1,43 @@
+import numpy as np
+
+from visual_nav.utils.replay_buffer import preprocess_frame
+
+
+class FrameHistory(object):
+    def __init__(self, frame_history_len, image_size):
+        """
+        Most recent frame_history_len frames and goals of the ongoing episode, for acting without a replay buffer
+
+        Frames and goals are preallocated in a ring of twice the history length, where each frame is written
+        at both i and i + frame_history_len, so that the history is always a contiguous slice and encoding it
+        allocates nothing. Missing context at the beginning of an episode is zero padded like
+        ReplayBuffer.encode_recent_observation.
+        """
+        img_h, img_w, img_c = image_size
+        self.frame_history_len = frame_history_len
+        self.image_size = image_size
+        self.frames = np.zeros((2 * frame_history_len, img_c, img_h, img_w), dtype=np.float32)
+        self.goals = np.zeros((2 * frame_history_len, 2), dtype=np.float32)
+        # position of the oldest frame in the history, where the next frame is written
+        self.next_idx = 0
+
+    def reset(self):
+        self.frames.fill(0)
+        self.goals.fill(0)
+        self.next_idx = 0
+
+    def append(self, ob):
+        frame = preprocess_frame(ob.image, self.image_size)
+        for idx in (self.next_idx, self.next_idx + self.frame_history_len):
+            self.frames[idx] = frame
+            self.goals[idx] = ob.goal
+        self.next_idx = (self.next_idx + 1) % self.frame_history_len
+
+    def encode(self):
+        """
+        Return views of frames of shape (img_c * frame_history_len, img_h, img_w) and goals of shape
+        (frame_history_len, 2), which are overwritten by the next append
+        """
+        end_idx = self.next_idx + self.frame_history_len
+        frames = self.frames[self.next_idx:end_idx]
+        return frames.reshape((-1,) + frames.shape[2:]), self.goals[self.next_idx:end_idx]
@@ -0,0 +1,76 @@
+import time
+import queue
+import logging
+import threading
+
+
+class MetricsLogger(object):
+    def __init__(self, writer, log_interval=100, batch_size=50, max_queue_size=100):
+        """
+        Log scalars to a tensorboardX SummaryWriter at most every log_interval steps
+
+        Scalars are buffered and handed over in batches of batch_size records to a background thread,
+        which is the only one writing to the SummaryWriter, so that event file writes never block training.
+        Time spent on the training thread is accumulated in overhead, to check the cost per step.
+        """
+        self.writer = writer
+        self.log_interval = log_interval
+        self.batch_size = batch_size
+        self.next_log_step = 0
+        self.pending = []
+        self.overhead = 0
+        self.queue = queue.Queue(max_queue_size)
+        self.thread = threading.Thread(target=self._write, name='metrics_writer', daemon=True)
+        self.thread.start()
+
+    def due(self, step):
+        """ Return True if scalars should be logged at step, which also works if steps are skipped """
+        if step < self.next_log_step:
+            return False
+        self.next_log_step = step + self.log_interval
+        return True
+
+    def log(self, scalars, step):
+        """ Buffer a dict of scalars for step """
+        start = time.perf_counter()
+        self.pending.append((step, scalars))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        self.overhead += time.perf_counter() - start
+
+    def flush(self):
+        if self.pending:
+            self.queue.put(('scalars', self.pending))
+            self.pending = []
+
+    def export_scalars_to_json(self, path):
+        """ Export scalars logged so far, in the writer thread since it owns the SummaryWriter """
+        start = time.perf_counter()
+        self.flush()
+        self.queue.put(('export', path))
+        self.overhead += time.perf_counter() - start
+
+    def _write(self):
+        while True:
+            command, value = self.queue.get()
+            try:
+                if command == 'scalars':
+                    for step, scalars in value:
+                        for tag, scalar in scalars.items():
+                            self.writer.add_scalar(tag, scalar, step)
+                elif command == 'export':
+                    self.writer.export_scalars_to_json(value)
+                    logging.info('Saved to {}'.format(value))
+                else:
+                    break
+            except Exception as e:
+                logging.error('Fail to write metrics: {}'.format(e))
+
+    def close(self, num_steps=None):
+        """ Write the remaining scalars and close the writer, logging the overhead per step if num_steps is given """
+        self.flush()
+        self.queue.put(('close', None))
+        self.thread.join()
+        self.writer.close()
+        if num_steps:
+            logging.info('Metrics logging overhead: {:.2f}us per step'.format(self.overhead / num_steps * 1e6))
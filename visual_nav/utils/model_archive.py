@@ -24,7 +24,7 @@ class DQN(nn.Module):
         frames = F.relu(self.conv1(frames))
         frames = F.relu(self.conv2(frames))
         frames = F.relu(self.conv3(frames))
-        frames = F.relu(self.fc4(frames.view(frames.size(0), -1)))
+        frames = F.relu(self.fc4(frames.reshape(frames.size(0), -1)))
         features = torch.cat([frames, goals.view(goals.size(0), -1)], dim=1)
         return self.fc5(features)
 
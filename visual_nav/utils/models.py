@@ -3,9 +3,11 @@ from visual_nav.utils.model_archive import *
 
 class GDNet(nn.Module):
     def __init__(self, in_channels=4, num_actions=18, with_sa=True, with_ga=True, goal_embedding_as_feature=False,
-                 share_image_embedding=False, mean_pool_feature_map=False, residual_connection=False):
+                 share_image_embedding=False, mean_pool_feature_map=False, residual_connection=False, dueling=False):
         """
         A base network architecture for goal-driven tasks
+
+        If dueling is True, Q values are computed from separate state value and advantage streams
         """
         super(GDNet, self).__init__()
         self.with_sa = with_sa
@@ -14,6 +16,7 @@ class GDNet(nn.Module):
         self.share_image_embedding = share_image_embedding
         self.mean_pool_feature_map = mean_pool_feature_map
         self.residual_connection = residual_connection
+        self.dueling = dueling
         self.conv1 = nn.Conv2d(in_channels, 32, kernel_size=8, stride=4)
         self.conv2 = nn.Conv2d(32, 64, kernel_size=4, stride=2)
         self.conv3 = nn.Conv2d(64, 64, kernel_size=3, stride=1)
@@ -56,6 +59,10 @@ class GDNet(nn.Module):
         self.fc4 = nn.Linear(image_feature_dim + goal_feature_dim, 256)
         self.fc5 = nn.Linear(256, 520)
         self.fc6 = nn.Linear(520, num_actions)
+        if dueling:
+            # state value layers, fc5 and fc6 compute the advantages
+            self.value_fc5 = nn.Linear(256, 520)
+            self.value_fc6 = nn.Linear(520, 1)
 
         # for visualization
         self.attention_weights = None
@@ -111,14 +118,18 @@ class GDNet(nn.Module):
                 # B, C, H, W -> B, C
                 image_features = torch.mean(feature_maps.view(B, self.C, -1), 2)
             else:
-                image_features = feature_maps.view(B, -1)
+                image_features = feature_maps.reshape(B, -1)
             goal_features = goals.view(goals.size(0), -1)
 
         # action classification
         fc_inputs = torch.cat([image_features, goal_features], dim=1)
-        outputs = F.relu(self.fc4(fc_inputs))
-        outputs = F.relu(self.fc5(outputs))
+        features = F.relu(self.fc4(fc_inputs))
+        outputs = F.relu(self.fc5(features))
         outputs = self.fc6(outputs)
+        if self.dueling:
+            # subtract the mean advantage to make state value and advantages identifiable
+            values = self.value_fc6(F.relu(self.value_fc5(features)))
+            outputs = values + outputs - outputs.mean(1, keepdim=True)
         return outputs
 
 
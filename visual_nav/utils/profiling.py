@@ -0,0 +1,164 @@
+"""
+    Low overhead timers and counters of hot paths, shared through the module level profiler
+
+    Functions are timed by decorating them with profiler.timed(name), or by instrumenting methods of objects
+    outside visual_nav like the simulator client, and blocks are timed with profiler.timer(name). Timers only
+    cost a flag check while the profiler is disabled. Timers nest, e.g. env/step includes env/compute_observation,
+    so their times are not meant to be summed up, while a timer entered again inside itself is only counted once.
+"""
+import time
+import logging
+import cProfile
+import functools
+import contextlib
+from collections import defaultdict
+
+import torch
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        # wait for CUDA kernels before stopping timers, otherwise GPU work is attributed to the next synchronization
+        self.cuda_sync = False
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.active = set()
+        self.start_time = time.perf_counter()
+
+    def enable(self, cuda_sync=False):
+        self.enabled = True
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.start_time = time.perf_counter()
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def _call(self, name, function, *args, **kwargs):
+        if not self.enabled or name in self.active:
+            return function(*args, **kwargs)
+        self.active.add(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self.cuda_sync:
+                torch.cuda.synchronize()
+            self.times[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            self.active.discard(name)
+
+    def timed(self, name):
+        """ Decorator timing each call of a function as name """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return self._call(name, function, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """ Context timing a block as name """
+        if not self.enabled or name in self.active:
+            yield
+            return
+        self.active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.cuda_sync:
+                torch.cuda.synchronize()
+            self.times[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            self.active.discard(name)
+
+    def instrument(self, obj, method_names, prefix):
+        """ Time calls of the methods of obj, which shadow its class methods, as prefix/method_name """
+        for method_name in method_names:
+            method = getattr(obj, method_name, None)
+            if method is not None and not hasattr(method, '__profiled__'):
+                wrapper = functools.partial(self._call, '{}/{}'.format(prefix, method_name), method)
+                wrapper.__profiled__ = True
+                setattr(obj, method_name, wrapper)
+
+    def breakdown(self, num_steps):
+        """ Return the time in ms per step of each timer, the calls per step and counters per step since reset """
+        return {name: (self.times[name] * 1000 / num_steps, self.calls[name] / num_steps)
+                for name in sorted(self.times)}, \
+            {name: value / num_steps for name, value in sorted(self.counters.items())}
+
+    def log_breakdown(self, num_steps):
+        """ Log the breakdown of the last num_steps steps, return the scalars to log to TensorBoard and reset """
+        wall_time = (time.perf_counter() - self.start_time) * 1000 / max(num_steps, 1)
+        timers, counters = self.breakdown(max(num_steps, 1))
+        lines = ['Profile of {} steps, {:.3f}ms per step'.format(num_steps, wall_time)]
+        scalars = {'profile/wall_ms_per_step': wall_time}
+        for name, (ms_per_step, calls_per_step) in timers.items():
+            lines.append('    {:<32} {:8.3f}ms per step {:6.1%} {:8.2f} calls per step'.format(
+                name, ms_per_step, ms_per_step / wall_time if wall_time else 0, calls_per_step))
+            scalars['profile/' + name] = ms_per_step
+        for name, value_per_step in counters.items():
+            lines.append('    {:<32} {:8.2f} per step'.format(name, value_per_step))
+            scalars['profile/' + name] = value_per_step
+        logging.info('\n'.join(lines))
+        self.reset()
+        return scalars
+
+
+profiler = Profiler()
+
+
+class ProfileCapture(object):
+    def __init__(self, start_step, end_step, output_file, mode='cprofile'):
+        """
+        Capture a cProfile or torch.profiler profile of the steps in [start_step, end_step),
+        saved as pstats or as a chrome trace in output_file
+        """
+        assert mode in ['cprofile', 'torch']
+        self.start_step = start_step
+        self.end_step = end_step
+        self.output_file = output_file
+        self.mode = mode
+        self.profile = None
+        self.finished = False
+
+    def step(self, step):
+        """ Start or stop the capture depending on the step about to run """
+        if self.finished:
+            return
+        if self.profile is None and self.start_step <= step < self.end_step:
+            logging.info('Start capturing a {} profile at step {}'.format(self.mode, step))
+            if self.mode == 'cprofile':
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+            else:
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self.profile = torch.profiler.profile(activities=activities, record_shapes=True)
+                self.profile.__enter__()
+        elif self.profile is not None and step >= self.end_step:
+            self.stop()
+
+    def stop(self):
+        if self.profile is None:
+            return
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.profile.dump_stats(self.output_file)
+        else:
+            self.profile.__exit__(None, None, None)
+            self.profile.export_chrome_trace(self.output_file)
+        logging.info('Saved the {} profile to {}'.format(self.mode, self.output_file))
+        self.profile = None
+        self.finished = True
@@ -0,0 +1,299 @@
+"""
+    On-disk storage of replay buffer frames
+
+    ArchivedFrames: frames are stored in chunks of consecutive frames, each compressed independently
+    and appended to one binary file, with an index of chunk offsets for random access. Depth frames hold
+    integer values in [0, 255], so they are stored losslessly as uint8 before compression.
+
+    ShardedFrames: frames are stored in fixed-size segment files, so that the replay buffer can grow
+    beyond the physical memory.
+"""
+import os
+import zlib
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+FRAMES_FILE = 'frames.bin'
+INDEX_FILE = 'frames_index.npz'
+SHARDS_INDEX_FILE = 'shards_index.npz'
+
+
+def get_codec(codec, level=None):
+    """ Return compress and decompress functions of codec, zlib is always available """
+    if codec == 'zlib':
+        level = 6 if level is None else level
+        return lambda data: zlib.compress(data, level), zlib.decompress
+    elif codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstandard needs to be installed for zstd codec')
+        level = 3 if level is None else level
+        return zstandard.ZstdCompressor(level=level).compress, zstandard.ZstdDecompressor().decompress
+    elif codec == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError('lz4 needs to be installed for lz4 codec')
+        return lz4.frame.compress, lz4.frame.decompress
+    else:
+        raise NotImplementedError
+
+
+class LRUCache(object):
+    def __init__(self, capacity):
+        """ Least recently used cache holding at most capacity items """
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+    def pop(self, key):
+        return self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+
+def _is_uint8(frames, chunk_size):
+    for start in range(0, len(frames), chunk_size):
+        chunk = frames[start:start + chunk_size]
+        if not np.array_equal(chunk, chunk.astype(np.uint8)):
+            return False
+    return True
+
+
+def save_frames(frames, num_frames, output_dir, chunk_size=32, codec='zlib', level=None):
+    """
+    Save the first num_frames frames of an array into output_dir in compressed chunks
+
+    The index records the full array shape, so that the archive is loaded with the same buffer size.
+    """
+    compress, _ = get_codec(codec, level)
+    stored_dtype = np.uint8 if _is_uint8(frames[:num_frames], chunk_size) else frames.dtype
+    offsets = [0]
+    with open(os.path.join(output_dir, FRAMES_FILE), 'wb') as fo:
+        for start in range(0, num_frames, chunk_size):
+            chunk = np.ascontiguousarray(frames[start:min(start + chunk_size, num_frames)], dtype=stored_dtype)
+            data = compress(chunk.tobytes())
+            fo.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    np.savez(os.path.join(output_dir, INDEX_FILE), offsets=np.array(offsets, dtype=np.int64),
+             shape=np.array(frames.shape, dtype=np.int64), num_frames=num_frames, chunk_size=chunk_size,
+             dtype=str(frames.dtype), stored_dtype=str(np.dtype(stored_dtype)), codec=codec)
+
+
+class ArchivedFrames(object):
+    def __init__(self, input_dir, cache_bytes=1 << 30):
+        """
+        Read-only array-like access to compressed frames saved by save_frames
+
+        Supports integer indexing and contiguous slicing along the first dimension like a numpy array.
+        Decompressed chunks are kept in an LRU cache bounded by cache_bytes. Frames beyond the saved
+        ones are returned as zeros.
+        """
+        index = np.load(os.path.join(input_dir, INDEX_FILE))
+        self.offsets = index['offsets']
+        self.shape = tuple(int(x) for x in index['shape'])
+        self.num_frames = int(index['num_frames'])
+        self.chunk_size = int(index['chunk_size'])
+        self.dtype = np.dtype(str(index['dtype']))
+        self.stored_dtype = np.dtype(str(index['stored_dtype']))
+        _, self.decompress = get_codec(str(index['codec']))
+
+        chunk_bytes = self.chunk_size * int(np.prod(self.shape[1:])) * self.stored_dtype.itemsize
+        self.cache = LRUCache(max(1, cache_bytes // chunk_bytes))
+        self.file = open(os.path.join(input_dir, FRAMES_FILE), 'rb')
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def _read_chunk(self, chunk_index):
+        chunk = self.cache.get(chunk_index)
+        if chunk is None:
+            offset = int(self.offsets[chunk_index])
+            size = int(self.offsets[chunk_index + 1]) - offset
+            if hasattr(os, 'pread'):
+                # pread does not share the file position, so it is safe in dataloader workers
+                data = os.pread(self.file.fileno(), size, offset)
+            else:
+                self.file.seek(offset)
+                data = self.file.read(size)
+            chunk = np.frombuffer(self.decompress(data), dtype=self.stored_dtype).reshape((-1,) + self.shape[1:])
+            self.cache.put(chunk_index, chunk)
+        return chunk
+
+    def _read(self, start, stop):
+        frames = np.zeros((stop - start,) + self.shape[1:], dtype=self.dtype)
+        for chunk_index in range(start // self.chunk_size, (min(stop, self.num_frames) - 1) // self.chunk_size + 1):
+            chunk_start = chunk_index * self.chunk_size
+            chunk = self._read_chunk(chunk_index)
+            begin = max(start, chunk_start)
+            end = min(stop, chunk_start + len(chunk))
+            frames[begin - start:end - start] = chunk[begin - chunk_start:end - chunk_start]
+        return frames
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            assert step == 1
+            return self._read(start, max(start, stop))
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Index {} is out of bounds for {} frames'.format(key, len(self)))
+        return self._read(idx, idx + 1)[0]
+
+    def to_array(self):
+        """ Decompress all frames into a numpy array """
+        return self._read(0, len(self))
+
+    def close(self):
+        self.file.close()
+
+
+class ShardedFrames(object):
+    def __init__(self, directory, shape, dtype=np.float32, segment_size=1024, cache_segments=16,
+                 stored_dtype=np.uint8):
+        """
+        Array-like frames stored in fixed-size segment files in directory
+
+        Frames are returned as dtype and stored as stored_dtype, uint8 by default since depth frames hold integer
+        values in [0, 255], which takes a quarter of the disk and page cache of float32. Segment files record
+        their dtype, so segments written with another stored_dtype are still read correctly.
+
+        Supports integer indexing and contiguous slicing along the first dimension like a numpy array,
+        and assignment of single frames. The segment being written is the only one copied in memory, and is
+        written to disk once writing moves to another segment. Other segments are memory-mapped, so that random
+        reads only load the frames they access, and kept open in an LRU cache holding cache_segments segments.
+        Frames never written are returned as zeros.
+        """
+        self.directory = directory
+        self.shape = tuple(int(x) for x in shape)
+        self.dtype = np.dtype(dtype)
+        self.stored_dtype = np.dtype(stored_dtype)
+        self.segment_size = segment_size
+        self.cache = LRUCache(cache_segments)
+        self.hot_index = None
+        self.hot_segment = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def _segment_file(self, index):
+        return os.path.join(self.directory, 'segment_{:06d}.npy'.format(index))
+
+    def _segment(self, index):
+        if index == self.hot_index:
+            return self.hot_segment
+        segment = self.cache.get(index)
+        if segment is None:
+            segment_file = self._segment_file(index)
+            if os.path.exists(segment_file):
+                segment = np.load(segment_file, mmap_mode='r')
+            else:
+                length = min(self.segment_size, self.shape[0] - index * self.segment_size)
+                segment = np.zeros((length,) + self.shape[1:], dtype=self.stored_dtype)
+            self.cache.put(index, segment)
+        return segment
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            assert step == 1
+            frames = [self._segment(index)[max(start - index * self.segment_size, 0):stop - index * self.segment_size]
+                      for index in range(start // self.segment_size, (stop - 1) // self.segment_size + 1)]
+            if not frames:
+                return np.zeros((0,) + self.shape[1:], dtype=self.dtype)
+            return np.concatenate(frames).astype(self.dtype, copy=False)
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Index {} is out of bounds for {} frames'.format(key, len(self)))
+        return self._segment(idx // self.segment_size)[idx % self.segment_size].astype(self.dtype)
+
+    def __setitem__(self, key, frame):
+        idx = int(key)
+        index = idx // self.segment_size
+        if index != self.hot_index:
+            self.flush()
+            self.hot_segment = np.array(self._segment(index))
+            self.cache.pop(index)
+            self.hot_index = index
+        self.hot_segment[idx % self.segment_size] = frame
+
+    def flush(self):
+        """ Write the segment in memory to disk, through a temporary file to never leave a partial segment """
+        if self.hot_index is None:
+            return
+        segment_file = self._segment_file(self.hot_index)
+        with open(segment_file + '.tmp', 'wb') as fo:
+            np.save(fo, self.hot_segment)
+            # segments are linked into checkpoints, which need them on disk
+            fo.flush()
+            os.fsync(fo.fileno())
+        os.replace(segment_file + '.tmp', segment_file)
+        # the segment is memory-mapped from the new file when read again
+        self.hot_index = None
+        self.hot_segment = None
+
+    def save(self, output_dir):
+        """
+        Save segments into output_dir, as hard links if possible since segment files are never modified in place
+
+        Segment files already in output_dir are deleted first rather than written to, since they can be linked
+        into other checkpoints.
+        """
+        self.flush()
+        os.makedirs(output_dir, exist_ok=True)
+        if os.path.abspath(output_dir) != os.path.abspath(self.directory):
+            segment_files = sorted(file for file in os.listdir(self.directory) if file.endswith('.npy'))
+            for segment_file in os.listdir(output_dir):
+                if segment_file.endswith('.npy'):
+                    os.remove(os.path.join(output_dir, segment_file))
+            for segment_file in segment_files:
+                try:
+                    os.link(os.path.join(self.directory, segment_file), os.path.join(output_dir, segment_file))
+                except OSError:
+                    shutil.copyfile(os.path.join(self.directory, segment_file), os.path.join(output_dir, segment_file))
+        np.savez(os.path.join(output_dir, SHARDS_INDEX_FILE), shape=np.array(self.shape, dtype=np.int64),
+                 dtype=str(self.dtype), stored_dtype=str(self.stored_dtype), segment_size=self.segment_size)
+
+    @classmethod
+    def load(cls, input_dir, cache_segments=16):
+        """ Open frames saved in input_dir, new frames are written into input_dir as well """
+        index = np.load(os.path.join(input_dir, SHARDS_INDEX_FILE))
+        # frames saved before they were stored as uint8 keep their dtype
+        stored_dtype = str(index['stored_dtype']) if 'stored_dtype' in index else str(index['dtype'])
+        return cls(input_dir, index['shape'], str(index['dtype']), int(index['segment_size']), cache_segments,
+                   stored_dtype)
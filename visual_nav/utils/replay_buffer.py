@@ -2,15 +2,42 @@
     This file is copied/apdated from https://github.com/berkeleydeeprlcourse/homework/tree/master/hw3
 """
 import random
+import itertools
 import os
 import shutil
 import logging
+import tempfile
+from collections import deque, namedtuple
 
 from PIL import Image
 import numpy as np
 from torch.utils.data import Dataset
 import torch
 
+from visual_nav.utils.replay_archive import ArchivedFrames, ShardedFrames, save_frames, INDEX_FILE, \
+    SHARDS_INDEX_FILE
+from visual_nav.utils.file_utils import prepare_dir, file_lock
+from visual_nav.utils.profiling import profiler
+
+
+"""
+    Episode stored in the replay buffer, where start is the total number of frames stored before the episode
+"""
+Episode = namedtuple('Episode', ['start', 'length'])
+
+# arrays of a replay buffer other than frames, which are small enough to be saved whole in checkpoints
+STATE_ARRAYS = ['goals', 'action', 'reward', 'done', 'value', 'n_step_return', 'n_step_done', 'n_step_offset',
+                'episode_step']
+CHECKPOINT_STATE_FILE = 'state.npz'
+
+
+def preprocess_frame(frame, image_size):
+    """Resize a single channel frame to `image_size` if needed and transpose it into (img_c, img_h, img_w)."""
+    if frame.shape != image_size:
+        assert frame.shape[2] == 1
+        frame = np.expand_dims(Image.fromarray(frame.squeeze()).resize(image_size[:2]), axis=2)
+    return frame.transpose(2, 0, 1)
+
 
 def sample_n_unique(sampling_f, n):
     """Helper function. Given a function `sampling_f` that returns
@@ -25,7 +52,8 @@ def sample_n_unique(sampling_f, n):
 
 
 class ReplayBuffer(Dataset):
-    def __init__(self, size, frame_history_len, image_size):
+    def __init__(self, size, frame_history_len, image_size, n_step=1, gamma=1.0, storage_dir=None,
+                 segment_size=1024, cache_segments=16, growable=False, grow_size=4096):
         """This is a memory efficient implementation of the replay buffer.
 
         The specific memory optimizations use here are:
@@ -50,13 +78,42 @@ class ReplayBuffer(Dataset):
             overflows the old memories are dropped.
         frame_history_len: int
             Number of memories to be retried for each observation.
+        n_step: int
+            Number of rewards accumulated in the returns of sampled transitions.
+        gamma: float
+            Discount factor between two consecutive transitions.
+        storage_dir: str
+            If given, frames are stored on disk in this directory in segments of `segment_size` frames,
+            with `cache_segments` segments kept in memory, so that the buffer can exceed the physical memory.
+        growable: bool
+            If True, in-memory arrays are allocated for `grow_size` transitions first and enlarged
+            geometrically as data arrives, up to `size`, and saved trimmed to the stored transitions.
+            Use it when `size` is a worst-case bound, e.g. episodes running to the time limit.
+
+        Monte-Carlo values and n-step returns are computed when an episode finishes.
+        Before that, transitions of the ongoing episode are sampled as one-step transitions.
+
+        Finished episodes are kept in an index, which is used to sample whole episodes and split
+        the buffer by episodes. Episodes are evicted from the index once their first frame is overwritten.
         """
         self.size = size
         self.frame_history_len = frame_history_len
         self.image_size = image_size
+        self.n_step = n_step
+        self.gamma = gamma
+        self.storage_dir = storage_dir
+        self.segment_size = segment_size
+        self.cache_segments = cache_segments
+        # sharded frames are only written to disk when stored, so they do not need to grow
+        self.growable = growable and storage_dir is None
+        self.grow_size = grow_size
 
         self.next_idx = 0
         self.num_in_buffer = 0
+        # total number of frames ever stored, used as absolute positions of frames
+        self.num_stored = 0
+        # total number of frames stored at the last snapshot
+        self.num_snapshotted = 0
 
         self.frames = None
         self.goals = None
@@ -64,6 +121,14 @@ class ReplayBuffer(Dataset):
         self.reward = None
         self.done = None
         self.value = None
+        self.n_step_return = None
+        self.n_step_done = None
+        self.n_step_offset = None
+        # position of each frame in its episode
+        self.episode_step = None
+        self.episodes = deque()
+        # absolute position where the ongoing episode starts
+        self.episode_start = None
 
     def __len__(self):
         return self.num_in_buffer
@@ -75,7 +140,7 @@ class ReplayBuffer(Dataset):
         """Returns true if `batch_size` different transitions can be sampled from the buffer."""
         return batch_size + 1 <= self.num_in_buffer
 
-    def _encode_sample(self, idxes, with_value=False):
+    def _encode_sample(self, idxes, with_value=False, with_discount=False):
         frames_batch = []
         goals_batch = []
         for idx in idxes:
@@ -86,27 +151,30 @@ class ReplayBuffer(Dataset):
         goals_batch = np.concatenate(goals_batch, 0)
 
         act_batch = self.action[idxes]
-        rew_batch = self.reward[idxes]
+        rew_batch = self.n_step_return[idxes]
 
+        # observations to bootstrap from, n steps later or at the episode end, or one step later for the ongoing episode
+        next_idxes = (np.asarray(idxes) + self.n_step_offset[idxes]) % self.size
         next_frames_batch = []
         next_goals_batch = []
-        for idx in idxes:
-            next_frames, next_goals = self.encode_observation(idx + 1)
+        for idx in next_idxes:
+            next_frames, next_goals = self.encode_observation(idx)
             next_frames_batch.append(next_frames[np.newaxis, :])
             next_goals_batch.append(next_goals[np.newaxis, :])
         next_frames_batch = np.concatenate(next_frames_batch, 0)
         next_goals_batch = np.concatenate(next_goals_batch, 0)
 
-        done_mask = self.done[idxes]
+        done_mask = self.n_step_done[idxes]
 
-        if not with_value:
-            return frames_batch, goals_batch, act_batch, rew_batch, next_frames_batch, next_goals_batch, done_mask
-        else:
-            value_batch = self.value[idxes]
-            return frames_batch, goals_batch, act_batch, rew_batch, next_frames_batch, next_goals_batch, done_mask, \
-                   value_batch
+        batch = frames_batch, goals_batch, act_batch, rew_batch, next_frames_batch, next_goals_batch, done_mask
+        if with_value:
+            batch += (self.value[idxes],)
+        if with_discount:
+            batch += (np.power(self.gamma, self.n_step_offset[idxes]).astype(np.float32),)
+        return batch
 
-    def sample(self, batch_size, with_value=False):
+    @profiler.timed('replay/sample')
+    def sample(self, batch_size, with_value=False, with_discount=False):
         """Sample `batch_size` different transitions.
 
         i-th sample transition is the following:
@@ -138,11 +206,20 @@ class ReplayBuffer(Dataset):
             and dtype np.uint8
         done_mask: np.array
             Array of shape (batch_size,) and dtype np.float32
+        value_batch: np.array
+            Monte-Carlo values, array of shape (batch_size,) and dtype np.float32, if `with_value`
+        discount_batch: np.array
+            Discount factors of the bootstrapped values, array of shape (batch_size,) and dtype np.float32,
+            if `with_discount`
+
+        With `n_step` > 1, `rew_batch` holds the n-step returns, `next_obs_batch` the observations
+        n steps later, or the last observations of episodes ending within n steps, for which `done_mask` is 1.
         """
         assert self.can_sample(batch_size)
         idxes = sample_n_unique(lambda: random.randint(0, self.num_in_buffer - 2), batch_size)
-        return self._encode_sample(idxes, with_value)
+        return self._encode_sample(idxes, with_value, with_discount)
 
+    @profiler.timed('replay/encode_recent_observation')
     def encode_recent_observation(self):
         """Return the most recent `frame_history_len` frames.
 
@@ -158,14 +235,11 @@ class ReplayBuffer(Dataset):
 
     def encode_observation(self, idx):
         end_idx = idx + 1  # make noninclusive
-        start_idx = end_idx - self.frame_history_len
-        # if there weren't enough frames ever in the buffer for context
-        if start_idx < 0 and self.num_in_buffer != self.size:
-            start_idx = 0
-        for idx in range(start_idx, end_idx - 1):
-            if self.done[idx % self.size]:
-                start_idx = idx + 1
-        missing_context = self.frame_history_len - (end_idx - start_idx)
+        # context frames are bounded by the episode start and by the oldest frame in the buffer
+        oldest_idx = self.next_idx if self.num_in_buffer == self.size else 0
+        num_frames = min(self.frame_history_len, self.episode_step[idx] + 1, (idx - oldest_idx) % self.size + 1)
+        start_idx = end_idx - num_frames
+        missing_context = self.frame_history_len - num_frames
         # if zero padding is needed for missing context
         # or we are on the boundary of the buffer
         if start_idx < 0 or missing_context > 0:
@@ -184,6 +258,7 @@ class ReplayBuffer(Dataset):
 
         return frames, goals
 
+    @profiler.timed('replay/store_observation')
     def store_observation(self, ob):
         """Store a single frame in the buffer at the next available index, overwriting
         old frames if necessary.
@@ -198,34 +273,64 @@ class ReplayBuffer(Dataset):
         idx: int
             Index at which the frame is stored. To be used for `store_effect` later.
         """
-        frame = ob.image
-        if frame.shape != self.image_size:
-            assert frame.shape[2] == 1
-            frame = np.expand_dims(Image.fromarray(frame.squeeze()).resize(self.image_size[:2]), axis=2)
+        frame = preprocess_frame(ob.image, self.image_size)
         goal = ob.goal
 
-        # make sure we are not using low-dimensional observations, such as RAM
-        if len(frame.shape) > 1:
-            # transpose image frame into (img_c, img_h, img_w)
-            frame = frame.transpose(2, 0, 1)
-
         if self.frames is None:
-            self.frames = np.empty([self.size] + list(frame.shape), dtype=np.float32)
-            self.goals = np.empty([self.size, 2], dtype=np.float32)
-            self.action = np.empty([self.size], dtype=np.float32)
-            self.reward = np.empty([self.size], dtype=np.float32)
-            self.done = np.empty([self.size], dtype=np.float32)
-            self.value = np.empty([self.size], dtype=np.float32)
+            self._allocate(frame.shape)
+        elif isinstance(self.frames, ArchivedFrames):
+            # frames loaded from a compressed archive are read-only
+            logging.info('Decompress archived frames to store new frames')
+            self.frames = self.frames.to_array()
+        if self.next_idx >= len(self.action):
+            self._grow()
+
+        # evict episodes whose first frame is overwritten
+        while self.episodes and self.episodes[0].start <= self.num_stored - self.size:
+            self.episodes.popleft()
+        if self.episode_start is None:
+            self.episode_start = self.num_stored
 
         self.frames[self.next_idx] = frame
         self.goals[self.next_idx] = np.array(goal)
+        self.episode_step[self.next_idx] = self.num_stored - self.episode_start
 
         ret = self.next_idx
         self.next_idx = (self.next_idx + 1) % self.size
         self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
+        self.num_stored += 1
 
         return ret
 
+    def _allocate(self, frame_shape):
+        capacity = min(self.size, self.grow_size) if self.growable else self.size
+        if self.storage_dir is None:
+            self.frames = np.empty([capacity] + list(frame_shape), dtype=np.float32)
+        else:
+            self.frames = ShardedFrames(self.storage_dir, [self.size] + list(frame_shape), np.float32,
+                                        self.segment_size, self.cache_segments)
+        self.goals = np.empty([capacity, 2], dtype=np.float32)
+        self.action = np.empty([capacity], dtype=np.float32)
+        self.reward = np.empty([capacity], dtype=np.float32)
+        self.done = np.empty([capacity], dtype=np.float32)
+        self.value = np.empty([capacity], dtype=np.float32)
+        self.n_step_return = np.empty([capacity], dtype=np.float32)
+        self.n_step_done = np.empty([capacity], dtype=np.float32)
+        self.n_step_offset = np.empty([capacity], dtype=np.int32)
+        self.episode_step = np.empty([capacity], dtype=np.int32)
+
+    def _grow(self):
+        """Enlarge the arrays of a growable buffer, at least doubling them so that growing is amortized O(1),
+        but never beyond `size`. The buffer has not wrapped around yet, so stored transitions keep their indices."""
+        capacity = len(self.action)
+        new_capacity = min(self.size, max(2 * capacity, capacity + self.grow_size))
+        logging.debug('Grow the replay buffer from {} to {} transitions'.format(capacity, new_capacity))
+        for name in ['frames'] + STATE_ARRAYS:
+            array = getattr(self, name)
+            grown = np.empty((new_capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:capacity] = array
+            setattr(self, name, grown)
+
     def store_effect(self, idx, action, reward, done):
         """Store effects of action taken after observing frame stored
         at index idx. The reason `store_frame` and `store_effect` is broken
@@ -246,46 +351,397 @@ class ReplayBuffer(Dataset):
         self.action[idx] = action
         self.reward[idx] = reward
         self.done[idx] = done
+        # one-step transition until the episode finishes
+        self.n_step_return[idx] = reward
+        self.n_step_done[idx] = done
+        self.n_step_offset[idx] = 1
+
+        if done:
+            episode = Episode(self.episode_start, int(self.episode_step[idx]) + 1)
+            self.episodes.append(episode)
+            self._finish_episode(self.episode_idxes(episode))
+            self.episode_start = None
+
+    def episode_idxes(self, episode):
+        """Return buffer indices of the frames of an episode."""
+        return (episode.start + np.arange(episode.length)) % self.size
+
+    def sample_episodes(self, num_episodes):
+        """Sample `num_episodes` different finished episodes, returned as arrays of buffer indices."""
+        assert num_episodes <= len(self.episodes)
+        return [self.episode_idxes(self.episodes[i]) for i in random.sample(range(len(self.episodes)), num_episodes)]
+
+    def _finish_episode(self, idxes):
+        """Compute Monte-Carlo values and n-step returns of a finished episode stored at `idxes`."""
+        rewards = self.reward[idxes].astype(np.float64)
+        discounts = np.power(self.gamma, np.arange(len(idxes)), dtype=np.float64)
+        # value[t] = sum_{k >= t} gamma^(k - t) * reward[k]
+        values = np.cumsum((rewards * discounts)[::-1])[::-1] / discounts
+        self.value[idxes] = values
+
+        if self.n_step > 1:
+            # n_step_return[t] = value[t] - gamma^n * value[t + n], where values after the episode end are 0
+            bootstrap_values = np.concatenate([values[self.n_step:], np.zeros(min(self.n_step, len(idxes)))])
+            self.n_step_return[idxes] = values - self.gamma ** self.n_step * bootstrap_values
+            self.n_step_done[idxes] = np.arange(len(idxes)) + self.n_step >= len(idxes)
+            # transitions within n steps of the end bootstrap from the last frame of the episode, which is masked
+            # by n_step_done, since frames after it belong to another episode or are not written yet
+            self.n_step_offset[idxes] = np.minimum(self.n_step, len(idxes) - 1 - np.arange(len(idxes)))
+
+    def _rebuild_episodes(self):
+        """Rebuild the episode index, values and returns from done flags for a loaded buffer,
+        assuming it has not wrapped around."""
+        self.next_idx = self.num_in_buffer % self.size
+        self.num_stored = self.num_in_buffer
+        self.n_step_return = self.reward.copy()
+        self.n_step_done = self.done.copy()
+        self.n_step_offset = np.ones([len(self.reward)], dtype=np.int32)
+
+        episode_ends = np.flatnonzero(self.done[:self.num_in_buffer]) + 1
+        episode_starts = np.concatenate([[0], episode_ends])
+        self.episodes = deque(Episode(int(start), int(end - start)) for start, end in
+                              zip(episode_starts[:-1], episode_ends))
+        for episode in self.episodes:
+            self._finish_episode(self.episode_idxes(episode))
+        # the last episode may be unfinished
+        self.episode_start = int(episode_starts[-1]) if episode_starts[-1] < self.num_in_buffer else None
+
+        self.episode_step = np.zeros([len(self.reward)], dtype=np.int32)
+        lengths = np.diff(np.concatenate([episode_starts, [self.num_in_buffer]]))
+        self.episode_step[:self.num_in_buffer] = np.arange(self.num_in_buffer) - np.repeat(episode_starts, lengths)
 
     def store_value(self, idx, value):
         self.value[idx] = value
 
-    def save(self, output_dir):
-        """ Save experience """
-        if os.path.exists(output_dir):
-            key = input('Replay buffer dir exists. Overwrite(y/n)?')
-            if key == 'y':
-                shutil.rmtree(output_dir)
-            else:
-                return
-            os.mkdir(output_dir)
+    def save(self, output_dir, compress=False, codec='zlib', overwrite='ask'):
+        """
+        Save experience, with frames in compressed chunks if compress is True or in segments if sharded.
+        A growable buffer is saved trimmed to the stored transitions, and is loaded with that size by a fixed one.
+        An existing output_dir is handled by the overwrite policy of prepare_dir, where a kept dir is not saved to,
+        and jobs loading or saving the same dir wait for each other through a lock file beside it.
+        """
+        with file_lock(output_dir):
+            self._save(output_dir, compress, codec, overwrite)
+
+    def _save(self, output_dir, compress, codec, overwrite):
+        sharded = isinstance(self.frames, ShardedFrames)
+        # number of saved transitions, None for the whole arrays
+        num_saved = self.num_in_buffer if self.growable and not sharded else None
+        if sharded and os.path.abspath(output_dir) == os.path.abspath(self.frames.directory):
+            # segments are already stored in output_dir
+            pass
+        elif prepare_dir(output_dir, overwrite, 'Replay buffer dir'):
+            logging.info('Keep the replay buffer in {}'.format(output_dir))
+            return
+
+        if sharded:
+            self.frames.save(output_dir)
+        elif compress:
+            save_frames(self.frames[:num_saved], self.num_in_buffer, output_dir, codec=codec)
         else:
-            os.mkdir(output_dir)
-
-        np.save(os.path.join(output_dir, 'frames'), self.frames)
-        np.save(os.path.join(output_dir, 'goals'), self.goals)
-        np.save(os.path.join(output_dir, 'action'), self.action)
-        np.save(os.path.join(output_dir, 'reward'), self.reward)
-        np.save(os.path.join(output_dir, 'done'), self.done)
-        np.save(os.path.join(output_dir, 'value'), self.value)
+            # slicing also reads archived frames into an array
+            np.save(os.path.join(output_dir, 'frames'), self.frames[:num_saved])
+        np.save(os.path.join(output_dir, 'goals'), self.goals[:num_saved])
+        np.save(os.path.join(output_dir, 'action'), self.action[:num_saved])
+        np.save(os.path.join(output_dir, 'reward'), self.reward[:num_saved])
+        np.save(os.path.join(output_dir, 'done'), self.done[:num_saved])
+        np.save(os.path.join(output_dir, 'value'), self.value[:num_saved])
         with open(os.path.join(output_dir, 'num_in_buffer.txt'), 'w') as fo:
             fo.write(str(self.num_in_buffer))
         logging.info('Saved the replay buffer in {}'.format(output_dir))
 
     def load(self, input_dir):
+        """
+        Load experience, compressed frames are decompressed lazily when accessed.
+        Sharded frames are read from input_dir through the segment cache and new frames are written there.
+        A growable buffer keeps its max size if it is larger than the loaded arrays.
+        """
+        with file_lock(input_dir, shared=True):
+            self._load(input_dir)
+
+    def _load(self, input_dir):
         if not os.path.exists(input_dir):
             raise ValueError('Dir does not exist')
 
-        self.frames = np.load(os.path.join(input_dir, 'frames.npy'))
+        if os.path.exists(os.path.join(input_dir, INDEX_FILE)):
+            self.frames = ArchivedFrames(input_dir)
+        elif os.path.exists(os.path.join(input_dir, SHARDS_INDEX_FILE)):
+            self.frames = ShardedFrames.load(input_dir, self.cache_segments)
+            self.storage_dir = input_dir
+            self.growable = False
+        else:
+            self.frames = np.load(os.path.join(input_dir, 'frames.npy'))
         self.goals = np.load(os.path.join(input_dir, 'goals.npy'))
         self.action = np.load(os.path.join(input_dir, 'action.npy'))
         self.reward = np.load(os.path.join(input_dir, 'reward.npy'))
         self.done = np.load(os.path.join(input_dir, 'done.npy'))
         self.value = np.load(os.path.join(input_dir, 'value.npy'))
+        self.size = max(self.size, len(self.frames)) if self.growable else len(self.frames)
 
         with open(os.path.join(input_dir, 'num_in_buffer.txt'), 'r') as fo:
             self.num_in_buffer = int(fo.read())
             logging.info('The replay buffer loaded in {}'.format(input_dir))
+        self._rebuild_episodes()
+
+    def snapshot(self):
+        """Copy the state of the buffer for `write_snapshot`, with only the frames stored since the last snapshot,
+        so that checkpoints do not rewrite all frames. Sharded frames are flushed and their segments hard-linked
+        into a directory next to the storage directory, which keeps them as of the snapshot since segment files
+        are replaced instead of modified.
+
+        Returns
+        -------
+        snapshot: dict
+            Arrays to be written by `write_snapshot`, possibly in another thread.
+        """
+        snapshot = {'meta': np.array([self.size, self.next_idx, self.num_in_buffer, self.num_stored,
+                                      -1 if self.episode_start is None else self.episode_start], dtype=np.int64),
+                    'episodes': np.array(self.episodes, dtype=np.int64).reshape(-1, 2),
+                    'frames_start': max(self.num_snapshotted, self.num_stored - self.size),
+                    'frames': None}
+        if self.frames is None:
+            return snapshot
+        for name in STATE_ARRAYS:
+            snapshot[name] = getattr(self, name).copy()
+        if isinstance(self.frames, ShardedFrames):
+            storage_parent = os.path.dirname(os.path.abspath(self.frames.directory))
+            shards_dir = tempfile.mkdtemp(prefix='.snapshot_', dir=storage_parent)
+            self.frames.save(shards_dir)
+            snapshot['storage_dir'] = self.frames.directory
+            snapshot['shards_dir'] = shards_dir
+        else:
+            # new frames are contiguous in the ring, except when they wrap around its end
+            start = snapshot['frames_start'] % self.size
+            end = start + self.num_stored - snapshot['frames_start']
+            frames = [self.frames[start:min(end, self.size)]]
+            if end > self.size:
+                frames.append(self.frames[:end - self.size])
+            snapshot['frames'] = np.concatenate(frames)
+        self.num_snapshotted = self.num_stored
+        return snapshot
+
+    @staticmethod
+    def write_snapshot(snapshot, output_dir):
+        """Write a snapshot incrementally into output_dir: new frames go to a new chunk file, the other arrays
+        replace the state file atomically, and chunks of frames overwritten in the buffer are deleted. Files are
+        synced to disk before the state file refers to them."""
+        os.makedirs(output_dir, exist_ok=True)
+        size, num_stored = snapshot['meta'][0], snapshot['meta'][3]
+        if snapshot['frames'] is not None and len(snapshot['frames']):
+            start = snapshot['frames_start']
+            end = start + len(snapshot['frames'])
+            _write_synced(os.path.join(output_dir, 'frames_{:012d}_{:012d}.npy'.format(start, end)),
+                          lambda fo: np.save(fo, snapshot['frames']))
+        state = {name: value for name, value in snapshot.items()
+                 if name not in ['frames', 'frames_start', 'shards_dir']}
+        shards = None
+        if 'shards_dir' in snapshot:
+            shards = 'shards_{:012d}'.format(num_stored)
+            if os.path.exists(os.path.join(output_dir, shards)):
+                # frames did not change since the last snapshot
+                shutil.rmtree(snapshot['shards_dir'])
+            else:
+                shutil.move(snapshot['shards_dir'], os.path.join(output_dir, shards))
+            state['shards'] = shards
+        state_file = os.path.join(output_dir, CHECKPOINT_STATE_FILE)
+        _write_synced(state_file, lambda fo: np.savez(fo, **state))
+        for start, end, chunk_file in _frame_chunks(output_dir):
+            if end <= num_stored - size or start >= num_stored:
+                os.remove(chunk_file)
+        for file_name in os.listdir(output_dir):
+            if file_name.startswith('shards_') and file_name != shards:
+                shutil.rmtree(os.path.join(output_dir, file_name))
+
+    def restore(self, input_dir):
+        """Restore the buffer from snapshots written into input_dir."""
+        with np.load(os.path.join(input_dir, CHECKPOINT_STATE_FILE)) as state:
+            self.size, self.next_idx, self.num_in_buffer, self.num_stored, episode_start = [int(x) for x in
+                                                                                            state['meta']]
+            self.episode_start = None if episode_start < 0 else episode_start
+            self.episodes = deque(Episode(int(start), int(length)) for start, length in state['episodes'])
+            for name in STATE_ARRAYS:
+                if name in state:
+                    setattr(self, name, state[name])
+            storage_dir = str(state['storage_dir']) if 'storage_dir' in state else None
+            shards = str(state['shards']) if 'shards' in state else None
+        self.num_snapshotted = self.num_stored
+        if self.action is None:
+            return
+
+        frame_shape = (self.image_size[2], self.image_size[0], self.image_size[1])
+        if shards is not None:
+            # segments written after the snapshot are replaced by the ones of the snapshot
+            self.storage_dir = storage_dir if self.storage_dir is None else self.storage_dir
+            ShardedFrames.load(os.path.join(input_dir, shards), self.cache_segments).save(self.storage_dir)
+            self.frames = ShardedFrames.load(self.storage_dir, self.cache_segments)
+            logging.info('The replay buffer restored from {}'.format(input_dir))
+            return
+        if storage_dir is not None:
+            # snapshots written before segments were copied into them
+            self.storage_dir = storage_dir
+            self.frames = ShardedFrames(storage_dir, (self.size,) + frame_shape, np.float32, self.segment_size,
+                                        self.cache_segments)
+            return
+        self.frames = np.zeros((len(self.action),) + frame_shape, dtype=np.float32)
+        for start, end, chunk_file in _frame_chunks(input_dir):
+            # only frames which are still in the buffer
+            first, last = max(start, self.num_stored - self.size), min(end, self.num_stored)
+            if first < last:
+                chunk = np.load(chunk_file, mmap_mode='r')
+                self.frames[np.arange(first, last) % self.size] = chunk[first - start:last - start]
+        logging.info('The replay buffer restored from {}'.format(input_dir))
+
+
+def _write_synced(path, write):
+    """Write path with write(file) into a temporary file which is synced to disk before being renamed, like
+    `CheckpointWriter`, so that a crash leaves either the previous or the complete new file."""
+    with open(path + '.tmp', 'wb') as fo:
+        write(fo)
+        fo.flush()
+        os.fsync(fo.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _frame_chunks(directory):
+    """Return (start, end, file) of the frame chunks written by `ReplayBuffer.write_snapshot` in directory."""
+    chunks = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.startswith('frames_') and file_name.endswith('.npy'):
+            start, end = file_name[len('frames_'):-len('.npy')].split('_')
+            chunks.append((int(start), int(end), os.path.join(directory, file_name)))
+    return chunks
+
+
+class SumTree(object):
+    def __init__(self, capacity):
+        """Array-backed binary tree where each inner node stores the sum of its children.
+
+        Leaves are padded to a power of two so that every leaf has the same depth, which allows
+        updating and searching a batch of leaves level by level with vectorized numpy operations.
+        Both take O(log n) per leaf.
+
+        Parameters
+        ----------
+        capacity: int
+            Number of leaves to store.
+        """
+        self.capacity = 1
+        self.depth = 0
+        while self.capacity < capacity:
+            self.capacity *= 2
+            self.depth += 1
+        self.tree = np.zeros(2 * self.capacity - 1, dtype=np.float64)
+
+    def total(self):
+        return self.tree[0]
+
+    def get(self, idxes):
+        return self.tree[np.asarray(idxes) + self.capacity - 1]
+
+    def update(self, idxes, values):
+        """Set the values of leaves `idxes` and recompute the sums of their ancestors."""
+        nodes = np.asarray(idxes, dtype=np.int64) + self.capacity - 1
+        self.tree[nodes] = values
+        for _ in range(self.depth):
+            nodes = np.unique((nodes - 1) // 2)
+            self.tree[nodes] = self.tree[2 * nodes + 1] + self.tree[2 * nodes + 2]
+
+    def find(self, prefix_sums):
+        """Return for each prefix sum the index of the leaf whose cumulative interval contains it."""
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.zeros(len(prefix_sums), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes + 1
+            go_right = prefix_sums >= self.tree[left]
+            prefix_sums -= self.tree[left] * go_right
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - (self.capacity - 1)
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(self, size, frame_history_len, image_size, n_step=1, gamma=1.0, storage_dir=None, growable=False,
+                 alpha=0.6, epsilon=1e-6):
+        """Replay buffer sampling transitions proportionally to their priorities, see
+        https://arxiv.org/abs/1511.05952
+
+        Priorities are stored in a sum tree indexed like the ring buffer. New transitions get the
+        max priority seen so far, so that they are sampled at least once.
+
+        Parameters
+        ----------
+        alpha: float
+            How much prioritization is used, 0 corresponds to uniform sampling.
+        epsilon: float
+            Small constant added to the TD errors to keep every transition sampleable.
+        """
+        super().__init__(size, frame_history_len, image_size, n_step, gamma, storage_dir, growable=growable)
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.sum_tree = SumTree(size)
+
+    @profiler.timed('replay/store_observation')
+    def store_observation(self, ob):
+        idx = super().store_observation(ob)
+        # the transition at idx can not be sampled before its next frame is stored,
+        # while storing this frame completes the previous transition
+        if self.num_in_buffer > 1:
+            self.sum_tree.update([idx, (idx - 1) % self.size], [0, self.max_priority ** self.alpha])
+        else:
+            self.sum_tree.update([idx], [0])
+        return idx
+
+    @profiler.timed('replay/sample')
+    def sample(self, batch_size, beta=0.4, with_value=False, with_discount=False):
+        """Sample `batch_size` transitions with probability proportional to their priorities.
+
+        Returns the same batch as `ReplayBuffer.sample`, followed by
+
+        weights: np.array
+            Importance-sampling weights normalized by their max value, array of shape (batch_size,)
+            and dtype np.float32
+        idxes: np.array
+            Indices of the sampled transitions, to be passed to `update_priorities`
+        """
+        assert self.can_sample(batch_size)
+        total = self.sum_tree.total()
+        # stratified sampling, one transition from each segment of the cumulative priorities
+        prefix_sums = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * total / batch_size
+        idxes = self.sum_tree.find(prefix_sums)
+        priorities = self.sum_tree.get(idxes)
+        # resample the rare transitions with zero priority hit because of floating point errors
+        while np.any(priorities <= 0):
+            invalid = priorities <= 0
+            idxes[invalid] = self.sum_tree.find(np.random.uniform(0, total, size=np.sum(invalid)))
+            priorities = self.sum_tree.get(idxes)
+
+        weights = (self.num_in_buffer * priorities / total) ** -beta
+        weights /= weights.max()
+        return self._encode_sample(idxes, with_value, with_discount) + (weights.astype(np.float32), idxes)
+
+    def update_priorities(self, idxes, td_errors):
+        """Update priorities of sampled transitions in batch with their absolute TD errors."""
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.sum_tree.update(idxes, priorities ** self.alpha)
+
+    def load(self, input_dir):
+        super().load(input_dir)
+        self.sum_tree = SumTree(self.size)
+        self.sum_tree.update(np.arange(self.num_in_buffer - 1), self.max_priority ** self.alpha)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['priorities'] = self.sum_tree.get(np.arange(self.size))
+        snapshot['max_priority'] = self.max_priority
+        return snapshot
+
+    def restore(self, input_dir):
+        super().restore(input_dir)
+        with np.load(os.path.join(input_dir, CHECKPOINT_STATE_FILE)) as state:
+            self.sum_tree = SumTree(self.size)
+            self.sum_tree.update(np.arange(self.size), state['priorities'])
+            self.max_priority = float(state['max_priority'])
 
 
 class BufferWrapper(Dataset):
@@ -293,16 +749,20 @@ class BufferWrapper(Dataset):
         self.replay_buffer = replay_buffer
         self.split = split
 
-        # percentage range for different splits:
-        split_percentages = {'train': (0, 0.7), 'val': (0.7, 0.8), 'test': (0.8, 1)}
-        self.start_index = int(len(self.replay_buffer) * split_percentages[split][0])
-        self.end_index = int(len(self.replay_buffer) * split_percentages[split][1])
+        # percentage range of episodes for different splits, so that no episode is cut across splits
+        split_percentages = {'train': (0, 0.7), 'val': (0.7, 0.8), 'test': (0.8, 1), 'all': (0, 1)}
+        num_episodes = len(self.replay_buffer.episodes)
+        start_episode = int(num_episodes * split_percentages[split][0])
+        end_episode = int(num_episodes * split_percentages[split][1])
+        episodes = itertools.islice(self.replay_buffer.episodes, start_episode, end_episode)
+        self.idxes = np.concatenate([self.replay_buffer.episode_idxes(episode) for episode in episodes] +
+                                    [np.zeros(0, dtype=np.int64)])
 
     def __len__(self):
-        return self.end_index - self.start_index
+        return len(self.idxes)
 
     def __getitem__(self, idx):
-        buffer_idx = self.start_index + idx
+        buffer_idx = self.idxes[idx]
         if self.replay_buffer.frame_history_len == 1:
             frames = self.replay_buffer.frames[buffer_idx]
             goals = self.replay_buffer.goals[buffer_idx]
@@ -0,0 +1,117 @@
+"""
+    Results of training runs, recorded by main.py in the metrics.jsonl of their output directories,
+    or parsed from output.log for runs before structured records
+"""
+import os
+import re
+import json
+import time
+import logging
+from collections import namedtuple
+
+METRICS_FILE = 'metrics.jsonl'
+
+EpochLog = namedtuple('EpochLog', ['epoch', 'train_loss', 'train_acc', 'val_loss', 'val_acc'])
+TestLog = namedtuple('TestLog', ['best_val_acc', 'test_loss', 'test_acc'])
+
+EPOCH_PATTERN = r"Epoch (?P<epoch>\d+).*\n" \
+                r".*train Loss: (?P<train_loss>\d+.\d+) Acc: (?P<train_acc>0.\d+).*\n" \
+                r".*val Loss: (?P<val_loss>\d+.\d+) Acc: (?P<val_acc>0.\d+).*"
+TEST_PATTERN = r"Best val Acc: (?P<best_val_acc>[0-1].\d+).*\n" \
+               r".*test Loss: (?P<test_loss>\d+.\d+) Acc: (?P<test_acc>0.\d+)"
+
+
+def parse_output_log(output_dir):
+    """ Return the imitation learning epoch logs of the run in output_dir and its test log, None if not finished """
+    with open(os.path.join(output_dir, 'output.log'), 'r') as fo:
+        log = fo.read()
+    epoch_logs = [EpochLog(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]))
+                  for r in re.findall(EPOCH_PATTERN, log)]
+    test_log = re.findall(TEST_PATTERN, log)
+    test_log = TestLog(*(float(value) for value in test_log[0])) if test_log else None
+    return epoch_logs, test_log
+
+
+class RunRecorder(object):
+    def __init__(self, output_dir):
+        """
+        Append structured records of a run to metrics.jsonl in output_dir, one json object per line with its kind
+        and time, so that reports neither depend on the format of output.log nor need to parse all of it
+        """
+        self.metrics_file = os.path.join(output_dir, METRICS_FILE)
+        self.file = None
+
+    def record(self, kind, **values):
+        if self.file is None:
+            self.file = open(self.metrics_file, 'a')
+        # numpy scalars are not serializable by json
+        self.file.write(json.dumps(dict(kind=kind, time=time.time(), **values), default=float) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_records(metrics_file, offset=0):
+    """
+    Stream the records of metrics_file from byte offset, yielding each record with the offset following it
+    A last line still being written is left for the next read, and malformed lines are yielded as None records
+    with a warning, so that offsets cached by the caller move past them.
+    """
+    with open(metrics_file, 'rb') as fo:
+        fo.seek(offset)
+        for line in fo:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                logging.warning('Skip malformed record before byte {} of {}'.format(offset, metrics_file))
+                record = None
+            yield record, offset
+
+
+def summarize_run(output_dir, cached=None):
+    """
+    Summarize the run in output_dir as a json serializable dict with its imitation learning epochs and test,
+    and its last reinforcement learning progress and evaluation, or None if it has no log.
+    A cached summary of the same metrics file is updated with the records appended since.
+    """
+    metrics_file = os.path.join(output_dir, METRICS_FILE)
+    if not os.path.exists(metrics_file):
+        log_file = os.path.join(output_dir, 'output.log')
+        if not os.path.exists(log_file):
+            return None
+        stat = os.stat(log_file)
+        if cached is not None and cached['source'] == 'output.log' and cached['size'] == stat.st_size and \
+                cached['mtime'] == stat.st_mtime:
+            return cached
+        epoch_logs, test_log = parse_output_log(output_dir)
+        return {'source': 'output.log', 'size': stat.st_size, 'mtime': stat.st_mtime,
+                'epochs': [list(epoch_log) for epoch_log in epoch_logs],
+                'test': test_log._asdict() if test_log else None, 'rl': None, 'evaluation': None}
+
+    stat = os.stat(metrics_file)
+    if cached is None or cached['source'] != METRICS_FILE or cached['inode'] != stat.st_ino or \
+            cached['offset'] > stat.st_size:
+        summary = {'source': METRICS_FILE, 'inode': stat.st_ino, 'offset': 0, 'epochs': [], 'test': None, 'rl': None,
+                   'evaluation': None}
+    else:
+        summary = dict(cached, epochs=list(cached['epochs']))
+    for record, offset in read_records(metrics_file, summary['offset']):
+        summary['offset'] = offset
+        if record is None:
+            continue
+        kind = record['kind']
+        if kind == 'il_epoch':
+            summary['epochs'].append([record[field] for field in EpochLog._fields])
+        elif kind == 'il_test':
+            summary['test'] = {field: record[field] for field in TestLog._fields}
+        elif kind == 'rl_progress':
+            summary['rl'] = record
+        elif kind == 'evaluation':
+            summary['evaluation'] = record
+    return summary
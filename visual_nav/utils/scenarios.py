@@ -0,0 +1,58 @@
+"""
+    Cache of test scenarios, so that policies are evaluated on identical initial conditions and human trajectories
+"""
+import os
+import logging
+
+import numpy as np
+
+
+def record_scenarios(env, num_scenarios, seed=0, num_steps=None):
+    """
+    Record num_scenarios scenarios with the robot standing still, for num_steps steps which default to the
+    time limit. Episodes are not cut when the robot is hit, since only human trajectories are recorded.
+    """
+    from visual_sim.envs.visual_sim import Scenario
+    env = env.unwrapped
+    num_steps = int(env.max_time / env.time_step) if num_steps is None else num_steps
+    scenarios = []
+    for i in range(num_scenarios):
+        np.random.seed(seed + i)
+        env.scenario = None
+        env.reset()
+        human_poses = [env.get_human_poses()]
+        for _ in range(num_steps):
+            # the first action does not move the robot
+            env.step(0)
+            human_poses.append(env.get_human_poses())
+        scenarios.append(Scenario(env.goal_distance, np.array(human_poses, dtype=np.float32)))
+        logging.info('Recorded scenario {} with goal distance {:.2f}'.format(i, env.goal_distance))
+    return scenarios
+
+
+def save_scenarios(path, scenarios):
+    np.savez_compressed(path, goal_distance=np.array([scenario.goal_distance for scenario in scenarios]),
+                        human_poses=np.stack([scenario.human_poses for scenario in scenarios]))
+
+
+def load_scenarios(path):
+    from visual_sim.envs.visual_sim import Scenario
+    with np.load(path) as data:
+        return [Scenario(float(goal_distance), human_poses)
+                for goal_distance, human_poses in zip(data['goal_distance'], data['human_poses'])]
+
+
+def get_scenarios(path, env_fn, num_scenarios, seed=0):
+    """ Load scenarios cached in path, or record them in env_fn(0) and cache them if there are not enough """
+    if not path.endswith('.npz'):
+        path += '.npz'
+    if os.path.exists(path):
+        scenarios = load_scenarios(path)
+        if len(scenarios) >= num_scenarios:
+            logging.info('Loaded {} scenarios from {}'.format(num_scenarios, path))
+            return scenarios[:num_scenarios]
+        logging.info('Only {} scenarios cached in {}, record {} scenarios'.format(len(scenarios), path,
+                                                                                  num_scenarios))
+    scenarios = record_scenarios(env_fn(0), num_scenarios, seed)
+    save_scenarios(path, scenarios)
+    return scenarios
@@ -0,0 +1,126 @@
+import logging
+import contextlib
+
+import torch
+
+
+def inference_mode(enabled=True):
+    """ Disable autograd for target and evaluation forward passes, torch.inference_mode when available """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode(enabled)
+    return torch.set_grad_enabled(not enabled)
+
+
+def autocast(device, enabled=True):
+    """ bfloat16 autocast for forward passes on device, no-op if disabled or not supported by torch """
+    if enabled and hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def _foreach_copy(targets, sources):
+    if not targets:
+        return
+    if hasattr(torch, '_foreach_copy_'):
+        torch._foreach_copy_(targets, sources)
+    else:
+        for target, source in zip(targets, sources):
+            target.copy_(source)
+
+
+def update_target_model(target_model, model, tau=1.0):
+    """
+    Update target model in place with fused foreach ops, without building state dicts
+
+    target = tau * model + (1 - tau) * target for parameters, where tau=1 is a hard copy.
+    Buffers are always copied.
+    """
+    if not 0 < tau <= 1:
+        raise ValueError('tau should be in (0, 1], got {}'.format(tau))
+    with torch.no_grad():
+        target_params = list(target_model.parameters())
+        params = list(model.parameters())
+        if tau >= 1:
+            _foreach_copy(target_params, params)
+        elif hasattr(torch, '_foreach_lerp_'):
+            torch._foreach_lerp_(target_params, params, tau)
+        else:
+            torch._foreach_mul_(target_params, 1 - tau)
+            torch._foreach_add_(target_params, params, alpha=tau)
+        _foreach_copy(list(target_model.buffers()), list(model.buffers()))
+
+
+def snapshot_state(state):
+    """ Copy tensors in a nested state (dicts, lists and tuples) to CPU, so that it can be written in the background
+    while training modifies the original tensors """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return type(state)((key, snapshot_state(value)) for key, value in state.items())
+    elif isinstance(state, (list, tuple)):
+        return type(state)(snapshot_state(value) for value in state)
+    return state
+
+
+def load_checkpoint(checkpoint_file, map_location=None):
+    """ torch.load of a checkpoint holding numpy arrays and python objects besides tensors """
+    try:
+        return torch.load(checkpoint_file, map_location=map_location, weights_only=False)
+    except TypeError:
+        # torch before 1.13 has no weights_only and loads any object
+        return torch.load(checkpoint_file, map_location=map_location)
+
+
+def to_channels_last(frames):
+    """ Convert a batch of frames (B, C, H, W) into channels_last memory format """
+    return frames.contiguous(memory_format=torch.channels_last)
+
+
+class CompiledModel(object):
+    def __init__(self, model, compiled):
+        """
+        Forward callable of a compiled model, which falls back to the eager model if compilation fails.
+        torch.compile is lazy, so compilation errors only show up in the first forward pass. Errors of later
+        passes, e.g. running out of memory, are raised instead of silently disabling compilation.
+        """
+        self.model = model
+        self.compiled = compiled
+        self.ran = False
+
+    def __call__(self, *args):
+        if self.compiled is None:
+            return self.model(*args)
+        if self.ran:
+            return self.compiled(*args)
+        try:
+            output = self.compiled(*args)
+        except Exception as e:
+            logging.warning('Fail to run compiled {}: {}. Use eager mode instead'.format(
+                self.model.__class__.__name__, e))
+            self.compiled = None
+            return self.model(*args)
+        self.ran = True
+        return output
+
+
+def accelerate_model(model, channels_last=True, compile_model=True):
+    """
+    Convert the model into channels_last memory format in place and return its compiled forward callable.
+
+    The original module should still be used for state_dict, optimizer and attention weights,
+    so that checkpoints stay compatible with eager models.
+    """
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    if not compile_model:
+        return model
+    if not hasattr(torch, 'compile'):
+        logging.warning('torch.compile is not available in torch {}. Use eager mode instead'.format(
+            torch.__version__))
+        return model
+    try:
+        compiled = torch.compile(model)
+    except Exception as e:
+        logging.warning('Fail to compile {}: {}. Use eager mode instead'.format(model.__class__.__name__, e))
+        return model
+    return CompiledModel(model, compiled)
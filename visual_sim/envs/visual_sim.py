@@ -14,6 +14,11 @@ from numpy.linalg import norm
 
 Goal = namedtuple('Goal', ['r', 'phi'])
 Observation = namedtuple('Observation', ['image', 'goal'])
+"""
+    Initial conditions and human trajectories of an episode to be replayed, where human_poses is an array of
+    shape (num_steps + 1, human_num, 4) holding x, y, z and yaw of humans after each step
+"""
+Scenario = namedtuple('Scenario', ['goal_distance', 'human_poses'])
 
 ImageType = namedtuple('ImageType', ['index', 'as_float', 'channel_size'])
 
@@ -41,14 +46,16 @@ class VisualSim(Env):
       SurfaceNormals = 6,
       Infrared = 7
     """
-    def __init__(self, image_type='DepthPerspective', reward_shaping=False, curriculum_learning=False):
+    def __init__(self, image_type='DepthPerspective', reward_shaping=False, curriculum_learning=False, ip='',
+                 port=41451):
         self.robot_dynamics = False
         self.blocking = True
         self.time_step = 0.25
         self.clock_speed = 10
         self.time = 0
         self.initial_position = np.array((0, 0, -1))
-        self.goal_distance = 6
+        self.default_goal_distance = 6
+        self.goal_distance = self.default_goal_distance
         self.goal_position = np.array((self.goal_distance, 0, -1))
 
         # rewards
@@ -81,17 +88,22 @@ class VisualSim(Env):
         self.observation_space = Box(low=0, high=255, shape=(84, 84, ImageInfo[image_type].channel_size))
         self.fov = np.pi / 2
 
+        # address of the simulator, one per environment when several run in parallel
+        self.ip = ip
+        self.port = port
         self.client = None
+        # scenario replayed from the next reset, None to let humans move freely
+        self.scenario = None
 
     def reset(self):
         # connect with server
         if self.client is None:
             if self.robot_dynamics:
-                client = airsim.CarClient()
+                client = airsim.CarClient(self.ip, self.port)
                 client.enableApiControl(True)
                 client.confirmConnection()
             else:
-                client = airsim.VehicleClient()
+                client = airsim.VehicleClient(self.ip, self.port)
             self.client = client
             if self.blocking:
                 self.client.simPause(True)
@@ -100,15 +112,21 @@ class VisualSim(Env):
         self.human_states = defaultdict(list)
         self.robot_states = list()
 
-        if self.curriculum_learning:
+        if self.scenario is not None:
+            self.goal_distance = self.scenario.goal_distance
+        elif self.curriculum_learning:
             self.goal_distance = np.random.uniform(2, 4)
-            self.goal_position = np.array((self.goal_distance, 0, -1))
+        else:
+            self.goal_distance = self.default_goal_distance
+        self.goal_position = np.array((self.goal_distance, 0, -1))
 
         if self.robot_dynamics:
             self.client.reset()
         else:
             self.client.reset()
             self. _move(self.initial_position, 0)
+        if self.scenario is not None:
+            self._move_humans(0)
 
         self._update_states()
         obs = self.compute_observation()
@@ -151,6 +169,9 @@ class VisualSim(Env):
                 while not self.client.simIsPause():
                     time.sleep(0.001)
         self.time += self.time_step
+        if self.scenario is not None:
+            # one pose is recorded after each step, in addition to the initial pose
+            self._move_humans(len(self.robot_states))
         self._update_states()
 
         past_pose = pose
@@ -198,6 +219,19 @@ class VisualSim(Env):
         self.client.simSetVehiclePose(airsim.Pose(airsim.Vector3r(float(pos[0]), float(pos[1]), float(pos[2])),
                                                   airsim.to_quaternion(0, 0, yaw)), True)
 
+    def _move_humans(self, step):
+        """ Move humans to their poses in the replayed scenario after step, or the last ones if it is shorter """
+        poses = self.scenario.human_poses[min(step, len(self.scenario.human_poses) - 1)]
+        for i, (x, y, z, yaw) in enumerate(poses):
+            self.client.simSetObjectPose('Human' + str(i), airsim.Pose(airsim.Vector3r(float(x), float(y), float(z)),
+                                                                       airsim.to_quaternion(0, 0, float(yaw))), True)
+
+    def get_human_poses(self):
+        """ Return the current x, y, z and yaw of humans as an array of shape (human_num, 4) """
+        poses = [self.human_states[i][-1] for i in range(self.human_num)]
+        return np.array([(pose.position.x_val, pose.position.y_val, pose.position.z_val,
+                          airsim.to_eularian_angles(pose.orientation)[2]) for pose in poses])
+
     def compute_observation(self):
         # retrieve visual observation
         image_type = ImageInfo[self.image_type]
@@ -205,13 +239,13 @@ class VisualSim(Env):
         response = responses[0]
 
         if image_type.as_float:
-            img1d = np.array(response.image_data_float, dtype=np.float)
+            img1d = np.array(response.image_data_float, dtype=float)
             img1d = 255 / np.maximum(np.ones(img1d.size), img1d)
             img2d = np.reshape(img1d, (response.height, response.width))
             image = np.expand_dims(Image.fromarray(img2d).convert('L'), axis=2)
         else:
             # get numpy array
-            img1d = np.fromstring(response.image_data_uint8, dtype=np.uint8)
+            img1d = np.frombuffer(response.image_data_uint8, dtype=np.uint8).copy()
             image = img1d.reshape(response.height, response.width, image_type.channel_size)
             image = np.ascontiguousarray(image, dtype=np.uint8)
 